@@ -0,0 +1,418 @@
+"""猫仔文本分割器 性能测试
+用法：python 猫仔分割器性能测试.py [--sizes 1 10 100]
+生成指定大小（MB）的测试文本，测量边界索引的构建和查找耗时，检查是否随文件大小线性增长；
+并对比文本规范化与旧版逐段 re.sub 实现的耗时，确认输出一致；最后测量万章小说的章节索引耗时。
+
+回归测试：python 猫仔分割器性能测试.py --suite [--size-mb 5] [--huge] [--save-baseline]
+在生成的语料（纯中文、纯英文、中英混排、无标点、万个小章节，--huge 时另加 1GB 单文件）上
+分别测量三种分块模式、边界索引、章节识别和文本规范化的耗时、峰值内存和 tokens/秒。
+每项在独立子进程中运行，峰值内存互不影响。--save-baseline 把结果存为基准，
+之后的运行与基准对比，耗时或峰值内存超出容差（--tolerance）即判为回归，退出码为 1。
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from typing import List
+
+import 猫仔文本分割器 as splitter
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，峰值内存改用 GetProcessMemoryInfo 读取
+    resource = None
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "猫仔分割器性能基准.json")
+
+
+def generate_text(size_mb: int, seed: int = 42) -> str:
+    """生成约 size_mb MB（UTF-8）的中英混排文本：先随机生成 1MB 样本块，再平铺到目标大小"""
+    rng = random.Random(seed)
+    cjk = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳"
+    words = ["the", "cat", "sat", "on", "a", "mat", "quickly", "Mr.", "U.S.", "e.g."]
+    parts = []
+    size = 0
+    while size < 1024 * 1024:
+        sentence = "".join(rng.choice(cjk) for _ in range(rng.randint(8, 60)))
+        english = " ".join(rng.choice(words) for _ in range(rng.randint(3, 15)))
+        para = f"{sentence}。{english.capitalize()}. 他说：“好！”\n\n"
+        parts.append(para)
+        size += len(para.encode("utf-8"))
+    block = "".join(parts)
+    return block * size_mb
+
+
+def bench_boundaries(size_mb: int, chunk_chars: int = 5000):
+    text = generate_text(size_mb)
+    start = time.perf_counter()
+    boundaries = splitter.find_sentence_boundaries(text)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pos = 0
+    lookups = 0
+    while pos < len(text):
+        end = splitter.find_optimal_boundary(text, pos + chunk_chars, boundaries, min_pos=pos)
+        boundaries.next(end)
+        pos = end
+        lookups += 1
+    lookup_time = time.perf_counter() - start
+    return len(boundaries), lookups, build_time, lookup_time
+
+
+def legacy_preserve_formatting(text: str) -> str:
+    """旧版实现：逐段依次执行四条 re.sub，作为规范化的对照"""
+    paragraphs = re.split(r'(\n\s*\n)', text)
+    cleaned_paragraphs = []
+    for para in paragraphs:
+        if not para.strip():
+            continue
+        para = re.sub(r'[ \t]+', ' ', para)
+        para = re.sub(r'([。！？.!?,;:；，：、])\s+', r'\1', para)
+        para = re.sub(r'\s+([）】」』、。，！？；："\'])', r'\1', para)
+        para = re.sub(r'([\(（【「『])\s+', r'\1', para)
+        cleaned_paragraphs.append(para.strip())
+    return '\n\n'.join([p for p in cleaned_paragraphs if p])
+
+
+def bench_normalizer(size_mb: int):
+    text = generate_text(size_mb).replace("。", "。 ").replace("\n\n", " \n\t\n")
+    start = time.perf_counter()
+    expected = legacy_preserve_formatting(text)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = splitter.preserve_formatting(text)
+    new_time = time.perf_counter() - start
+    if result != expected:
+        raise AssertionError("规范化结果与旧版实现不一致")
+    return legacy_time, new_time
+
+
+def bench_chapters(n_chapters: int = 10000, chapter_chars: int = 3000):
+    """生成 n_chapters 章的网文式文本，返回 (章节数, 字符数, 建索引耗时)"""
+    body = generate_text(1)
+    parts = []
+    for i in range(n_chapters):
+        offset = (i * 7919) % (len(body) - chapter_chars)
+        parts.append(f"第{i + 1}章 标题{i + 1}\n\n{body[offset:offset + chapter_chars]}\n")
+    text = "".join(parts)
+    start = time.perf_counter()
+    index = splitter.build_chapter_index(text)
+    return len(index), len(text), time.perf_counter() - start
+
+
+# ================== 回归测试 ==================
+CJK_CHARS = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳云腾致雨露结为霜金生丽水玉出昆冈"
+ENGLISH_WORDS = ["the", "cat", "sat", "on", "a", "mat", "quickly", "river", "ancient", "letter", "Mr.", "U.S.",
+                 "whispered", "beneath", "window", "morning"]
+
+
+def _tile(make_block, size_mb: int, seed: int) -> str:
+    """用 1MB 样本块平铺到 size_mb MB"""
+    return make_block(random.Random(seed)) * max(1, size_mb)
+
+
+def _block_cjk(rng) -> str:
+    parts, size = [], 0
+    while size < 1024 * 1024:
+        para = "".join("".join(rng.choice(CJK_CHARS) for _ in range(rng.randint(8, 40))) + rng.choice("。！？，")
+                       for _ in range(rng.randint(2, 8))) + "\n\n"
+        parts.append(para)
+        size += len(para.encode("utf-8"))
+    return "".join(parts)
+
+
+def _block_english(rng) -> str:
+    parts, size = [], 0
+    while size < 1024 * 1024:
+        para = " ".join(" ".join(rng.choice(ENGLISH_WORDS) for _ in range(rng.randint(4, 18))).capitalize()
+                        + rng.choice(".!?") for _ in range(rng.randint(2, 8))) + "\n\n"
+        parts.append(para)
+        size += len(para.encode("utf-8"))
+    return "".join(parts)
+
+
+def _block_nopunct(rng) -> str:
+    """没有标点也没有空行，分块只能硬切"""
+    parts, size = [], 0
+    while size < 1024 * 1024:
+        line = "".join(rng.choice(CJK_CHARS) for _ in range(rng.randint(200, 2000))) + "\n"
+        parts.append(line)
+        size += len(line.encode("utf-8"))
+    return "".join(parts)
+
+
+def _tiny_chapters(n_chapters: int = 10000) -> str:
+    rng = random.Random(7)
+    return "".join(f"第{i + 1}章 标题{i + 1}\n\n"
+                   + "".join(rng.choice(CJK_CHARS) for _ in range(rng.randint(50, 300))) + "。\n\n"
+                   for i in range(n_chapters))
+
+
+CORPORA = {
+    "cjk": lambda size_mb: _tile(_block_cjk, size_mb, 1),
+    "english": lambda size_mb: _tile(_block_english, size_mb, 2),
+    "mixed": generate_text,
+    "nopunct": lambda size_mb: _tile(_block_nopunct, size_mb, 3),
+    "chapters": lambda size_mb: _tiny_chapters(),
+}
+HUGE_MB = 1024
+SUITE_OPS = ["boundaries", "chapters", "normalize", "v1", "v2", "v3"]
+SPLIT_OPS = ["v1", "v2", "v3"]
+
+
+def write_huge_corpus(path: str, size_mb: int = HUGE_MB):
+    """边生成边写入的大文件：带章节标题的中英混排文本，内存中只保留一个 1MB 样本块"""
+    block = generate_text(1)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(size_mb):
+            f.write(f"第{i + 1}章 第{i + 1}卷\n\n")
+            f.write(block)
+
+
+def _windows_peak_working_set():
+    """Windows 上当前进程的峰值工作集（字节），即 PROCESS_MEMORY_COUNTERS.PeakWorkingSetSize"""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    kernel32 = ctypes.WinDLL("kernel32")
+    psapi = ctypes.WinDLL("psapi")
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+    psapi.GetProcessMemoryInfo.restype = wintypes.BOOL
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def peak_rss_mb():
+    if resource is None:
+        if sys.platform != "win32":
+            return None
+        peak = _windows_peak_working_set()
+        return None if peak is None else round(peak / (1024 * 1024), 1)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(op: str, path: str, encoding_name: str, stream: bool, repeat: int = 1) -> dict:
+    """在当前进程中执行一项测试（由 --run-case 在子进程里调用），重复 repeat 次取最短耗时"""
+    results = [_run_case_once(op, path, encoding_name, stream) for _ in range(max(1, repeat))]
+    seconds, chunks = min(results)
+    return {"seconds": round(seconds, 3), "peak_rss_mb": peak_rss_mb(), "chunks": chunks}
+
+
+def _run_case_once(op: str, path: str, encoding_name: str, stream: bool):
+    if op in SPLIT_OPS:
+        with tempfile.TemporaryDirectory() as out:
+            start = time.perf_counter()
+            if op == "v1":
+                _, chunks = splitter.split_text_file_v1(
+                    path, out, "bench", splitter.DEFAULT_CHUNK_SIZE, splitter.DEFAULT_OVERLAP_RATE,
+                    splitter.DEFAULT_MIN_CHUNK_RATIO, encoding_name, stream)
+            elif op == "v2":
+                _, chunks = splitter.split_text_file_v2(path, out, "bench", splitter.DEFAULT_MAX_TOKENS,
+                                                        encoding_name, stream, workers=1)
+            else:
+                _, chunks = splitter.split_text_file_v3(
+                    path, out, "bench", splitter.DEFAULT_CHUNK_SIZE, splitter.DEFAULT_OVERLAP_RATE,
+                    splitter.DEFAULT_MIN_CHUNK_RATIO, encoding_name, stream, workers=1)
+            seconds = time.perf_counter() - start
+    else:
+        text, _ = splitter.read_text_file(path)
+        func = {"boundaries": splitter.find_sentence_boundaries, "chapters": splitter.detect_chapters,
+                "normalize": splitter.preserve_formatting}[op]
+        start = time.perf_counter()
+        chunks = len(func(text))
+        seconds = time.perf_counter() - start
+    return seconds, chunks
+
+
+def run_case_subprocess(op: str, path: str, encoding_name: str, stream: bool, repeat: int = 1) -> dict:
+    cmd = [sys.executable, os.path.abspath(__file__), "--run-case", op, path, "--encoding", encoding_name,
+           "--repeat", str(repeat)]
+    if stream:
+        cmd.append("--stream")
+    proc = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
+    if proc.returncode != 0:
+        raise RuntimeError(f"{op} 失败：{proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run_suite(size_mb: int, encoding_name: str, huge: bool = False, corpora=None, ops=None, repeat: int = 3,
+              progress=print) -> dict:
+    """生成语料并逐项测量，返回 {"语料/操作": 结果}"""
+    tokenizer = splitter.get_tokenizer(encoding_name)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = []
+        for name in corpora or CORPORA:
+            text = CORPORA[name](size_mb)
+            path = os.path.join(tmp_dir, f"{name}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            cases.append((name, path, tokenizer.count(text), False, ops or SUITE_OPS))
+            del text
+        if huge:
+            # 1GB 只测流式分块：整篇读入内存的操作在这个规模上没有意义
+            path = os.path.join(tmp_dir, "huge.txt")
+            write_huge_corpus(path)
+            tokens = tokenizer.count(generate_text(1)) * HUGE_MB
+            cases.append(("huge", path, tokens, True, [op for op in ops or SUITE_OPS if op in SPLIT_OPS]))
+
+        for name, path, tokens, stream, case_ops in cases:
+            for op in case_ops:
+                key = f"{name}/{op}"
+                try:
+                    result = run_case_subprocess(op, path, encoding_name, stream, 1 if name == "huge" else repeat)
+                    result["tokens"] = tokens
+                    result["tokens_per_sec"] = round(tokens / result["seconds"]) if result["seconds"] else None
+                except Exception as e:
+                    result = {"error": str(e)}
+                results[key] = result
+                progress(format_result(key, result))
+    return results
+
+
+def format_result(key: str, result: dict, base: dict = None) -> str:
+    if "error" in result:
+        return f"{key:<20} 失败: {result['error']}"
+    rss = "n/a" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.0f}"
+    tps = "n/a" if result["tokens_per_sec"] is None else f"{result['tokens_per_sec']:,}"
+    line = f"{key:<20} {result['seconds']:>9.3f} {rss:>10} {tps:>14}"
+    if base and "error" not in base:
+        line += f" {_change(result['seconds'], base['seconds']):>9} {_change(result['peak_rss_mb'], base['peak_rss_mb']):>9}"
+    return line
+
+
+def _change(value, base):
+    if value is None or not base:
+        return "-"
+    return f"{(value - base) / base * 100:+.0f}%"
+
+
+# 耗时太短时计时噪声大，低于这个秒数的项不判回归
+MIN_COMPARE_SECONDS = 0.05
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """返回回归项的说明；耗时或峰值内存超过基准的 (1 + tolerance) 倍即为回归，失败的项也算回归"""
+    regressions = []
+    for key, base in baseline.items():
+        result = results.get(key)
+        if result is None or "error" in base:
+            continue
+        if "error" in result:
+            regressions.append(f"{key}: {result['error']}")
+            continue
+        if base["seconds"] >= MIN_COMPARE_SECONDS and result["seconds"] > base["seconds"] * (1 + tolerance):
+            regressions.append(f"{key}: 耗时 {base['seconds']:.3f}s -> {result['seconds']:.3f}s")
+        if base["peak_rss_mb"] and result["peak_rss_mb"] and result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{key}: 峰值内存 {base['peak_rss_mb']:.0f}MB -> {result['peak_rss_mb']:.0f}MB")
+    return regressions
+
+
+def suite_main(args) -> int:
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved["size_mb"] != args.size_mb or saved["encoding"] != args.encoding:
+            print(f"基准的参数不同（size_mb={saved['size_mb']}, encoding={saved['encoding']}），不做对比")
+        else:
+            baseline = saved["results"]
+
+    header = f"{'语料/操作':<20} {'耗时(s)':>9} {'峰值内存(MB)':>10} {'tokens/秒':>14}"
+    print(header + (f" {'耗时变化':>9} {'内存变化':>9}" if baseline else ""))
+    results = run_suite(args.size_mb, args.encoding, args.huge, args.corpora, args.ops, args.repeat,
+                        progress=lambda line: print(line, flush=True))
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"size_mb": args.size_mb, "encoding": args.encoding,
+                       "created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results},
+                      f, indent=2, ensure_ascii=False)
+        print(f"基准已保存: {args.baseline}")
+        return 0 if all("error" not in r for r in results.values()) else 1
+    if baseline is None:
+        print("没有可对比的基准（先用 --save-baseline 保存一次）")
+        return 0 if all("error" not in r for r in results.values()) else 1
+
+    print()
+    print(f"{'语料/操作':<20} {'耗时(s)':>9} {'峰值内存(MB)':>10} {'tokens/秒':>14} {'耗时变化':>9} {'内存变化':>9}")
+    for key, result in results.items():
+        print(format_result(key, result, baseline.get(key)))
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n性能回归（容差 {args.tolerance:.0%}）：")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\n与基准相比没有回归（容差 {args.tolerance:.0%}）")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="猫仔文本分割器 性能测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100], help="测试文本大小（MB）")
+    parser.add_argument("--suite", action="store_true", help="运行回归测试并与基准对比")
+    parser.add_argument("--size-mb", type=int, default=5, help="回归测试中每种语料的大小（MB）")
+    parser.add_argument("--huge", action="store_true", help=f"回归测试另加 {HUGE_MB}MB 单文件（流式分块）")
+    parser.add_argument("--corpora", nargs="+", choices=sorted(CORPORA), help="只测指定的语料")
+    parser.add_argument("--ops", nargs="+", choices=SUITE_OPS, help="只测指定的操作")
+    parser.add_argument("--encoding", default=splitter.DEFAULT_ENCODING, help="分词器")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最短耗时（1GB 文件只跑一次）")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="基准文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基准")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="允许的耗时/内存增幅（0.3 即 30%%）")
+    parser.add_argument("--run-case", nargs=2, metavar=("OP", "PATH"), help=argparse.SUPPRESS)
+    parser.add_argument("--stream", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_case:
+        print(json.dumps(run_case(*args.run_case, args.encoding, args.stream, args.repeat)))
+        return 0
+    if args.suite:
+        return suite_main(args)
+
+    print(f"{'大小(MB)':>8} {'边界数':>10} {'查找次数':>8} {'构建(s)':>8} {'查找(s)':>8} {'每MB(ms)':>9}")
+    per_mb = []
+    for size_mb in args.sizes:
+        n_boundaries, lookups, build_time, lookup_time = bench_boundaries(size_mb)
+        ms_per_mb = (build_time + lookup_time) * 1000 / size_mb
+        per_mb.append(ms_per_mb)
+        print(f"{size_mb:>8} {n_boundaries:>10} {lookups:>8} {build_time:>8.2f} {lookup_time:>8.2f} {ms_per_mb:>9.1f}")
+
+    # 线性：每 MB 耗时不随文件增大而明显上升
+    ratio = max(per_mb) / min(per_mb)
+    print(f"每MB耗时最大/最小比: {ratio:.2f}（接近 1 表示线性）")
+
+    print()
+    print(f"{'大小(MB)':>8} {'旧版规范化(s)':>12} {'单遍规范化(s)':>12} {'加速比':>8}")
+    for size_mb in args.sizes:
+        legacy_time, new_time = bench_normalizer(size_mb)
+        print(f"{size_mb:>8} {legacy_time:>12.2f} {new_time:>12.2f} {legacy_time / new_time:>7.1f}x")
+
+    n_chapters, n_chars, chapter_time = bench_chapters()
+    print()
+    print(f"章节索引: {n_chapters} 章 / {n_chars / 1e6:.1f}M 字符, 耗时 {chapter_time:.2f}s")
+    return 0 if ratio < 2 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,7 +14,18 @@ import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext, filedialog
 from datetime import datetime
 import requests
+import socket
+import errno
 import threading
+import asyncio
+from urllib.parse import urlsplit
+from importlib.util import find_spec
+from contextlib import contextmanager, asynccontextmanager
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
 import concurrent.futures
 from difflib import SequenceMatcher
 import re
@@ -29,6 +40,9 @@ DEFAULT_CONFIG = {
     "models_list": [],
     "max_workers": 2,
     "max_retries": 3,
+    "async_engine": False,  # True 时批处理改用 asyncio 引擎（需要 httpx）
+    "adaptive_concurrency": False,  # True 时并发数由 AIMD 控制器自动调整，并发数一栏作为起始值
+    "max_concurrency": 32,  # 自适应并发的上限
     "similarity_threshold": 40,  # 默认相似度阈值（%）
     "max_tokens": 1500,
     "temperature": 0.8,
@@ -39,8 +53,402 @@ DEFAULT_CONFIG = {
 CONFIG_FILE = "config.json"
 API_KEYS_FILE = "api_keys.json"  # 存储API密钥的文件
 DEFAULT_PROFILE_FILE = "default_profile.json"  # 存储默认配置的文件
+DNS_CACHE_TTL = 300  # 域名解析结果的缓存时间（秒）
+ADAPTIVE_BACKOFF = 0.5  # 自适应并发遇到过载时，并发数乘以该系数
+ADAPTIVE_LATENCY_SPIKE = 2.0  # 近期平均耗时超过平常的该倍数时视为延迟突增
+ASYNC_POOL_SHARD_SIZE = 16  # 异步引擎单个连接池的连接数上限（httpx 单池连接过多时调度开销急剧上升）
 # ===============================================
 
+# ================== HTTP 连接池 ==================
+class DNSCache:
+    """域名解析缓存：同一接口的新连接不再重复查询 DNS"""
+    
+    def __init__(self, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        self.lookups = 0
+        self.hits = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def resolve(self, host, port):
+        """返回 getaddrinfo 的完整结果 [(family, type, proto, canonname, sockaddr)]，解析失败时抛 socket.gaierror"""
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+        infos = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+        with self._lock:
+            self.lookups += 1
+            self._entries[key] = (now + self.ttl, infos)
+        return infos
+    
+    def forget(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+DNS_CACHE = DNSCache()
+
+
+def _connect_any(infos, timeout, source_address, socket_options):
+    """依次尝试 getaddrinfo 的各个地址（保留 IPv6 的 flowinfo/scope_id），
+    所有尝试共用一个 timeout；全部失败时抛出最后一个错误"""
+    deadline = time.monotonic() + timeout if isinstance(timeout, (int, float)) else None
+    error = None
+    for family, socktype, proto, _, sockaddr in infos:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        sock = socket.socket(family, socktype, proto)
+        try:
+            for option in socket_options or ():
+                sock.setsockopt(*option)
+            if deadline is not None:
+                sock.settimeout(deadline - time.monotonic())
+            elif timeout is None:
+                sock.settimeout(None)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or socket.timeout("timed out")
+
+
+def _is_stale_address_error(error):
+    # 拒绝连接、主机或网络不可达说明缓存的地址可能已失效；超时不算
+    return (isinstance(error, ConnectionRefusedError)
+            or getattr(error, "errno", None) in (errno.EHOSTUNREACH, errno.ENETUNREACH))
+
+
+def _new_conn_with_dns_cache(self, fallback):
+    # 用缓存的地址建立 TCP 连接；TLS 握手和 Host 头仍使用原域名。
+    # 解析失败或缓存的地址被拒绝/不可达时丢弃缓存，交给 urllib3 按原流程重新解析；
+    # 超时等其他错误按 urllib3 的方式报出，不再用整个超时重连一次
+    try:
+        infos = DNS_CACHE.resolve(self._dns_host, self.port)
+    except OSError:
+        return fallback(self)
+    try:
+        return _connect_any(infos, self.timeout, self.source_address, self.socket_options)
+    except socket.timeout as e:
+        raise ConnectTimeoutError(
+            self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})") from e
+    except OSError as e:
+        if _is_stale_address_error(e):
+            DNS_CACHE.forget(self._dns_host, self.port)
+            return fallback(self)
+        raise NewConnectionError(self, f"Failed to establish a new connection: {e}") from e
+
+
+class _CachedDNSHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        return _new_conn_with_dns_cache(self, HTTPConnection._new_conn)
+
+
+class _CachedDNSHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        return _new_conn_with_dns_cache(self, HTTPSConnection._new_conn)
+
+
+class _CachedDNSHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _CachedDNSHTTPConnection
+
+
+class _CachedDNSHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _CachedDNSHTTPSConnection
+
+
+class HTTPSessionPool:
+    """按接口（协议 + 主机 + 端口）复用 requests.Session。
+    每个接口的连接池大小等于并发数，连接在整个批处理期间保持（keep-alive），
+    重试和后续文件都复用已有连接，省去每次请求的 TCP/TLS 握手。
+    """
+    
+    def __init__(self):
+        self._sessions = {}  # 接口 -> (Session, 连接池大小)
+        self._retired = []  # 被更大连接池替换下来的 Session，统计仍要算上
+        self._lock = threading.Lock()
+    
+    def get(self, url, pool_size=1):
+        """取 url 所在接口的 Session；已有的连接池比 pool_size 小时换一个更大的"""
+        parts = urlsplit(url)
+        endpoint = (parts.scheme, parts.netloc)
+        pool_size = max(1, int(pool_size))
+        with self._lock:
+            entry = self._sessions.get(endpoint)
+            if entry and entry[1] >= pool_size:
+                return entry[0]
+            # 旧 Session 可能仍有请求在用，先不关闭，保留到 close() 以便累计统计
+            if entry:
+                self._retired.append(entry[0])
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            adapter.poolmanager.pool_classes_by_scheme = {"http": _CachedDNSHTTPPool,
+                                                          "https": _CachedDNSHTTPSPool}
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._sessions[endpoint] = (session, pool_size)
+            return session
+    
+    def stats(self):
+        """累计的请求数和新建连接数（复用次数 = 请求数 - 新建连接数），换过连接池的接口也包括旧的"""
+        requests_count = 0
+        connections = 0
+        with self._lock:
+            sessions = [session for session, _ in self._sessions.values()] + self._retired
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        requests_count += pool.num_requests
+                        connections += pool.num_connections
+        return {"requests": requests_count, "connections": connections,
+                "reused": max(0, requests_count - connections),
+                "dns_lookups": DNS_CACHE.lookups, "dns_hits": DNS_CACHE.hits}
+    
+    def format_stats(self, since=None):
+        """连接复用统计的日志文本；since 为之前的 stats()，只统计其后的部分"""
+        current = self.stats()
+        if since:
+            current = {k: v - since.get(k, 0) for k, v in current.items()}
+        total = current["requests"]
+        rate = current["reused"] / total if total else 0
+        return (f"🔌 连接复用：请求 {total} 次，新建连接 {current['connections']} 个，"
+                f"复用率 {rate:.0%}；DNS 查询 {current['dns_lookups']} 次，命中缓存 {current['dns_hits']} 次")
+    
+    def close(self):
+        with self._lock:
+            sessions = [session for session, _ in self._sessions.values()] + self._retired
+            self._sessions.clear()
+            self._retired = []
+        for session in sessions:
+            session.close()
+
+
+# ================== 异步请求引擎 ==================
+class AsyncLLMClient:
+    """asyncio 引擎使用的 HTTP 客户端（httpx.AsyncClient）。
+    装有 h2 时对 HTTPS 接口启用 HTTP/2，同一连接上多路复用大量请求；
+    服务端不支持时自动退回 HTTP/1.1 长连接池。同时在途的请求数由调用方的信号量限制；
+    连接按 ASYNC_POOL_SHARD_SIZE 分到多个小连接池，请求交给在途最少的那个。
+    """
+    
+    def __init__(self, max_connections, timeout):
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("使用异步引擎需要先安装 httpx：pip install httpx[http2]")
+        self.http2 = find_spec("h2") is not None
+        shard_count = -(-max(1, max_connections) // ASYNC_POOL_SHARD_SIZE)
+        shard_size = -(-max(1, max_connections) // shard_count)
+        limits = httpx.Limits(max_connections=shard_size, max_keepalive_connections=shard_size)
+        self.clients = [httpx.AsyncClient(http2=self.http2, limits=limits, timeout=timeout)
+                        for _ in range(shard_count)]
+        self.loads = [0] * shard_count
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.http_versions = set()
+    
+    async def post_json(self, url, headers, payload):
+        """发送 POST 请求并返回解析后的 JSON；HTTP 错误状态抛异常（与 requests 的 raise_for_status 一致）"""
+        shard = min(range(len(self.clients)), key=self.loads.__getitem__)
+        self.requests += 1
+        self.in_flight += 1
+        self.loads[shard] += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await self.clients[shard].post(url, headers=headers, json=payload)
+        finally:
+            self.in_flight -= 1
+            self.loads[shard] -= 1
+        self.http_versions.add(response.http_version)
+        response.raise_for_status()
+        return response.json()
+    
+    def format_stats(self):
+        versions = "、".join(sorted(self.http_versions)) or "无"
+        return (f"⚡ 异步引擎：请求 {self.requests} 次，最多同时 {self.peak_in_flight} 个，"
+                f"协议 {versions}{'' if self.http2 else '（未安装 h2，未启用 HTTP/2）'}")
+    
+    async def aclose(self):
+        for client in self.clients:
+            await client.aclose()
+
+
+# ================== 自适应并发 ==================
+def overload_reason(error):
+    """请求异常是否说明服务端过载：429、5xx 和超时返回原因文字，其余错误返回 None"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return f"HTTP {status}" if status == 429 or status >= 500 else None
+    # requests 与 httpx 的超时异常都以 Timeout 结尾（ReadTimeout、ConnectTimeout 等）
+    if isinstance(error, (requests.Timeout, TimeoutError)) or type(error).__name__.endswith("Timeout"):
+        return "超时"
+    return None
+
+
+class AdaptiveConcurrency:
+    """AIMD 并发控制：同时在途的 API 请求数不超过 limit。
+    请求顺利且名额用满时加性增大（第一次过载前每次 +1，之后每轮 +1），
+    遇到 429/5xx/超时或近期耗时突增到平常的 ADAPTIVE_LATENCY_SPIKE 倍时乘以 ADAPTIVE_BACKOFF。
+    降低之前已发出的请求不再重复触发降低。minimum 等于 maximum 时即固定并发数。
+    线程池引擎用 slot()，asyncio 引擎用 slot_async()（须在同一个事件循环里使用）。
+    """
+    
+    def __init__(self, initial, maximum, minimum=1, on_change=None):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self.on_change = on_change  # on_change(原并发数, 新并发数, 原因)，在工作线程里调用
+        self.history = [(time.time(), int(self.limit), "起始")]
+        self.recent_latency = None  # 近期平均耗时（快速滑动平均）
+        self.usual_latency = None  # 平常耗时（慢速滑动平均）
+        self._backed_off = False
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = []
+    
+    @property
+    def adaptive(self):
+        return self.minimum < self.maximum
+    
+    @property
+    def current(self):
+        return int(self.limit)
+    
+    def mark(self):
+        """当前调整记录的位置，传给 format_stats 只统计其后的部分"""
+        return len(self.history)
+    
+    @contextmanager
+    def slot(self):
+        """占用一个请求名额，名额用满时阻塞；退出时按请求结果调整并发数"""
+        with self._cond:
+            while not self._try_acquire():
+                self._cond.wait()
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # KeyboardInterrupt、任务取消等也要归还名额
+            self._release(started, error)
+    
+    @asynccontextmanager
+    async def slot_async(self):
+        """slot 的协程版本"""
+        while True:
+            with self._cond:
+                if self._try_acquire():
+                    break
+                waiter = asyncio.get_running_loop().create_future()
+                self._async_waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._cond:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+                    elif waiter.done() and not waiter.cancelled():
+                        # 已被唤醒却在拿到名额前取消，把唤醒让给下一个等待者
+                        self._wake_async(1)
+                raise
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # KeyboardInterrupt、任务取消等也要归还名额
+            self._release(started, error)
+    
+    def _try_acquire(self):
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+    
+    def _release(self, started, error=None):
+        latency = time.monotonic() - started
+        with self._cond:
+            self.in_flight -= 1
+            reason = overload_reason(error) if error is not None else None
+            if reason:
+                self._decrease(started, f"过载（{reason}）")
+            elif error is None:
+                self._observe(started, latency)
+            # 只唤醒空出名额数量的等待者，几百个请求排队时不必全部唤醒
+            free = int(self.limit) - self.in_flight
+            if free > 0:
+                self._cond.notify(free)
+                self._wake_async(free)
+    
+    def _wake_async(self, count):
+        """唤醒 count 个协程等待者，跳过已取消的；须持有 self._cond"""
+        while count > 0 and self._async_waiters:
+            waiter = self._async_waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                count -= 1
+    
+    def _observe(self, started, latency):
+        if self.usual_latency is None:
+            self.recent_latency = self.usual_latency = latency
+        else:
+            self.recent_latency += 0.3 * (latency - self.recent_latency)
+            # 突增的样本不计入平常耗时，否则持续变慢时平常值跟着上涨，近期值永远到不了它的 2 倍
+            if latency <= ADAPTIVE_LATENCY_SPIKE * self.usual_latency:
+                self.usual_latency += 0.05 * (latency - self.usual_latency)
+        if self.recent_latency > ADAPTIVE_LATENCY_SPIKE * self.usual_latency:
+            reason = f"延迟升高（近期 {self.recent_latency:.1f} 秒，平常 {self.usual_latency:.1f} 秒）"
+            if self._decrease(started, reason):
+                # 降低后以当前耗时为新的平常值，接口本身变慢时只减半一次，不会一路降到最小
+                self.usual_latency = self.recent_latency
+        elif self.in_flight + 1 >= int(self.limit):
+            # 名额用满时才增大，请求不够多时不虚涨
+            step = 1 / self.limit if self._backed_off else 1
+            self._set(min(self.maximum, self.limit + step), "请求顺利")
+    
+    def _decrease(self, started, reason):
+        """乘性降低并发数；started 早于上次降低（降低前已发出的请求）时不再降低，返回 False"""
+        if started < self._last_decrease:
+            return False
+        self._last_decrease = time.monotonic()
+        self._backed_off = True
+        self._set(max(self.minimum, self.limit * ADAPTIVE_BACKOFF), reason)
+        return True
+    
+    def _set(self, limit, reason):
+        old = int(self.limit)
+        self.limit = limit
+        if int(limit) != old:
+            self.history.append((time.time(), int(limit), reason))
+            if self.on_change:
+                self.on_change(old, int(limit), reason)
+    
+    def format_stats(self, since=0):
+        """自适应并发的日志文本；since 为之前的 mark()"""
+        first = max(since, 1)
+        limits = [limit for _, limit, _ in self.history[first - 1:]]
+        ups = sum(1 for before, after in zip(limits, limits[1:]) if after > before)
+        return (f"🎚️ 自适应并发：当前 {self.current}（上限 {self.maximum}），"
+                f"本轮调高 {ups} 次、调低 {len(limits) - 1 - ups} 次，最高 {max(limits)}")
+
 class APIKeyManagerDialog:
     """API密钥管理对话框"""
     def __init__(self, parent, current_url="", current_key=""):
@@ -369,6 +777,14 @@ class MainApplication:
         ttk.Label(api_row4, text="最大输出值:", width=12).pack(side=tk.LEFT)
         self.max_output_var = tk.StringVar(value=str(self.config.get("max_output_tokens", 600)))
         ttk.Entry(api_row4, textvariable=self.max_output_var, width=8).pack(side=tk.LEFT, padx=5)
+        self.async_engine_var = tk.BooleanVar(value=self.config.get("async_engine", False))
+        ttk.Checkbutton(api_row4, text="异步引擎（高并发，需 httpx）", 
+                       variable=self.async_engine_var).pack(side=tk.LEFT, padx=10)
+        self.adaptive_concurrency_var = tk.BooleanVar(value=self.config.get("adaptive_concurrency", False))
+        ttk.Checkbutton(api_row4, text="自适应并发，上限:", 
+                       variable=self.adaptive_concurrency_var).pack(side=tk.LEFT, padx=(10, 0))
+        self.max_concurrency_var = tk.StringVar(value=str(self.config.get("max_concurrency", 32)))
+        ttk.Entry(api_row4, textvariable=self.max_concurrency_var, width=6).pack(side=tk.LEFT, padx=5)
         
         # 文件夹/文档选择区域
         folder_frame = ttk.LabelFrame(main_frame, text="选择处理文件夹/文档", padding=10)
@@ -574,6 +990,9 @@ class MainApplication:
         self.loop_fix_stop_flag = False  # 循环纠错停止标志
         self.current_input_folder = None  # 记录当前输入文件夹（用于单文档模式）
         self.config_confirmed = False  # 配置确认标志
+        self.http_pool = HTTPSessionPool()  # 按接口复用的 HTTP 连接（keep-alive）
+        self.concurrency = None  # 当前使用的并发控制器，见 prepare_concurrency
+        self.concurrency_key = None  # 创建该控制器时的并发配置
         
         self.log_message("系统已启动，加载配置完成。")
         self.log_message(f"API地址: {self.config.get('api_url', 'N/A')}")
@@ -656,7 +1075,8 @@ class MainApplication:
                     headers["Authorization"] = f"Bearer {api_key}"
                 
                 self.root.after(0, lambda: self.log_message(f"📡 测试连接: {models_url}"))
-                response = requests.get(models_url, headers=headers, timeout=timeout)
+                session = self.http_pool.get(models_url, self.config.get("max_workers", 2))
+                response = session.get(models_url, headers=headers, timeout=timeout)
                 response.raise_for_status()
                 data = response.json()
                 
@@ -704,6 +1124,9 @@ class MainApplication:
                 "models_list": list(self.model_combo['values']),
                 "max_workers": int(self.max_workers_var.get()),
                 "max_retries": int(self.max_retries_var.get()),
+                "async_engine": self.async_engine_var.get(),
+                "adaptive_concurrency": self.adaptive_concurrency_var.get(),
+                "max_concurrency": int(self.max_concurrency_var.get()),
                 "similarity_threshold": similarity,
                 "max_input_tokens": int(self.max_input_var.get()),
                 "max_output_tokens": int(self.max_output_var.get()),
@@ -735,6 +1158,9 @@ class MainApplication:
                 "models_list": list(self.model_combo['values']),
                 "max_workers": int(self.max_workers_var.get()),
                 "max_retries": int(self.max_retries_var.get()),
+                "async_engine": self.async_engine_var.get(),
+                "adaptive_concurrency": self.adaptive_concurrency_var.get(),
+                "max_concurrency": int(self.max_concurrency_var.get()),
                 "similarity_threshold": int(self.similarity_var.get()),
                 "max_input_tokens": int(self.max_input_var.get()),
                 "max_output_tokens": int(self.max_output_var.get()),
@@ -782,6 +1208,12 @@ class MainApplication:
                 self.max_workers_var.set(str(profile["max_workers"]))
             if "max_retries" in profile:
                 self.max_retries_var.set(str(profile["max_retries"]))
+            if "async_engine" in profile:
+                self.async_engine_var.set(profile["async_engine"])
+            if "adaptive_concurrency" in profile:
+                self.adaptive_concurrency_var.set(profile["adaptive_concurrency"])
+            if "max_concurrency" in profile:
+                self.max_concurrency_var.set(str(profile["max_concurrency"]))
             if "similarity_threshold" in profile:
                 self.similarity_var.set(str(profile["similarity_threshold"]))
             if "max_input_tokens" in profile:
@@ -1417,85 +1849,42 @@ class MainApplication:
     
     def _reprocess_files_sync(self, folder_path, file_list, prompt, operation_name):
         """同步重新处理指定文件（用于循环纠错）"""
-        max_workers = self.config.get("max_workers", 2)
+        concurrency = self.prepare_concurrency()
+        concurrency_mark = concurrency.mark()
+        max_workers = concurrency.maximum
         success_count = 0
         error_count = 0
-        
-        def process_single_file(filename):
-            if self.loop_fix_stop_flag:
-                return {"status": "stopped", "filename": filename}
-            
-            file_path = os.path.join(folder_path, filename)
-            self.root.after(0, lambda: self.update_current_file(filename, "processing"))
-            self.root.after(0, lambda: self.update_file_status(filename, "processing"))
-            
-            for attempt in range(1, self.config.get("max_retries", 3) + 1):
-                if self.loop_fix_stop_flag:
-                    return {"status": "stopped", "filename": filename}
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        source_text = f.read().strip()
-                    
-                    if not source_text:
-                        raise ValueError("文件内容为空")
-                    
-                    result = self.call_llm_api(prompt, source_text)
-                    processed_output = self.post_process_format(result)
-                    
-                    similarity_threshold = self.config.get("similarity_threshold", 40) / 100.0
-                    sim_ratio = self.get_similarity(source_text, processed_output)
-                    
-                    if sim_ratio > similarity_threshold:
-                        self.root.after(0, lambda f=filename, a=attempt, s=sim_ratio: 
-                                      self.log_message(f"⚠️ [{operation_name}][{f}] 第{a}次失败：相似度{s:.2%}过高"))
-                        if attempt < self.config.get("max_retries", 3):
-                            time.sleep(2)
-                            continue
-                        else:
-                            raise Exception(f"相似度过高（{sim_ratio:.2%}），疑似复读原文")
-                    
-                    final_result = self.apply_regex_rules(processed_output)
-                    
-                    out_filename = filename.replace('.txt', '_processed.txt')
-                    result_file = os.path.join(self.current_task_folder, out_filename)
-                    with open(result_file, 'w', encoding='utf-8') as f:
-                        f.write(final_result)
-                    
-                    self.root.after(0, lambda f=filename, s=sim_ratio: 
-                                  self.log_message(f"✅ [{operation_name}][{f}] 处理成功！相似度: {s:.2%}"))
-                    self.root.after(0, lambda f=filename: self.update_file_status(f, "success"))
-                    return {"status": "success", "filename": filename}
+        http_stats = self.http_pool.stats()
+        
+        if self.config.get("async_engine"):
+            results = []
+            engine_msg = self.run_async_batch(folder_path, file_list, prompt, self.current_task_folder,
+                                              f"[{operation_name}]", results.append,
+                                              should_stop=lambda: self.loop_fix_stop_flag)
+            success_count = sum(1 for r in results if r and r["status"] == "success")
+            error_count = sum(1 for r in results if r and r["status"] == "error")
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self.process_single_file, folder_path, f, prompt,
+                                           self.current_task_folder, f"[{operation_name}]",
+                                           lambda: self.loop_fix_stop_flag)
+                           for f in file_list]
                 
-                except Exception as e:
-                    if attempt < self.config.get("max_retries", 3):
-                        self.root.after(0, lambda f=filename, a=attempt, err=str(e): 
-                                      self.log_message(f"❌ [{operation_name}][{f}] 第{a}次失败: {err}"))
-                        time.sleep(2)
-                    else:
-                        self.root.after(0, lambda f=filename, err=str(e): 
-                                      self.log_message(f"🚫 [{operation_name}][{f}] 处理失败: {err}"))
-                        self.root.after(0, lambda f=filename: self.update_file_status(f, "error"))
-                        
-                        error_file = os.path.join(self.current_task_folder, filename.replace('.txt', '_error.txt'))
-                        with open(error_file, 'w', encoding='utf-8') as f:
-                            f.write(f"处理失败\n错误: {str(e)}\n时间: {datetime.now()}")
-                        return {"status": "error", "filename": filename}
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(process_single_file, f) for f in file_list]
-            
-            for future in concurrent.futures.as_completed(futures):
-                if self.loop_fix_stop_flag:
-                    break
-                result = future.result()
-                if result and result["status"] == "success":
-                    success_count += 1
-                elif result and result["status"] == "error":
-                    error_count += 1
+                for future in concurrent.futures.as_completed(futures):
+                    if self.loop_fix_stop_flag:
+                        break
+                    result = future.result()
+                    if result and result["status"] == "success":
+                        success_count += 1
+                    elif result and result["status"] == "error":
+                        error_count += 1
+            engine_msg = self.http_pool.format_stats(since=http_stats)
         
         self.root.after(0, lambda s=success_count, e=error_count: 
                       self.log_message(f"📊 [{operation_name}] 本轮完成: 成功 {s}, 失败 {e}"))
+        self.root.after(0, lambda msg=engine_msg: self.log_message(msg))
+        if concurrency.adaptive:
+            self.root.after(0, lambda msg=concurrency.format_stats(since=concurrency_mark): self.log_message(msg))
     
     def _reprocess_files_thread(self, folder_path, file_list, prompt, operation_name):
         """重新处理指定文件的线程函数"""
@@ -1507,78 +1896,44 @@ class MainApplication:
             
             self.root.after(0, lambda: self.update_progress(0, len(file_list)))
             
-            max_workers = self.config.get("max_workers", 2)
+            concurrency = self.prepare_concurrency()
+            concurrency_mark = concurrency.mark()
+            max_workers = concurrency.maximum
             success_count = 0
             error_count = 0
+            http_stats = self.http_pool.stats()
             
-            def process_single_file(filename):
-                file_path = os.path.join(folder_path, filename)
-                self.root.after(0, lambda: self.update_current_file(filename, "processing"))
-                self.root.after(0, lambda: self.update_file_status(filename, "processing"))
+            if self.config.get("async_engine"):
+                results = []
                 
-                for attempt in range(1, self.config.get("max_retries", 3) + 1):
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            source_text = f.read().strip()
-                        
-                        if not source_text:
-                            raise ValueError("文件内容为空")
-                        
-                        result = self.call_llm_api(prompt, source_text)
-                        processed_output = self.post_process_format(result)
-                        
-                        similarity_threshold = self.config.get("similarity_threshold", 40) / 100.0
-                        sim_ratio = self.get_similarity(source_text, processed_output)
-                        
-                        if sim_ratio > similarity_threshold:
-                            self.root.after(0, lambda f=filename, a=attempt, s=sim_ratio: 
-                                          self.log_message(f"⚠️ [{operation_name}][{f}] 第{a}次失败：相似度{s:.2%}过高"))
-                            if attempt < self.config.get("max_retries", 3):
-                                time.sleep(2)
-                                continue
-                            else:
-                                raise Exception(f"相似度过高（{sim_ratio:.2%}），疑似复读原文")
-                        
-                        final_result = self.apply_regex_rules(processed_output)
-                        
-                        out_filename = filename.replace('.txt', '_processed.txt')
-                        result_file = os.path.join(self.current_task_folder, out_filename)
-                        with open(result_file, 'w', encoding='utf-8') as f:
-                            f.write(final_result)
-                        
-                        self.root.after(0, lambda f=filename, s=sim_ratio: 
-                                      self.log_message(f"✅ [{operation_name}][{f}] 处理成功！相似度: {s:.2%}"))
-                        self.root.after(0, lambda f=filename: self.update_file_status(f, "success"))
-                        return {"status": "success", "filename": filename}
+                def on_result(result):
+                    results.append(result)
+                    self.root.after(0, lambda c=len(results), t=len(file_list): self.update_progress(c, t))
+                
+                engine_msg = self.run_async_batch(folder_path, file_list, prompt, self.current_task_folder,
+                                                  f"[{operation_name}]", on_result)
+                success_count = sum(1 for r in results if r and r["status"] == "success")
+                error_count = len(results) - success_count
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = [executor.submit(self.process_single_file, folder_path, f, prompt,
+                                               self.current_task_folder, f"[{operation_name}]")
+                               for f in file_list]
                     
-                    except Exception as e:
-                        if attempt < self.config.get("max_retries", 3):
-                            self.root.after(0, lambda f=filename, a=attempt, err=str(e): 
-                                          self.log_message(f"❌ [{operation_name}][{f}] 第{a}次失败: {err}"))
-                            time.sleep(2)
+                    for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                        result = future.result()
+                        if result and result["status"] == "success":
+                            success_count += 1
                         else:
-                            self.root.after(0, lambda f=filename, err=str(e): 
-                                          self.log_message(f"🚫 [{operation_name}][{f}] 处理失败: {err}"))
-                            self.root.after(0, lambda f=filename: self.update_file_status(f, "error"))
-                            
-                            error_file = os.path.join(self.current_task_folder, filename.replace('.txt', '_error.txt'))
-                            with open(error_file, 'w', encoding='utf-8') as f:
-                                f.write(f"处理失败\n错误: {str(e)}\n时间: {datetime.now()}")
-                            return {"status": "error", "filename": filename}
-            
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = [executor.submit(process_single_file, f) for f in file_list]
-                
-                for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
-                    result = future.result()
-                    if result and result["status"] == "success":
-                        success_count += 1
-                    else:
-                        error_count += 1
-                    self.root.after(0, lambda c=i, t=len(file_list): self.update_progress(c, t))
+                            error_count += 1
+                        self.root.after(0, lambda c=i, t=len(file_list): self.update_progress(c, t))
+                engine_msg = self.http_pool.format_stats(since=http_stats)
             
             final_msg = f"✅ {operation_name}完成！成功: {success_count}, 失败: {error_count}, 总计: {len(file_list)}"
             self.root.after(0, lambda: self.log_message(final_msg))
+            self.root.after(0, lambda msg=engine_msg: self.log_message(msg))
+            if concurrency.adaptive:
+                self.root.after(0, lambda msg=concurrency.format_stats(since=concurrency_mark): self.log_message(msg))
             self.root.after(0, lambda msg=final_msg: messagebox.showinfo("完成", msg))
         
         except Exception as e:
@@ -1613,6 +1968,7 @@ class MainApplication:
                 timeout = int(self.timeout_var.get())
                 max_workers = int(self.max_workers_var.get())
                 max_retries = int(self.max_retries_var.get())
+                max_concurrency = int(self.max_concurrency_var.get())
                 similarity = int(self.similarity_var.get())
                 max_input = int(self.max_input_var.get())
                 max_output = int(self.max_output_var.get())
@@ -1624,6 +1980,14 @@ class MainApplication:
                 if max_workers < 1:
                     messagebox.showerror("错误", "并发数至少为1！")
                     return
+                
+                if self.adaptive_concurrency_var.get() and max_concurrency < max_workers:
+                    messagebox.showerror("错误", "自适应并发的上限不能小于并发数！")
+                    return
+                
+                if self.async_engine_var.get() and find_spec("httpx") is None:
+                    messagebox.showerror("错误", "使用异步引擎需要先安装 httpx：pip install httpx[http2]")
+                    return
                     
             except ValueError:
                 messagebox.showerror("错误", "请确保所有数值参数输入正确！")
@@ -1634,7 +1998,11 @@ class MainApplication:
             self.log_message("✅ 当前配置已确认")
             self.log_message(f"  - API地址: {self.api_url_var.get().strip()}")
             self.log_message(f"  - 模型: {self.model_var.get()}")
-            self.log_message(f"  - 并发数: {max_workers}, 重试次数: {max_retries}")
+            if self.adaptive_concurrency_var.get():
+                self.log_message(f"  - 并发数: 自适应（从 {max_workers} 开始，上限 {max_concurrency}）, 重试次数: {max_retries}")
+            else:
+                self.log_message(f"  - 并发数: {max_workers}, 重试次数: {max_retries}")
+            self.log_message(f"  - 请求引擎: {'asyncio（异步）' if self.async_engine_var.get() else '线程池'}")
             self.log_message(f"  - 相似度阈值: {similarity}%")
             messagebox.showinfo("成功", "当前配置已确认！\n现在可以开始处理文件。")
             
@@ -1694,80 +2062,40 @@ class MainApplication:
             self.root.after(0, lambda: self.log_message(f"🚀 开始批量处理 {len(file_list)} 个文件"))
             self.root.after(0, lambda: self.update_progress(0, len(file_list)))
             
-            max_workers = self.config.get("max_workers", 2)
+            concurrency = self.prepare_concurrency()
+            concurrency_mark = concurrency.mark()
+            max_workers = concurrency.maximum
             success_count = 0
             error_count = 0
+            http_stats = self.http_pool.stats()
             
-            def process_single_file(filename):
-                file_path = os.path.join(folder_path, filename)
-                self.root.after(0, lambda: self.update_current_file(filename, "processing"))
-                self.root.after(0, lambda: self.update_file_status(filename, "processing"))
+            if self.config.get("async_engine"):
+                results = []
                 
-                for attempt in range(1, self.config.get("max_retries", 3) + 1):
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            source_text = f.read().strip()
-                        
-                        if not source_text:
-                            raise ValueError("文件内容为空")
-                        
-                        result = self.call_llm_api(prompt, source_text)
-                        processed_output = self.post_process_format(result)
-                        
-                        similarity_threshold = self.config.get("similarity_threshold", 40) / 100.0
-                        sim_ratio = self.get_similarity(source_text, processed_output)
-                        
-                        if sim_ratio > similarity_threshold:
-                            self.root.after(0, lambda f=filename, a=attempt, s=sim_ratio: 
-                                          self.log_message(f"⚠️ [{f}] 第{a}次失败：相似度{s:.2%}过高"))
-                            if attempt < self.config.get("max_retries", 3):
-                                time.sleep(2)
-                                continue
-                            else:
-                                raise Exception(f"相似度过高（{sim_ratio:.2%}），疑似复读原文")
-                        
-                        final_result = self.apply_regex_rules(processed_output)
-                        
-                        out_filename = filename.replace('.txt', '_processed.txt')
-                        result_file = os.path.join(task_folder, out_filename)
-                        with open(result_file, 'w', encoding='utf-8') as f:
-                            f.write(final_result)
-                        
-                        self.root.after(0, lambda f=filename, s=sim_ratio: 
-                                      self.log_message(f"✅ [{f}] 处理成功！相似度: {s:.2%}"))
-                        self.root.after(0, lambda f=filename: self.update_file_status(f, "success"))
-                        return {"status": "success", "filename": filename}
+                def on_result(result):
+                    results.append(result)
+                    self.root.after(0, lambda c=len(results), t=len(file_list): self.update_progress(c, t))
+                
+                engine_msg = self.run_async_batch(folder_path, file_list, prompt, task_folder, "", on_result)
+                success_count = sum(1 for r in results if r and r["status"] == "success")
+                error_count = len(results) - success_count
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = []
                     
-                    except Exception as e:
-                        if attempt < self.config.get("max_retries", 3):
-                            self.root.after(0, lambda f=filename, a=attempt, err=str(e): 
-                                          self.log_message(f"❌ [{f}] 第{a}次失败: {err}"))
-                            time.sleep(2)
+                    for idx, f in enumerate(file_list):
+                        self.pause_event.wait()
+                        future = executor.submit(self.process_single_file, folder_path, f, prompt, task_folder, "")
+                        futures.append((idx, future))
+                    
+                    for i, (idx, future) in enumerate(futures, 1):
+                        result = future.result()
+                        if result and result["status"] == "success":
+                            success_count += 1
                         else:
-                            self.root.after(0, lambda f=filename, err=str(e): 
-                                          self.log_message(f"🚫 [{f}] 处理失败: {err}"))
-                            self.root.after(0, lambda f=filename: self.update_file_status(f, "error"))
-                            
-                            error_file = os.path.join(task_folder, filename.replace('.txt', '_error.txt'))
-                            with open(error_file, 'w', encoding='utf-8') as f:
-                                f.write(f"处理失败\n错误: {str(e)}\n时间: {datetime.now()}")
-                            return {"status": "error", "filename": filename}
-            
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = []
-                
-                for idx, f in enumerate(file_list):
-                    self.pause_event.wait()
-                    future = executor.submit(process_single_file, f)
-                    futures.append((idx, future))
-                
-                for i, (idx, future) in enumerate(futures, 1):
-                    result = future.result()
-                    if result and result["status"] == "success":
-                        success_count += 1
-                    else:
-                        error_count += 1
-                    self.root.after(0, lambda c=i, t=len(file_list): self.update_progress(c, t))
+                            error_count += 1
+                        self.root.after(0, lambda c=i, t=len(file_list): self.update_progress(c, t))
+                engine_msg = self.http_pool.format_stats(since=http_stats)
             
             self.processing_completed = True
             
@@ -1779,6 +2107,9 @@ class MainApplication:
             
             final_msg = f"✅ 批量处理完成！成功: {success_count}, 失败: {error_count}, 总计: {len(file_list)}"
             self.root.after(0, lambda: self.log_message(final_msg))
+            self.root.after(0, lambda msg=engine_msg: self.log_message(msg))
+            if concurrency.adaptive:
+                self.root.after(0, lambda msg=concurrency.format_stats(since=concurrency_mark): self.log_message(msg))
             result_msg = final_msg + f"\n\n结果保存在:\n{task_folder}"
             self.root.after(0, lambda msg=result_msg: messagebox.showinfo("完成", msg))
         
@@ -1793,8 +2124,178 @@ class MainApplication:
             self.root.after(0, lambda: setattr(self, 'is_paused', False))
             self.root.after(0, lambda: self.pause_event.set())
     
-    def call_llm_api(self, prompt, text_content):
-        """调用大模型API处理文本"""
+    def prepare_concurrency(self):
+        """取本次处理使用的并发控制器。
+        开启自适应并发时从并发数起步、在 1 到并发上限之间自动调整，并沿用上一轮学到的值；
+        关闭时固定为并发数。并发配置或接口配置（地址、密钥、模型、超时）改变后重新创建，
+        换了接口时不沿用旧接口学到的并发数。
+        """
+        max_workers = self.config.get("max_workers", 2)
+        api = tuple(self.config.get(name) for name in ("api_url", "api_key", "selected_model", "timeout"))
+        if self.config.get("adaptive_concurrency"):
+            key = ("adaptive", max_workers, max(max_workers, self.config.get("max_concurrency", 32)), api)
+        else:
+            key = ("fixed", max_workers, max_workers, api)
+        if self.concurrency is None or self.concurrency_key != key:
+            def on_change(old, new, reason):
+                arrow = "↑" if new > old else "↓"
+                self.root.after(0, lambda: self.log_message(f"🎚️ 并发数 {old} {arrow} {new}：{reason}"))
+            
+            minimum = 1 if key[0] == "adaptive" else max_workers
+            self.concurrency = AdaptiveConcurrency(max_workers, key[2], minimum=minimum, on_change=on_change)
+            self.concurrency_key = key
+            if self.concurrency.adaptive:
+                self.root.after(0, lambda: self.log_message(f"🎚️ 自适应并发：从 {max_workers} 开始，上限 {key[2]}"))
+        return self.concurrency
+    
+    def run_async_batch(self, folder_path, file_list, prompt, output_folder, log_prefix, on_result, should_stop=None):
+        """用 asyncio 引擎处理 file_list，在当前工作线程里运行事件循环。
+        同时处理的文件数不超过并发上限（信号量），其中在途的请求数再由并发控制器限制，
+        每个文件处理完时调用 on_result(结果)。
+        返回引擎统计的日志文本。
+        """
+        max_workers = self.concurrency.maximum
+        
+        async def run():
+            client = AsyncLLMClient(max_workers, self.config["timeout"])
+            semaphore = asyncio.Semaphore(max_workers)
+            try:
+                tasks = [asyncio.create_task(self._process_file_async(client, semaphore, folder_path, f, prompt,
+                                                                      output_folder, log_prefix, should_stop))
+                         for f in file_list]
+                for task in asyncio.as_completed(tasks):
+                    on_result(await task)
+            finally:
+                await client.aclose()
+            return client.format_stats()
+        
+        return asyncio.run(run())
+    
+    # ---------- 单个文件的处理步骤（线程池引擎和 asyncio 引擎共用） ----------
+    def _mark_file_processing(self, filename):
+        self.root.after(0, lambda: self.update_current_file(filename, "processing"))
+        self.root.after(0, lambda: self.update_file_status(filename, "processing"))
+    
+    def _read_source_text(self, folder_path, filename):
+        """读取待处理的原文，为空时抛 ValueError"""
+        with open(os.path.join(folder_path, filename), 'r', encoding='utf-8') as f:
+            source_text = f.read().strip()
+        if not source_text:
+            raise ValueError("文件内容为空")
+        return source_text
+    
+    def _check_output(self, source_text, result, filename, attempt, log_prefix):
+        """后处理 API 返回的文本并检查与原文的相似度，返回 (处理后文本, 相似度)。
+        相似度过高时记日志：还能重试时返回 None，已是最后一次则抛异常
+        """
+        processed_output = self.post_process_format(result)
+        similarity_threshold = self.config.get("similarity_threshold", 40) / 100.0
+        sim_ratio = self.get_similarity(source_text, processed_output)
+        if sim_ratio > similarity_threshold:
+            self.root.after(0, lambda f=filename, a=attempt, s=sim_ratio: 
+                          self.log_message(f"⚠️ {log_prefix}[{f}] 第{a}次失败：相似度{s:.2%}过高"))
+            if attempt < self.config.get("max_retries", 3):
+                return None
+            raise Exception(f"相似度过高（{sim_ratio:.2%}），疑似复读原文")
+        return processed_output, sim_ratio
+    
+    def _save_processed(self, output_folder, filename, processed_output, sim_ratio, log_prefix):
+        """应用正则规则后写出结果文件，返回成功的结果"""
+        final_result = self.apply_regex_rules(processed_output)
+        
+        out_filename = filename.replace('.txt', '_processed.txt')
+        result_file = os.path.join(output_folder, out_filename)
+        with open(result_file, 'w', encoding='utf-8') as f:
+            f.write(final_result)
+        
+        self.root.after(0, lambda f=filename, s=sim_ratio: 
+                      self.log_message(f"✅ {log_prefix}[{f}] 处理成功！相似度: {s:.2%}"))
+        self.root.after(0, lambda f=filename: self.update_file_status(f, "success"))
+        return {"status": "success", "filename": filename}
+    
+    def _log_retry(self, filename, attempt, error, log_prefix):
+        self.root.after(0, lambda f=filename, a=attempt, err=str(error): 
+                      self.log_message(f"❌ {log_prefix}[{f}] 第{a}次失败: {err}"))
+    
+    def _save_error(self, output_folder, filename, error, log_prefix):
+        """重试用尽后记录失败并写出错误文件，返回失败的结果"""
+        self.root.after(0, lambda f=filename, err=str(error): 
+                      self.log_message(f"🚫 {log_prefix}[{f}] 处理失败: {err}"))
+        self.root.after(0, lambda f=filename: self.update_file_status(f, "error"))
+        
+        error_file = os.path.join(output_folder, filename.replace('.txt', '_error.txt'))
+        with open(error_file, 'w', encoding='utf-8') as f:
+            f.write(f"处理失败\n错误: {str(error)}\n时间: {datetime.now()}")
+        return {"status": "error", "filename": filename}
+    
+    def process_single_file(self, folder_path, filename, prompt, output_folder, log_prefix, should_stop=None):
+        """线程池引擎处理单个文件：失败或相似度过高时重试，结果写到 output_folder"""
+        if should_stop and should_stop():
+            return {"status": "stopped", "filename": filename}
+        self._mark_file_processing(filename)
+        
+        max_retries = self.config.get("max_retries", 3)
+        for attempt in range(1, max_retries + 1):
+            if should_stop and should_stop():
+                return {"status": "stopped", "filename": filename}
+            
+            try:
+                source_text = self._read_source_text(folder_path, filename)
+                result = self.call_llm_api(prompt, source_text)
+                checked = self._check_output(source_text, result, filename, attempt, log_prefix)
+                if checked is None:
+                    time.sleep(2)
+                    continue
+                return self._save_processed(output_folder, filename, *checked, log_prefix)
+            
+            except Exception as e:
+                if attempt < max_retries:
+                    self._log_retry(filename, attempt, e, log_prefix)
+                    time.sleep(2)
+                else:
+                    return self._save_error(output_folder, filename, e, log_prefix)
+    
+    async def _process_file_async(self, client, semaphore, folder_path, filename, prompt, output_folder,
+                                  log_prefix, should_stop=None):
+        """asyncio 引擎处理单个文件，步骤与 process_single_file 相同；
+        只有 API 请求是异步的，文件读写和相似度计算放到线程里做，不阻塞其它在途请求
+        """
+        async with semaphore:
+            # 暂停时不再发起新的文件，已在途的请求照常完成
+            while not self.pause_event.is_set():
+                await asyncio.sleep(0.2)
+            if should_stop and should_stop():
+                return {"status": "stopped", "filename": filename}
+            self._mark_file_processing(filename)
+            
+            max_retries = self.config.get("max_retries", 3)
+            for attempt in range(1, max_retries + 1):
+                if should_stop and should_stop():
+                    return {"status": "stopped", "filename": filename}
+                
+                try:
+                    source_text = await asyncio.to_thread(self._read_source_text, folder_path, filename)
+                    api_url, headers, payload = self.build_llm_request(prompt, source_text)
+                    async with self.concurrency.slot_async():
+                        data = await client.post_json(api_url, headers, payload)
+                    result = self.parse_llm_response(data)
+                    checked = await asyncio.to_thread(self._check_output, source_text, result, filename, attempt,
+                                                      log_prefix)
+                    if checked is None:
+                        await asyncio.sleep(2)
+                        continue
+                    return await asyncio.to_thread(self._save_processed, output_folder, filename, *checked,
+                                                   log_prefix)
+                
+                except Exception as e:
+                    if attempt < max_retries:
+                        self._log_retry(filename, attempt, e, log_prefix)
+                        await asyncio.sleep(2)
+                    else:
+                        return await asyncio.to_thread(self._save_error, output_folder, filename, e, log_prefix)
+    
+    def build_llm_request(self, prompt, text_content):
+        """组装大模型API请求，返回 (接口地址, 请求头, 请求体)"""
         base_url = self.config["api_url"].rstrip("/")
         if "/v1/chat/completions" in base_url:
             api_url = base_url
@@ -1829,20 +2330,32 @@ class MainApplication:
             "presence_penalty": self.config.get("presence_penalty", 1.2),
             "frequency_penalty": self.config.get("frequency_penalty", 1.2)
         }
-        
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=payload,
-            timeout=self.config["timeout"]
-        )
-        response.raise_for_status()
-        data = response.json()
-        
+        return api_url, headers, payload
+    
+    def parse_llm_response(self, data):
+        """从API返回的 JSON 中取出生成的文本"""
         if "choices" in data and len(data["choices"]) > 0:
             return data["choices"][0]["message"]["content"]
         else:
             raise Exception("API返回格式错误")
+    
+    def call_llm_api(self, prompt, text_content):
+        """调用大模型API处理文本"""
+        api_url, headers, payload = self.build_llm_request(prompt, text_content)
+        
+        concurrency = self.prepare_concurrency()
+        # 复用该接口的连接池，重试和并发的各个文件都不再重新握手
+        session = self.http_pool.get(api_url, concurrency.maximum)
+        with concurrency.slot():
+            response = session.post(
+                api_url,
+                headers=headers,
+                json=payload,
+                timeout=self.config["timeout"]
+            )
+            response.raise_for_status()
+            data = response.json()
+        return self.parse_llm_response(data)
 
 if __name__ == "__main__":
     app = MainApplication()
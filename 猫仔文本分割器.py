@@ -2,18 +2,331 @@ import os
 import re
 import sys
 import json
-import tkinter as tk
-from tkinter import filedialog, messagebox
+import codecs
+import shutil
+import hashlib
+import mmap
+import itertools
+import glob
+import time
+import argparse
+import tempfile
+import threading
+import queue
+import zlib
+import random
+from array import array
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime
 from typing import List
 
-import tiktoken
-
 
 # ================== 默认配置 ==================
 DEFAULT_CHUNK_SIZE = 2500
 DEFAULT_OVERLAP_RATE = 0.05
 DEFAULT_MIN_CHUNK_RATIO = 0.2
+DEFAULT_MAX_TOKENS = 5000               # 模式 B 的最大 Token 上限
+DEFAULT_ENCODING = "cl100k_base"
+DEFAULT_WORKERS = os.cpu_count() or 1   # 批量编码线程数 / 章节细分进程数
+DEFAULT_POOL_SIZE = 2                   # 猫仔多文伴侣的默认并发数（自动调参时让区块数为其整数倍）
+COUNT_BATCH_SIZE = 256                  # 批量计数时每批的章节数
+UI_POLL_MS = 50                         # 界面主线程检查后台线程消息的间隔（毫秒）
+
+
+# ================== 分词器注册表 ==================
+# 本地词表目录：可放入 cl100k_base.tiktoken / o200k_base.tiktoken 等文件，无网络环境也能加载
+TOKENIZER_DIR = os.environ.get(
+    "MAOZAI_TOKENIZER_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tokenizers"),
+)
+TIKTOKEN_BPE_URL = "https://openaipublic.blob.core.windows.net/encodings/{name}.tiktoken"
+
+_TOKENIZERS = {}
+_TOKENIZER_LOCK = threading.Lock()
+
+
+class TiktokenTokenizer:
+    """tiktoken 编码的包装，额外缓存每个 token 的字符长度表用于计算偏移"""
+
+    def __init__(self, encoding):
+        self.name = encoding.name
+        self.encoding = encoding
+        self._char_table = None
+
+    def encode(self, text: str) -> List[int]:
+        return self.encoding.encode(text, disallowed_special=())
+
+    def encode_batch(self, texts: List[str], num_threads: int = DEFAULT_WORKERS) -> List[List[int]]:
+        return self.encoding.encode_batch(texts, num_threads=num_threads, disallowed_special=())
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text))
+
+    def count_batch(self, texts: List[str], num_threads: int = DEFAULT_WORKERS) -> List[int]:
+        return [len(tokens) for tokens in self.encode_batch(texts, num_threads)]
+
+    def _token_char_table(self):
+        if self._char_table is None:
+            n_vocab = self.encoding.n_vocab
+            char_lens = [0] * n_vocab
+            starts_mid_char = [0] * n_vocab
+            for token in range(n_vocab):
+                try:
+                    data = self.encoding.decode_single_token_bytes(token)
+                except KeyError:
+                    continue
+                char_lens[token] = sum(1 for b in data if not 0x80 <= b < 0xC0)
+                starts_mid_char[token] = 1 if data and 0x80 <= data[0] < 0xC0 else 0
+            self._char_table = (char_lens, starts_mid_char)
+        return self._char_table
+
+    def token_offsets(self, text: str) -> array:
+        """每个 token 的起始字符位置"""
+        tokens = self.encode(text)
+        char_lens, starts_mid_char = self._token_char_table()
+        # 以续字节开头的 token 属于前一个字符，起点回退一位
+        char_ends = itertools.accumulate(map(char_lens.__getitem__, tokens), initial=0)
+        return array('q', (
+            pos - flag for pos, flag in zip(char_ends, map(starts_mid_char.__getitem__, tokens))
+        ))
+
+
+class HFTokenizer:
+    """本地 HuggingFace tokenizer.json（需要安装 tokenizers 包）"""
+
+    def __init__(self, path: str):
+        try:
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise RuntimeError("使用 tokenizer.json 需要先安装 tokenizers：pip install tokenizers")
+        self.name = path
+        self.tokenizer = Tokenizer.from_file(path)
+
+    def encode(self, text: str) -> List[int]:
+        return self.tokenizer.encode(text, add_special_tokens=False).ids
+
+    def encode_batch(self, texts: List[str], num_threads: int = DEFAULT_WORKERS) -> List[List[int]]:
+        # tokenizers 自带并行，线程数由 RAYON_NUM_THREADS 控制
+        return [e.ids for e in self.tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text))
+
+    def count_batch(self, texts: List[str], num_threads: int = DEFAULT_WORKERS) -> List[int]:
+        return [len(tokens) for tokens in self.encode_batch(texts, num_threads)]
+
+    def token_offsets(self, text: str) -> array:
+        """每个 token 的起始字符位置"""
+        offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+        return array('q', (start for start, _ in offsets))
+
+
+def _resolve_hf_tokenizer_path(name: str):
+    for base in ("", TOKENIZER_DIR):
+        path = os.path.join(base, name)
+        if os.path.isdir(path):
+            path = os.path.join(path, "tokenizer.json")
+        if path.endswith(".json") and os.path.isfile(path):
+            return path
+    return None
+
+
+def _tiktoken_cache_dir() -> str:
+    # 与 tiktoken 自己的查找顺序一致；返回空字符串表示用户关闭了缓存
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        return os.environ["TIKTOKEN_CACHE_DIR"]
+    if "DATA_GYM_CACHE_DIR" in os.environ:
+        return os.environ["DATA_GYM_CACHE_DIR"]
+    return os.path.join(tempfile.gettempdir(), "data-gym-cache")
+
+
+def _load_tiktoken(name: str):
+    # tiktoken 按 URL 的 sha1 在它的缓存目录中查找词表。用户放在 TOKENIZER_DIR 的 <name>.tiktoken
+    # 只作为额外来源：缓存里还没有时复制过去（哈希仍由 tiktoken 校验），不改环境变量，原有缓存照常使用
+    cache_dir = _tiktoken_cache_dir()
+    local_file = os.path.join(TOKENIZER_DIR, f"{name}.tiktoken")
+    if cache_dir and os.path.isfile(local_file):
+        cache_key = hashlib.sha1(TIKTOKEN_BPE_URL.format(name=name).encode()).hexdigest()
+        cache_file = os.path.join(cache_dir, cache_key)
+        if not os.path.exists(cache_file):
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                shutil.copyfile(local_file, cache_file)
+            except OSError:
+                pass  # 缓存目录不可写时交给 tiktoken 按原流程处理
+    import tiktoken  # 用到时才导入，避免拖慢启动
+    return TiktokenTokenizer(tiktoken.get_encoding(name))
+
+
+def get_tokenizer(encoding_name: str = None):
+    """按名称取分词器，每个进程只加载一次。
+    encoding_name 可以是 tiktoken 编码名（cl100k_base、o200k_base 等），
+    也可以是本地 tokenizer.json 文件或其所在目录。加载失败直接抛错，不再回退到字数统计。
+    """
+    name = encoding_name or DEFAULT_ENCODING
+    tokenizer = _TOKENIZERS.get(name)
+    if tokenizer is not None:
+        return tokenizer
+    with _TOKENIZER_LOCK:
+        tokenizer = _TOKENIZERS.get(name)
+        if tokenizer is None:
+            hf_path = _resolve_hf_tokenizer_path(name)
+            try:
+                tokenizer = HFTokenizer(hf_path) if hf_path else _load_tiktoken(name)
+            except Exception as e:
+                raise RuntimeError(
+                    f"无法加载分词器 {name}：{e}\n"
+                    f"离线环境请将 {name}.tiktoken 或 tokenizer.json 放入 {TOKENIZER_DIR}"
+                ) from e
+            _TOKENIZERS[name] = tokenizer
+    return tokenizer
+
+
+# ================== Token 快速估算 ==================
+# 不做 BPE 编码，只按字符类别计数：文本转成 UTF-8 后用 bytes.translate 把每个字符的首字节换成类别码
+# （续字节直接删掉），各类别的字符数和连续段数都由 bytes.count 得到，不逐字符进入 Python。
+# 每类的 token 比例用文件中抽样的片段对照真实分词器校准，用于预览、初步规划和进度估计，
+# 需要精确数时（实际分块）仍然完整编码。
+ESTIMATE_SAMPLE_PIECES = 48     # 校准抽样的片段数
+ESTIMATE_PIECE_CHARS = 2000     # 每个片段的字符数
+ESTIMATE_RIDGE = 0.01           # 校准时向默认比例收缩的强度，样本里很少出现的类别基本保持默认值
+
+# 特征名和默认比例（每个计数对应的 token 数，大致按 cl100k_base）
+ESTIMATE_FEATURES = ('words', 'letters', 'numbers', 'digits', 'spaces', 'punct',
+                     'extended', 'symbol', 'kana', 'cjk', 'hangul', 'fullwidth', 'astral')
+ESTIMATE_PRIORS = (1.0, 0.02, 0.5, 0.25, 0.3, 0.8, 0.7, 0.8, 1.0, 1.2, 0.9, 1.0, 1.5)
+
+
+def _script_tables():
+    # 类别码：L 拉丁字母，D 数字，S 空白，P 其他 ASCII，E 双字节字符（西欧、希腊、西里尔等），
+    # T E0-E2 开头（通用标点、符号），K E3（中文标点、假名），C E4-E9（常用汉字），
+    # H EA-ED（谚文），F EE-EF（全角字符），X 四字节字符（表情、扩展汉字）
+    table = bytearray(b'P' * 256)
+    for ranges, code in ((b'AZaz', b'L'), (b'09', b'D'), (b'\t\r  ', b'S'),
+                         (b'\xc0\xdf', b'E'), (b'\xe0\xe2', b'T'), (b'\xe3\xe3', b'K'), (b'\xe4\xe9', b'C'),
+                         (b'\xea\xed', b'H'), (b'\xee\xef', b'F'), (b'\xf0\xff', b'X')):
+        for lo, hi in zip(ranges[::2], ranges[1::2]):
+            table[lo:hi + 1] = code * (hi - lo + 1)
+    # 连续段计数用：目标类别为 1、其余为 0，段数 = "01" 的个数（加上开头的一段）
+    runs = {code: bytes(ord('1') if c == code[0] else ord('0') for c in range(256)) for code in (b'L', b'D', b'S')}
+    return bytes(table), runs
+
+
+_SCRIPT_TABLE, _RUN_TABLES = _script_tables()
+_CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+
+
+def script_features(text: str) -> List[int]:
+    """文本各字符类别的计数，顺序同 ESTIMATE_FEATURES"""
+    codes = text.encode('utf-8', 'surrogatepass').translate(_SCRIPT_TABLE, _CONTINUATION_BYTES)
+    runs = {code: codes.translate(table).count(b'01') + (codes[:1] == code) for code, table in _RUN_TABLES.items()}
+    return [runs[b'L'], codes.count(b'L'), runs[b'D'], codes.count(b'D'), runs[b'S'], codes.count(b'P'),
+            codes.count(b'E'), codes.count(b'T'), codes.count(b'K'), codes.count(b'C'), codes.count(b'H'),
+            codes.count(b'F'), codes.count(b'X')]
+
+
+def _fit_ratios(features: List[List[int]], exact: List[int]) -> List[float]:
+    """带收缩的最小二乘：min Σ(真实 - 估算)² + λΣ(比例 - 默认值)²，解正规方程（特征只有十几个）"""
+    k = len(ESTIMATE_PRIORS)
+    a = [[sum(f[i] * f[j] for f in features) for j in range(k)] for i in range(k)]
+    b = [sum(f[i] * y for f, y in zip(features, exact)) for i in range(k)]
+    ridge = ESTIMATE_RIDGE * max(1.0, sum(a[i][i] for i in range(k)) / k)
+    for i in range(k):
+        a[i][i] += ridge
+        b[i] += ridge * ESTIMATE_PRIORS[i]
+    # 高斯消元（列主元）
+    for col in range(k):
+        pivot = max(range(col, k), key=lambda r: abs(a[r][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        b[col], b[pivot] = b[pivot], b[col]
+        for r in range(col + 1, k):
+            factor = a[r][col] / a[col][col]
+            if factor:
+                for c in range(col, k):
+                    a[r][c] -= factor * a[col][c]
+                b[r] -= factor * b[col]
+    ratios = [0.0] * k
+    for i in reversed(range(k)):
+        ratios[i] = (b[i] - sum(a[i][j] * ratios[j] for j in range(i + 1, k))) / a[i][i]
+    return [max(0.0, r) for r in ratios]
+
+
+class TokenEstimator:
+    """按字符类别估算 token 数：tokens ≈ Σ 各类别计数 × 比例。
+    calibrate() 用抽样片段对照真实分词器拟合比例，error 为留出片段上的最大相对误差（未校准时为 None），
+    可作为任意不短于一个片段的文本的误差上界；整篇总数的误差通常小得多。
+    """
+
+    def __init__(self, ratios=ESTIMATE_PRIORS, error: float = None, tokenizer_name: str = None):
+        self.ratios = list(ratios)
+        self.error = error
+        self.tokenizer_name = tokenizer_name
+
+    @classmethod
+    def calibrate(cls, tokenizer, samples: List[str]):
+        samples = [sample for sample in samples if sample.strip()]
+        features = [script_features(sample) for sample in samples]
+        exact = tokenizer.count_batch(samples)
+        # 误差：两半样本互相校准、互相检验
+        errors = []
+        for held in (0, 1):
+            half = cls(_fit_ratios(features[1 - held::2], exact[1 - held::2]))
+            errors.extend(abs(half.estimate(f) - y) / y for f, y in zip(features[held::2], exact[held::2]) if y)
+        return cls(_fit_ratios(features, exact), max(errors, default=None), tokenizer.name)
+
+    def estimate(self, features: List[int]) -> int:
+        """按 script_features 的计数（可以是多段文本的累加）估算 token 数"""
+        return round(sum(r * n for r, n in zip(self.ratios, features)))
+
+    def count(self, text: str) -> int:
+        return self.estimate(script_features(text))
+
+
+def estimate_file_tokens(file_path: str, encoding_name: str = None, encoding: str = None) -> dict:
+    """快速估算文件的 token 数：读一遍文件累加各类别计数，同时均匀抽取片段校准比例，不做完整编码。
+    返回 {'tokens', 'error', 'chars', 'tokenizer', 'ratios', 'seconds'}，error 为相对误差上界（如 0.03）。
+    """
+    start = time.perf_counter()
+    tokenizer = get_tokenizer(encoding_name)
+
+    def scan(blocks):
+        totals = [0] * len(ESTIMATE_FEATURES)
+        samples = []
+        pieces = chars = 0
+        rng = random.Random(0)
+        for block in blocks:
+            chars += len(block)
+            totals = [a + b for a, b in zip(totals, script_features(block))]
+            # 蓄水池抽样：全文每个片段被选中的概率相同，不必预先知道总长
+            for pos in range(0, len(block), ESTIMATE_PIECE_CHARS):
+                pieces += 1
+                if len(samples) < ESTIMATE_SAMPLE_PIECES:
+                    samples.append(block[pos:pos + ESTIMATE_PIECE_CHARS])
+                else:
+                    j = rng.randrange(pieces)
+                    if j < ESTIMATE_SAMPLE_PIECES:
+                        samples[j] = block[pos:pos + ESTIMATE_PIECE_CHARS]
+        return totals, samples, chars
+
+    try:
+        totals, samples, chars = scan(iter_text_blocks(file_path, encoding or detect_file_encoding(file_path)))
+    except UnicodeDecodeError:
+        # 探测的编码中途解码失败，改为整篇读取（read_text_file 会换用其他编码）
+        totals, samples, chars = scan([read_text_file(file_path)[0]])
+    estimator = TokenEstimator.calibrate(tokenizer, samples)
+    return {
+        'tokens': estimator.estimate(totals),
+        'error': estimator.error,
+        'chars': chars,
+        'tokenizer': tokenizer.name,
+        'ratios': dict(zip(ESTIMATE_FEATURES, (round(r, 4) for r in estimator.ratios))),
+        'seconds': round(time.perf_counter() - start, 4),
+    }
+
+
+def format_token_estimate(estimate: dict) -> str:
+    error = f"，误差 ±{estimate['error']:.1%} 以内" if estimate['error'] is not None else ""
+    return f"约 {estimate['tokens']:,} tokens（估算{error}）"
 
 
 # ================== 公共函数 ==================
@@ -24,52 +337,167 @@ def create_output_folders():
     return out_dir
 
 
-def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
-    try:
-        encoding = tiktoken.get_encoding(encoding_name)
-        return len(encoding.encode(text))
-    except Exception as e:
-        print(f"警告: 无法使用tiktoken计算token，回退到字数统计。错误: {e}")
-        return len(text)
+def count_tokens(text: str, encoding_name: str = None) -> int:
+    return get_tokenizer(encoding_name).count(text)
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds + 0.5)
+    if seconds < 60:
+        return f"{seconds} 秒"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes} 分 {seconds} 秒"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} 小时 {minutes} 分"
+
+
+class TokenOffsetMap:
+    """整篇文本只编码一次，记录每个 token 的起始字符位置。
+    块终点、重叠起点和 token 数都从这张表上查，不再按平均字符数估算或反复编码。
+    """
+
+    def __init__(self, text: str, tokenizer):
+        self.offsets = tokenizer.token_offsets(text)
+        self.total_tokens = len(self.offsets)
+        self.n_chars = len(text)
+
+    @classmethod
+    def from_offsets(cls, offsets, text_len: int):
+        """直接包装已有的 token 起始位置表（array 或其 memoryview 切片，不复制），不再编码"""
+        token_map = cls.__new__(cls)
+        token_map.offsets = offsets
+        token_map.total_tokens = len(offsets)
+        token_map.n_chars = text_len
+        return token_map
+
+    def char_at(self, token_pos: int) -> int:
+        """第 token_pos 个 token 的起始字符位置（越界时为文本末尾）"""
+        if token_pos >= self.total_tokens:
+            return self.n_chars
+        return self.offsets[max(0, token_pos)]
+
+    def token_at(self, char_pos: int) -> int:
+        """起点在 char_pos 之前的 token 个数"""
+        return bisect_left(self.offsets, char_pos, 0, self.total_tokens)
+
+    def count(self, start: int, end: int) -> int:
+        """字符区间 [start, end) 内的 token 数"""
+        return self.token_at(end) - self.token_at(start)
+
+
+# 文本规范化规则：名称 -> 说明。规则都只删除或合并空白，可按需组合开关
+NORMALIZE_RULES = {
+    'collapse_spaces': '连续空格/制表符合并为一个空格',
+    'strip_after_punct': '去掉标点后的空白',
+    'strip_before_closing': '去掉右括号、引号和标点前的空白',
+    'strip_after_opening': '去掉左括号后的空白',
+}
+_PUNCT_BEFORE_SPACE = '。！？.!?,;:；，：、'
+_CLOSING_AFTER_SPACE = '）】」』、。，！？；："\''
+_OPENING_BEFORE_SPACE = '(（【「『'
+
+
+class TextNormalizer:
+    """单遍文本规范化：段落之间统一为一个空行，段首尾空白去掉，段内按启用的规则处理空白。
+    所有规则编译成一个正则，只匹配需要改动的空白段，整篇文本扫描一次即可，
+    结果与逐段依次执行各条 re.sub 相同。
+    """
+
+    def __init__(self, rules=None):
+        self.rules = tuple(NORMALIZE_RULES if rules is None else rules)
+        unknown = [r for r in self.rules if r not in NORMALIZE_RULES]
+        if unknown:
+            raise ValueError(f"未知的规范化规则: {', '.join(unknown)}")
+        alternatives = [r'(?P<edge>\A\s+|\s+\Z)', r'(?P<para>\s*\n\s*\n\s*)']
+        before = ''.join(
+            chars for rule, chars in (('strip_after_punct', _PUNCT_BEFORE_SPACE),
+                                      ('strip_after_opening', _OPENING_BEFORE_SPACE))
+            if rule in self.rules
+        )
+        if before:
+            alternatives.append(r'(?<=[%s])\s+' % re.escape(before))
+        if 'strip_before_closing' in self.rules:
+            alternatives.append(r'\s+(?=[%s])' % re.escape(_CLOSING_AFTER_SPACE))
+        if 'collapse_spaces' in self.rules:
+            alternatives.append(r'(?P<spaces>(?: [ \t]|\t)[ \t]*)')
+        # 所有分支都从空白字符开始，先用前瞻快速跳过非空白位置
+        self._pattern = re.compile(r'(?=\s)(?:%s)' % '|'.join(alternatives))
+
+    @staticmethod
+    def _replace(match):
+        if match.lastgroup == 'para':
+            return '\n\n'
+        if match.lastgroup == 'spaces':
+            return ' '
+        return ''
+
+    def normalize(self, text: str) -> str:
+        return self._pattern.sub(self._replace, text)
+
+
+DEFAULT_NORMALIZER = TextNormalizer()
+
+
+def preserve_formatting(text: str, normalizer: TextNormalizer = None) -> str:
+    return (normalizer or DEFAULT_NORMALIZER).normalize(text)
+
+
+# 句末标点及其后的空白 | 空行（连续空行只记第一个空行的行尾）
+_BOUNDARY_PATTERN = re.compile(r'([。．！？.!?])(\s*)|(?:\A|\n)([^\S\n]*\n)(?:[^\S\n]*\n)*')
+
+
+class BoundaryIndex:
+    """有序的句子/段落边界位置表（array 存储），prev/next 查找为 O(log n)"""
+
+    __slots__ = ('positions',)
+
+    def __init__(self, positions: array):
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __getitem__(self, i):
+        return self.positions[i]
+
+    def prev(self, pos: int):
+        """不超过 pos 的最后一个边界，没有则返回 None"""
+        i = bisect_right(self.positions, pos)
+        return self.positions[i - 1] if i else None
+
+    def next(self, pos: int):
+        """大于 pos 的第一个边界，没有则返回 None"""
+        i = bisect_right(self.positions, pos)
+        return self.positions[i] if i < len(self.positions) else None
+
 
+def find_sentence_boundaries(text: str) -> BoundaryIndex:
+    """一次正则扫描得到全部句子边界和段落边界（空行之后），末尾总包含 len(text)"""
+    boundaries = array('q')
+    text_len = len(text)
 
-def preserve_formatting(text: str) -> str:
-    paragraphs = re.split(r'(\n\s*\n)', text)
-    cleaned_paragraphs = []
-    for para in paragraphs:
-        if not para.strip():
+    def add(pos):
+        pos = min(pos, text_len)
+        if not boundaries or boundaries[-1] < pos:
+            boundaries.append(pos)
+
+    for match in _BOUNDARY_PATTERN.finditer(text):
+        if match.group(1) is None:
+            add(match.end(3))
             continue
-        para = re.sub(r'[ \t]+', ' ', para)
-        para = re.sub(r'([。！？.!?,;:；，：、])\s+', r'\1', para)
-        para = re.sub(r'\s+([）】」』、。，！？；："\'])', r'\1', para)
-        para = re.sub(r'([\(（【「『])\s+', r'\1', para)
-        cleaned_paragraphs.append(para.strip())
-    return '\n\n'.join([p for p in cleaned_paragraphs if p])
-
-
-def find_sentence_boundaries(text: str) -> List[int]:
-    boundaries = []
-    lines = text.split('\n')
-    current_pos = 0
-    line_positions = []
-    for line in lines:
-        line_positions.append((current_pos, current_pos + len(line) + 1))
-        current_pos += len(line) + 1
-
-    paragraph_boundaries = []
-    prev_was_empty = False
-    for i, (start_pos, end_pos) in enumerate(line_positions):
-        line_content = text[start_pos:end_pos-1]
-        is_empty = not line_content.strip()
-        if is_empty and not prev_was_empty:
-            paragraph_boundaries.append(end_pos)
-        prev_was_empty = is_empty
-
-    for match in re.finditer(r'[。．！？\.\!\?]\s*', text):
-        end_pos = match.end()
         start_pos = match.start()
-        char_before = text[start_pos]
-        if char_before == '.' and start_pos > 0:
+        # 标点后的空白里若含空行，空行行尾也是段落边界
+        spaces = match.group(2)
+        first_newline = spaces.find('\n')
+        if first_newline >= 0:
+            second_newline = spaces.find('\n', first_newline + 1)
+            if second_newline >= 0:
+                add(match.start(2) + second_newline + 1)
+        if text[start_pos] == '.' and start_pos > 0:
             prev_char = text[start_pos-1]
             if prev_char.isupper() or prev_char.isdigit():
                 if start_pos-2 >= 0 and text[start_pos-2] == '.':
@@ -78,64 +506,894 @@ def find_sentence_boundaries(text: str) -> List[int]:
                     continue
             if start_pos >= 2 and text[start_pos-2:start_pos+1] in ['...', '…']:
                 continue
-        boundaries.append(end_pos)
+        add(match.end())
 
-    for pos in paragraph_boundaries:
-        if pos not in boundaries:
-            boundaries.append(pos)
-    if len(text) not in boundaries:
-        boundaries.append(len(text))
-    return sorted(set(boundaries))
+    add(text_len)
+    return BoundaryIndex(boundaries)
 
 
-def find_optimal_boundary(text: str, target_pos: int, boundaries: List[int]) -> int:
-    if not boundaries:
+def find_optimal_boundary(text: str, target_pos: int, boundaries, min_pos: int = None) -> int:
+    """取不超过 target_pos 的最近边界，没有时取其后的第一个边界。
+    指定 min_pos 时，若 (min_pos, target_pos] 内没有任何边界（如整段无标点的文本），直接在 target_pos 硬切。
+    """
+    positions = getattr(boundaries, 'positions', boundaries)
+    if not positions:
         return target_pos
-    prev_boundaries = [b for b in boundaries if b <= target_pos]
-    next_boundaries = [b for b in boundaries if b > target_pos]
-    if prev_boundaries:
-        return max(prev_boundaries)
-    elif next_boundaries:
-        return min(next_boundaries)
-    else:
+    i = bisect_right(positions, target_pos)
+    if i and (min_pos is None or positions[i - 1] > min_pos):
+        return positions[i - 1]
+    if min_pos is not None:
         return target_pos
+    if i < len(positions):
+        return positions[i]
+    return target_pos
 
 
-# ================== 模式 A：Token 分块（v1）==================
-def split_text_file_v1(file_path: str, output_folder: str, base_name: str, CHUNK_SIZE, OVERLAP_RATE, MIN_CHUNK_RATIO):
-    encodings = ['utf-8', 'gbk', 'shift_jis', 'utf-16', 'latin1']
-    text = None
-    used_encoding = None
-    for encoding in encodings:
+MERGED_REMAINDER_MARK = "\n\n[合并的剩余内容]\n"
+
+
+class ChunkSpan:
+    """区块只记录位置：正文为 text[start:end]，合并了剩余内容时再接上标记和 text[merged_start:merged_end]。
+    写出时才切片取文本，分块过程中内存占用只与区块数有关。
+    """
+
+    __slots__ = ('start', 'end', 'tokens', 'merged_start', 'merged_end')
+
+    def __init__(self, start: int, end: int, tokens: int):
+        self.start = start
+        self.end = end
+        self.tokens = tokens
+        self.merged_start = None
+        self.merged_end = None
+
+    def merge_remainder(self, start: int, end: int, tokens: int):
+        self.merged_start = start
+        self.merged_end = end
+        self.tokens += tokens
+
+    @property
+    def char_end(self) -> int:
+        return self.end if self.merged_start is None else self.merged_end
+
+    def parts(self, text: str):
+        """区块文本的各段，依次写出即为完整区块"""
+        if self.merged_start is None:
+            return (text[self.start:self.end],)
+        return text[self.start:self.end], MERGED_REMAINDER_MARK, text[self.merged_start:self.merged_end]
+
+    def write_to(self, writer, name: str, text: str, **info):
+        """写出区块，清单记录其 token 数和字符范围（info 为附加的清单字段）"""
+        with writer.open(name, tokens=self.tokens, char_range=[self.start, self.char_end], **info) as f:
+            f.writelines(self.parts(text))
+
+
+def cut_token_chunks(text: str, token_map: TokenOffsetMap, boundaries, max_tokens: int, overlap_tokens: int,
+                     min_chunk_tokens: int, start: int = 0, end: int = None, first_chunk: bool = True,
+                     final: bool = True):
+    """在 text[start:end] 上按 token 切块（模式 A 与模式 C 细分共用）。
+    返回 (块列表 [(起始, 结束, token数)], 下一个起点, 剩余部分)。
+    final=True 时切到 end，剩余不足 min_chunk_tokens 的部分以 (起点, token数) 返回，由调用方并入最后一块；
+    final=False（流式窗口）时只切出离 end 足够远、不受后续文本影响的块，下一个起点之后的内容留给下一个窗口。
+    text 只用于取默认的 end，只有偏移表和边界表时（分块规划）可传 None 并给出 end。
+    """
+    end = len(text) if end is None else end
+    start_token = token_map.token_at(start)
+    total_tokens = token_map.token_at(end) - start_token
+    safe_tokens = 2 * max_tokens + min_chunk_tokens
+    chunks = []
+    remainder = None
+    current_pos = start
+    current_token_pos = 0
+
+    while current_token_pos < total_tokens:
+        if not final and total_tokens - current_token_pos < safe_tokens:
+            break
+        target_end_token_pos = min(current_token_pos + max_tokens, total_tokens)
+        target_end_char_pos = token_map.char_at(start_token + target_end_token_pos)
+        if target_end_char_pos >= end:
+            optimal_end_pos = end
+        else:
+            optimal_end_pos = find_optimal_boundary(text, target_end_char_pos, boundaries, min_pos=current_pos)
+        chunk_tokens = token_map.count(current_pos, optimal_end_pos)
+
+        # 如果块太小且不是第一块，尝试扩展到下一个边界
+        if chunk_tokens < min_chunk_tokens and not (first_chunk and not chunks):
+            next_boundary = boundaries.next(optimal_end_pos)
+            if next_boundary is not None:
+                optimal_end_pos = min(next_boundary, end)
+                chunk_tokens = token_map.count(current_pos, optimal_end_pos)
+        if not final and optimal_end_pos >= end:
+            break
+        chunks.append((current_pos, optimal_end_pos, chunk_tokens))
+
+        # 计算下一个起始位置（带重叠）
+        overlap_start_char = token_map.char_at(start_token + max(current_token_pos, target_end_token_pos - overlap_tokens))
+        next_start_boundary = find_optimal_boundary(text, overlap_start_char, boundaries, min_pos=current_pos)
+        current_pos = max(optimal_end_pos, next_start_boundary)
+        current_token_pos = token_map.token_at(current_pos) - start_token
+
+        # 剩余内容不足最小块，留给调用方合并到上一块
+        remaining_tokens = total_tokens - current_token_pos
+        if final and 0 < remaining_tokens < min_chunk_tokens:
+            remainder = (current_pos, remaining_tokens)
+            current_pos = end
+            break
+
+    return chunks, current_pos, remainder
+
+
+# ================== 均衡分块（动态规划）==================
+SIZE_REPORT_SUFFIX = "_size_report.json"
+
+
+def _fewest_segments(prefix, limit: int, starts):
+    """balanced_partition 的正向贪心：fewest[i] 为前 i 项最少分几段，lows[i] 为以切点 i 结尾的一段
+    最早能从哪个切点开始，oversized[i] 表示第 i 项单独也超限。fewest[-1] 即最少段数"""
+    n = len(prefix) - 1
+    fewest = [0] * (n + 1)
+    lows = [0] * (n + 1)
+    oversized = [False] * (n + 1)
+    lo = 0
+    for i in range(1, n + 1):
+        if prefix[i] - starts[i - 1] > limit:
+            oversized[i] = True
+            lows[i] = i - 1
+            fewest[i] = fewest[i - 1] + 1
+            lo = i
+            continue
+        while prefix[i] - starts[lo] > limit:
+            lo += 1
+        lows[i] = lo
+        fewest[i] = fewest[lo] + 1
+    return fewest, lows, oversized
+
+
+def balanced_partition(prefix, limit: int, starts=None) -> List[int]:
+    """把 n 个连续的项分段，prefix 为各项大小的前缀和（长度 n+1）。
+    从切点 p 开始的一段实际从 starts[p] 算起（默认即 prefix[p]，可更小以计入向前补的重叠），
+    每段大小 prefix[i] - starts[p] 不超过 limit（单项超限时独占一段）。段数固定为贪心求出的最少段数 k，
+    以平均大小为目标，动态规划在所有 k 段切法中选出与目标之差的平方和最小的一种。
+    返回切点下标 [0, ..., n]。
+    """
+    prefix = list(prefix)
+    starts = prefix if starts is None else list(starts)
+    n = len(prefix) - 1
+    # fewest[i]：前 i 项最少分几段；rest[i]：第 i 项起的剩余部分最少分几段。
+    # k 为最少段数时，能出现在 k 段切法里的切点 i 满足 fewest[i] + rest[i] == k，且它前面恰好是 fewest[i] 段
+    fewest, lows, oversized = _fewest_segments(prefix, limit, starts)
+    rest = [0] * (n + 1)
+    hi = n
+    for i in range(n - 1, -1, -1):
+        if prefix[i + 1] - starts[i] > limit:
+            rest[i] = rest[i + 1] + 1
+            hi = i
+            continue
+        while prefix[hi] - starts[i] > limit:
+            hi -= 1
+        rest[i] = rest[hi] + 1
+
+    segments = fewest[n]
+    oversized_count = sum(oversized)
+    oversized_total = sum(prefix[i] - prefix[i - 1] for i in range(1, n + 1) if oversized[i])
+    target = (prefix[n] - prefix[0] - oversized_total) / max(1, segments - oversized_count)
+    if starts is not prefix and n > 1:
+        # 除第一段外每段都带重叠，目标按切点处的平均重叠加上
+        target += sum(prefix[p] - starts[p] for p in range(1, n)) / (n - 1) * (segments - 1) / segments
+
+    inf = float('inf')
+    cost = [inf] * (n + 1)
+    cost[0] = 0.0
+    back = [0] * (n + 1)
+    for i in range(1, n + 1):
+        if fewest[i] + rest[i] != segments:
+            continue
+        if oversized[i]:
+            # 超限的单项独占一段，不计入偏差
+            cost[i] = cost[i - 1]
+            back[i] = i - 1
+            continue
+        # 上一个切点前面须恰好是 fewest[i] - 1 段；fewest 单调不减，这些切点是连续的一段
+        a = bisect_left(fewest, fewest[i] - 1, lows[i], i)
+        b = bisect_left(fewest, fewest[i], a, i)
+        p = prefix[i] - target
+        costs = [c + (p - q) ** 2 for c, q in zip(cost[a:b], starts[a:b])]
+        best = min(costs)
+        cost[i] = best
+        back[i] = a + costs.index(best)
+
+    cuts = [n]
+    while cuts[-1] > 0:
+        cuts.append(back[cuts[-1]])
+    if len(cuts) - 1 != segments:
+        raise RuntimeError(f"均衡分块得到 {len(cuts) - 1} 段，与最少段数 {segments} 不一致")
+    return cuts[::-1]
+
+
+def cut_balanced_chunks(text: str, token_map: TokenOffsetMap, boundaries, max_tokens: int, overlap_tokens: int,
+                        start: int = 0, end: int = None, max_chunks: int = None):
+    """cut_token_chunks 的均衡版本：在 text[start:end] 的全部句子边界上做 balanced_partition。
+    除第一块外每块向前补上不超过 overlap_tokens 的重叠（从句子边界开始），
+    连同重叠整块不超过 max_tokens，块数与同样限制下的最少块数相同。
+    给出 max_chunks（通常为贪心切法的块数）时，重叠缩小到刚好不多于这么多块为止。
+    整段无边界时按 max_tokens - overlap_tokens 硬切。返回 [(起始, 结束, token数)]。
+    text 的用法同 cut_token_chunks。
+    """
+    end = len(text) if end is None else end
+    positions = getattr(boundaries, 'positions', boundaries)
+    sentence_ends = array('q', itertools.islice(positions, bisect_right(positions, start), bisect_left(positions, end)))
+    sentence_ends.append(end)
+
+    def layout(overlap):
+        # 候选切点：句子边界，超过 max_tokens - overlap 的长句再按 token 硬切；
+        # 以及每个切点作为块起点时连同重叠从哪里开始（第一块不补重叠）
+        limit = max(1, max_tokens - overlap)
+        cuts = array('q', [start])
+        cut_tokens = array('q', [token_map.token_at(start)])
+        for pos in sentence_ends:
+            tok = token_map.token_at(pos)
+            while tok - cut_tokens[-1] > limit:
+                hard_pos = token_map.char_at(cut_tokens[-1] + limit)
+                if hard_pos <= cuts[-1] or hard_pos >= pos:
+                    break
+                cuts.append(hard_pos)
+                cut_tokens.append(token_map.token_at(hard_pos))
+            cuts.append(pos)
+            cut_tokens.append(tok)
+        starts = array('q', cuts)
+        if overlap:
+            for a in range(1, len(cuts)):
+                boundary = boundaries.next(token_map.char_at(cut_tokens[a] - overlap) - 1)
+                if boundary is not None and boundary < cuts[a]:
+                    starts[a] = max(boundary, start)
+        token_starts = array('q', (token_map.token_at(pos) for pos in starts))
+        return cuts, cut_tokens, starts, token_starts
+
+    def chunk_count(plan):
+        return _fewest_segments(plan[1], max_tokens, plan[3])[0][-1]
+
+    # 规划时按整块（含重叠）限制在 max_tokens 内
+    plan = layout(overlap_tokens)
+    if overlap_tokens and max_chunks and chunk_count(plan) > max_chunks:
+        # 二分找出块数不超过 max_chunks 的最大重叠
+        lo, hi = 0, overlap_tokens - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if chunk_count(layout(mid)) <= max_chunks:
+                lo = mid
+            else:
+                hi = mid - 1
+        plan = layout(lo)
+    cuts, cut_tokens, starts, token_starts = plan
+    indexes = balanced_partition(cut_tokens, max_tokens, token_starts)
+    return [(starts[a], cuts[b], token_map.count(starts[a], cuts[b])) for a, b in zip(indexes, indexes[1:])]
+
+
+def chunk_size_report(sizes: List[int], max_tokens: int) -> dict:
+    """区块大小（token）分布：数量、最小/最大/平均、标准差和超限块数"""
+    sizes = list(sizes)
+    if not sizes:
+        return {'chunks': 0, 'max_tokens': max_tokens}
+    mean = sum(sizes) / len(sizes)
+    return {
+        'chunks': len(sizes),
+        'max_tokens': max_tokens,
+        'min': min(sizes),
+        'max': max(sizes),
+        'mean': round(mean, 1),
+        'stdev': round((sum((x - mean) ** 2 for x in sizes) / len(sizes)) ** 0.5, 1),
+        'over_limit': sum(x > max_tokens for x in sizes),
+        'sizes': sizes,
+    }
+
+
+def format_size_report(report: dict) -> str:
+    if not report.get('chunks'):
+        return "区块大小: 无"
+    text = (f"区块大小: {report['chunks']} 块, 最小 {report['min']}, 最大 {report['max']}, "
+            f"平均 {report['mean']}, 标准差 {report['stdev']} tokens")
+    if report['over_limit']:
+        text += f"（{report['over_limit']} 块超过上限 {report['max_tokens']}）"
+    return text
+
+
+def write_size_report(output_folder: str, base_name: str, sizes: List[int], max_tokens: int) -> dict:
+    """写入 metadata/<base_name>_size_report.json 并返回报告"""
+    report = chunk_size_report(sizes, max_tokens)
+    metadata_dir = os.path.join(output_folder, "metadata")
+    os.makedirs(metadata_dir, exist_ok=True)
+    with open(os.path.join(metadata_dir, f"{base_name}{SIZE_REPORT_SUFFIX}"), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+def read_size_report(output_folder: str, base_name: str) -> dict:
+    with open(os.path.join(output_folder, "metadata", f"{base_name}{SIZE_REPORT_SUFFIX}"), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _check_balanced(stream: bool, balanced: bool):
+    if stream and balanced:
+        raise ValueError("均衡分块需要全文的边界索引，不能与流式处理同时使用")
+
+
+# ================== 重复区块检测 ==================
+# 区块去掉全部空白后比较：完全相同记为 duplicate_of；近似重复用 MinHash 估计字符 shingle 的 Jaccard 相似度，
+# 每个 shingle 只哈希一次（按哈希低位分桶取最小值），再把桶分段做 LSH 找候选，只与候选计算相似度
+DUPLICATE_REPORT_SUFFIX = "_duplicates.json"
+DEDUP_SHINGLE_CHARS = 5       # shingle 长度（字符，不含空白）
+DEDUP_BINS = 64               # MinHash 桶数（2 的幂）
+DEDUP_BAND_ROWS = 4           # LSH 每段的桶数
+DEDUP_THRESHOLD = 0.8         # 近似重复的相似度下限
+DEDUP_MIN_BINS = 32           # 非空桶少于此数的区块太短，不做近似比较
+DEDUP_MIN_LINE_CHARS = 8      # 段落去重只统计去空白后不短于此的行
+DEDUP_REPORT_PARAGRAPHS = 100
+_EMPTY_BIN = 1 << 32          # 大于任何 crc32
+
+
+class _ChunkFingerprint:
+    """边写边计算的区块指纹：去空白文本的 sha1、MinHash，以及（段落去重时）各行的哈希和示例"""
+
+    def __init__(self, lines: bool):
+        self.sha1 = hashlib.sha1()
+        self.mins = [_EMPTY_BIN] * DEDUP_BINS
+        self.lines = [] if lines else None
+        self._tail = ''     # 上次写入末尾不足一个 shingle 的字符
+        self._line = ''     # 上次写入末尾未结束的行
+
+    def update(self, text: str):
+        if self.lines is not None:
+            lines = (self._line + text).split('\n')
+            self._line = lines.pop()
+            self._add_lines(lines)
+        packed = ''.join(text.split())
+        self.sha1.update(packed.encode('utf-8'))
+        packed = self._tail + packed
+        width = 4 * DEDUP_SHINGLE_CHARS
+        data = packed.encode('utf-32-le')
+        mins = self.mins
+        mask = DEDUP_BINS - 1
+        for h in {zlib.crc32(data[i:i + width]) for i in range(0, len(data) - width + 1, 4)}:
+            if h < mins[h & mask]:
+                mins[h & mask] = h
+        self._tail = packed[-(DEDUP_SHINGLE_CHARS - 1):]
+
+    def _add_lines(self, lines):
+        for line in lines:
+            packed = ''.join(line.split())
+            if len(packed) >= DEDUP_MIN_LINE_CHARS:
+                self.lines.append((hash(packed), line.strip()[:80]))
+
+    def finish(self):
+        if self.lines is not None and self._line:
+            self._add_lines([self._line])
+            self._line = ''
+
+
+def minhash_similarity(a: List[int], b: List[int]) -> float:
+    """两个 MinHash 的 Jaccard 相似度估计（两边都为空的桶不计）"""
+    both = [x == y for x, y in zip(a, b) if x != _EMPTY_BIN or y != _EMPTY_BIN]
+    return sum(both) / len(both) if both else 1.0
+
+
+class ChunkDeduplicator:
+    """一次分块内的重复检测：区块按写出顺序登记，副本指向最先出现的那一块（区块序号）。
+    paragraphs=True 时还统计重复出现的行（作者的话、广告、章节前言等），
+    需要为全书每一行保存一个哈希，内存随行数增长。
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, paragraphs: bool = False):
+        self.threshold = threshold
+        self.paragraphs = paragraphs
+        self.chunks = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self.groups = {}        # 原始区块序号 -> [副本序号]
+        self._exact = {}        # 去空白文本的 sha1 -> 区块序号
+        self._bands = {}        # (段号, 段内各桶最小值) -> [区块序号]
+        self._mins = {}         # 区块序号 -> MinHash（不含近似副本）
+        self._lines = {}        # 行哈希 -> 首次出现的区块序号
+        self._repeated = {}     # 行哈希 -> [出现次数, 首次出现的区块序号, 示例]
+
+    def fingerprint(self) -> _ChunkFingerprint:
+        return _ChunkFingerprint(self.paragraphs)
+
+    def _bands_of(self, mins):
+        return [(i, tuple(mins[i:i + DEDUP_BAND_ROWS])) for i in range(0, DEDUP_BINS, DEDUP_BAND_ROWS)]
+
+    def _find_near(self, mins):
+        best = None
+        seen = set()
+        for band in self._bands_of(mins):
+            for chunk_num in self._bands.get(band, ()):
+                if chunk_num in seen:
+                    continue
+                seen.add(chunk_num)
+                similarity = minhash_similarity(mins, self._mins[chunk_num])
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (chunk_num, similarity)
+        return best
+
+    def check(self, chunk_num: int, fingerprint: _ChunkFingerprint) -> dict:
+        """登记一个写完的区块，返回写入清单的字段"""
+        fingerprint.finish()
+        self.chunks += 1
+        fields = {'duplicate_of': None, 'near_duplicate_of': None, 'similarity': None}
+        digest = fingerprint.sha1.digest()
+        original = self._exact.get(digest)
+        if original is not None:
+            fields['duplicate_of'] = original
+            self.exact_duplicates += 1
+            self.groups.setdefault(original, []).append(chunk_num)
+        else:
+            self._exact[digest] = chunk_num
+            mins = fingerprint.mins
+            near = None
+            if DEDUP_BINS - mins.count(_EMPTY_BIN) >= DEDUP_MIN_BINS:
+                near = self._find_near(mins)
+                if near is None:
+                    self._mins[chunk_num] = mins
+                    for band in self._bands_of(mins):
+                        self._bands.setdefault(band, []).append(chunk_num)
+            if near is not None:
+                original, similarity = near
+                fields['near_duplicate_of'] = original
+                fields['similarity'] = round(similarity, 3)
+                self.near_duplicates += 1
+                self.groups.setdefault(original, []).append(chunk_num)
+        if self.paragraphs:
+            repeated = 0
+            for key, sample in fingerprint.lines:
+                first = self._lines.get(key)
+                if first is None:
+                    self._lines[key] = chunk_num
+                    continue
+                entry = self._repeated.get(key)
+                if entry is None:
+                    entry = self._repeated[key] = [1, first, sample]
+                entry[0] += 1
+                repeated += 1
+            fields['repeated_paragraphs'] = repeated
+        return fields
+
+    def report(self) -> dict:
+        paragraphs = sorted(self._repeated.values(), key=lambda e: -e[0])
+        return {
+            'chunks': self.chunks,
+            'unique_chunks': self.chunks - self.exact_duplicates - self.near_duplicates,
+            'exact_duplicates': self.exact_duplicates,
+            'near_duplicates': self.near_duplicates,
+            'threshold': self.threshold,
+            'groups': [{'chunk': chunk, 'copies': copies} for chunk, copies in sorted(self.groups.items())],
+            'repeated_paragraphs': [{'text': sample, 'count': count, 'first_chunk': first}
+                                    for count, first, sample in paragraphs[:DEDUP_REPORT_PARAGRAPHS]],
+        }
+
+    def write_report(self, path: str) -> dict:
+        report = self.report()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        return report
+
+
+def format_duplicate_report(report: dict) -> str:
+    text = (f"重复区块: {report['exact_duplicates']} 块完全重复, {report['near_duplicates']} 块近似重复, "
+            f"{report['unique_chunks']}/{report['chunks']} 块需要处理")
+    if report['repeated_paragraphs']:
+        top = report['repeated_paragraphs'][0]
+        text += f"；最常重复的段落出现 {top['count']} 次：{top['text'][:30]}"
+    return text
+
+
+def read_duplicate_report(output_folder: str, base_name: str) -> dict:
+    with open(os.path.join(output_folder, "metadata", f"{base_name}{DUPLICATE_REPORT_SUFFIX}"),
+              encoding='utf-8') as f:
+        return json.load(f)
+
+
+# ================== 区块输出（散文件 / 打包归档）==================
+# 打包归档：<名称>.pack 存放所有区块的 UTF-8 文本，<名称>.idx 为索引：
+#   8 字节魔数 | 区块数 n（uint64）| n+1 个字节偏移（uint64）| 各区块名称（UTF-8，以换行分隔）
+# 所有整数均为小端序。第 i 块为 pack[offsets[i]:offsets[i+1]]，名称即散文件模式下的相对路径
+CHUNK_ARCHIVE_MAGIC = b"MZCHUNK1"
+CHUNK_ARCHIVE_EXT = ".pack"
+CHUNK_INDEX_EXT = ".idx"
+CHUNK_MANIFEST_SUFFIX = "_chunks.jsonl"
+
+
+class SplitCancelled(Exception):
+    """progress 回调抛出此异常即中止分块（在下一个区块写出之前生效）"""
+
+
+def chunk_index_path(archive_path: str) -> str:
+    return os.path.splitext(archive_path)[0] + CHUNK_INDEX_EXT
+
+
+def _le_offsets(offsets: array) -> array:
+    if sys.byteorder == 'big':
+        offsets = array('Q', offsets)
+        offsets.byteswap()
+    return offsets
+
+
+def chunk_manifest_path(output_folder: str, base_name: str) -> str:
+    return os.path.join(output_folder, "metadata", f"{base_name}{CHUNK_MANIFEST_SUFFIX}")
+
+
+class _ChunkWriterBase:
+    """写出进度和区块清单。
+    进度：每个区块开始写之前和全部写完时调用 progress(已写完的区块数)，
+    回调可以抛出 SplitCancelled 中止分块，此时不会留下写了一半的区块。
+    清单：每写完一个区块就向 JSONL 清单追加一行，记录位置、字节数、token 数、字符范围、标题、
+    sha1 和原文编码，下游工具只读清单即可调度、去重和断点续跑。
+    去重：给定 ChunkDeduplicator 时，清单另记每块是哪一块的副本，关闭时在清单旁写出重复报告。
+    """
+
+    def _init_writer(self, progress, manifest_path, source_encoding, dedup=None):
+        self.progress = progress
+        self.count = 0
+        self.source_encoding = source_encoding
+        self.dedup = dedup
+        self._manifest = None
+        if manifest_path:
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            self._manifest = open(manifest_path, 'w', encoding='utf-8')
+            self._dedup_report = manifest_path[:-len(CHUNK_MANIFEST_SUFFIX)] + DUPLICATE_REPORT_SUFFIX
+
+    def _start_chunk(self):
+        if self.progress:
+            self.progress(self.count)
+        self.count += 1
+
+    def _record(self, entry, **location):
+        duplicates = self.dedup.check(self.count, entry.fingerprint) if self.dedup else {}
+        if self._manifest is None:
+            return
+        record = {'chunk_num': self.count, 'file': entry.name, **location, 'length': entry.length,
+                  'tokens': None, 'char_range': None, 'title': None}
+        record.update(entry.info)
+        record['sha1'] = entry.sha1.hexdigest()
+        record['source_encoding'] = self.source_encoding
+        record.update(duplicates)
+        self._manifest.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._manifest.flush()
+
+    def _close_writer(self):
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
+            if self.dedup:
+                self.dedup.write_report(self._dedup_report)
+        if self.progress:
+            self.progress(self.count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.progress = None  # 出错或已取消，关闭时不再报告进度
+        self.close()
+
+
+class _ChunkEntry:
+    """正在写入的区块，用法同文本文件；同一时刻只能有一个。
+    info 为写入清单的字段（tokens / char_range / title 等），关闭前仍可修改。
+    """
+
+    def __init__(self, writer, name: str, info: dict):
+        self.writer = writer
+        self.name = name
+        self.info = info
+        self.sha1 = hashlib.sha1()
+        self.length = 0
+        self.fingerprint = writer.dedup.fingerprint() if writer.dedup else None
+
+    def write(self, text: str):
+        data = text.encode('utf-8')
+        self.sha1.update(data)
+        self.length += len(data)
+        if self.fingerprint:
+            self.fingerprint.update(text)
+        self._write(text, data)
+
+    def writelines(self, parts):
+        for part in parts:
+            self.write(part)
+
+    def close(self):
+        self.writer._finish(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _ChunkFileEntry(_ChunkEntry):
+    def __init__(self, writer, name: str, info: dict, path: str):
+        super().__init__(writer, name, info)
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def _write(self, text, data):
+        self.file.write(text)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class _ChunkArchiveEntry(_ChunkEntry):
+    def _write(self, text, data):
+        self.writer._data.write(data)
+
+
+class ChunkFolderWriter(_ChunkWriterBase):
+    """散文件输出：每个区块一个 .txt 文件，name 为相对 folder 的路径（用 / 分隔）"""
+
+    def __init__(self, folder: str, progress=None, manifest_path: str = None, source_encoding: str = None,
+                 dedup: ChunkDeduplicator = None):
+        self.path = folder
+        self._init_writer(progress, manifest_path, source_encoding, dedup)
+
+    def open(self, name: str, **info) -> _ChunkFileEntry:
+        self._start_chunk()
+        path = os.path.join(self.path, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return _ChunkFileEntry(self, name, info, path)
+
+    def write(self, name: str, text: str, **info):
+        with self.open(name, **info) as f:
+            f.write(text)
+
+    def _finish(self, entry):
+        self._record(entry)
+
+    def close(self):
+        self._close_writer()
+
+
+class ChunkArchiveWriter(_ChunkWriterBase):
+    """打包输出：所有区块顺序写入一个数据文件，关闭时写出偏移索引"""
+
+    def __init__(self, path: str, progress=None, manifest_path: str = None, source_encoding: str = None,
+                 dedup: ChunkDeduplicator = None):
+        self.path = path
+        self.names = []
+        self.offsets = array('Q', [0])
+        self._data = open(path, 'wb')
+        self._init_writer(progress, manifest_path, source_encoding, dedup)
+
+    def open(self, name: str, **info) -> _ChunkArchiveEntry:
+        self._start_chunk()
+        return _ChunkArchiveEntry(self, name, info)
+
+    def write(self, name: str, text: str, **info):
+        with self.open(name, **info) as entry:
+            entry.write(text)
+
+    def _finish(self, entry):
+        self.names.append(entry.name)
+        self.offsets.append(self._data.tell())
+        self._record(entry, archive=os.path.basename(self.path), offset=self.offsets[-2])
+
+    def close(self):
+        if self._data.closed:
+            return
+        self._data.close()
+        with open(chunk_index_path(self.path), 'wb') as f:
+            f.write(CHUNK_ARCHIVE_MAGIC)
+            f.write(len(self.names).to_bytes(8, 'little'))
+            f.write(_le_offsets(self.offsets).tobytes())
+            f.write('\n'.join(self.names).encode('utf-8'))
+        self._close_writer()
+
+
+def open_chunk_writer(output_folder: str, base_name: str, packed: bool = False, progress=None,
+                      source_encoding: str = None, dedup: ChunkDeduplicator = None):
+    """packed=True 时输出 <output_folder>/<base_name>_chunks.pack（+ .idx），否则输出散文件；
+    两种方式都同时写出清单 metadata/<base_name>_chunks.jsonl，
+    给定 dedup 时另写出 metadata/<base_name>_duplicates.json
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = chunk_manifest_path(output_folder, base_name)
+    if packed:
+        return ChunkArchiveWriter(os.path.join(output_folder, f"{base_name}_chunks{CHUNK_ARCHIVE_EXT}"), progress,
+                                  manifest_path, source_encoding, dedup)
+    return ChunkFolderWriter(output_folder, progress, manifest_path, source_encoding, dedup)
+
+
+def read_chunk_manifest(output_folder: str, base_name: str):
+    """逐条读取区块清单"""
+    with open(chunk_manifest_path(output_folder, base_name), encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class ChunkArchive:
+    """只读打开打包归档：数据文件用 mmap 映射，按序号随机读取区块"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(chunk_index_path(path), 'rb') as f:
+            index = f.read()
+        if index[:8] != CHUNK_ARCHIVE_MAGIC:
+            raise ValueError(f"不是有效的区块索引文件: {chunk_index_path(path)}")
+        count = int.from_bytes(index[8:16], 'little')
+        names_at = 16 + 8 * (count + 1)
+        self.offsets = _le_offsets(array('Q', index[16:names_at]))
+        self.names = index[names_at:].decode('utf-8').split('\n') if count else []
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self.offsets[-1]:
+            raise ValueError(f"区块数据文件不完整: {path}")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_bytes(self, i: int) -> memoryview:
+        """第 i 块的原始 UTF-8 字节（不复制）"""
+        return memoryview(self._data)[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i: int) -> str:
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i %= len(self)
+        return self._data[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def __iter__(self):
+        """按顺序产出 (名称, 文本)"""
+        for i, name in enumerate(self.names):
+            yield name, self[i]
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_chunk_archive(archive_path: str, output_folder: str) -> int:
+    """把打包归档导出为散文件（与不打包时的目录结构相同），返回区块数"""
+    with ChunkArchive(archive_path) as archive, ChunkFolderWriter(output_folder) as writer:
+        for name, text in archive:
+            writer.write(name, text)
+        return len(archive)
+
+
+# ================== 文件读取与编码探测 ==================
+FILE_ENCODINGS = ['utf-8', 'gbk', 'shift_jis', 'utf-16', 'latin1']
+ENCODING_SAMPLE_BYTES = 1 << 20    # 探测编码时读取的文件前缀大小
+_BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# 解码结果缓存：(绝对路径, mtime_ns, 大小) -> (文本, 编码)。
+# 只保留最近一个文件，选择文件时解码的文本直接留给随后的分割使用
+_TEXT_CACHE = {}
+_TEXT_CACHE_LOCK = threading.Lock()
+_STREAM_ENCODING_CACHE = {}  # 流式处理校验过的编码：(绝对路径, mtime_ns, 大小) -> 编码
+
+
+def sniff_encoding(sample: bytes) -> str:
+    """先看 BOM，再只解码文件前缀来判断编码，候选顺序与 FILE_ENCODINGS 相同"""
+    for bom, encoding in _BOM_ENCODINGS:
+        if sample.startswith(bom):
+            return encoding
+    for encoding in FILE_ENCODINGS:
         try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                text = f.read()
-            used_encoding = encoding
+            # final=False：前缀末尾被截断的多字节字符不算错误
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeError:
+            # 没有 BOM 时 utf-16 的增量解码器抛出的是 UnicodeError 而不是 UnicodeDecodeError
+            continue
+    raise ValueError("无法用任何支持的编码读取文件")
+
+
+def detect_file_encoding(file_path: str) -> str:
+    with open(file_path, 'rb') as f:
+        return sniff_encoding(f.read(ENCODING_SAMPLE_BYTES))
+
+
+def _decode_check(file_path: str, encoding: str):
+    """按 encoding 增量解码整个文件（不保留文本），失败时抛出 UnicodeDecodeError，位置为文件中的字节偏移"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    consumed = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(ENCODING_SAMPLE_BYTES)
+            try:
+                decoder.decode(data, final=not data)
+            except UnicodeDecodeError as e:
+                raise UnicodeDecodeError(e.encoding, e.object, e.start, e.end,
+                                         f"{e.reason}（文件第 {consumed + e.start} 字节）") from None
+            if not data:
+                return
+            consumed += len(data)
+
+
+def stream_file_encoding(file_path: str) -> str:
+    """流式处理使用的编码。前缀探测的编码在文件后部解码失败时，与 read_text_file 一样依次换用其余候选编码；
+    在写出任何区块之前先把整个文件试解码一遍（内存与文件大小无关），避免分到一半才出错。
+    文件未修改时直接返回缓存的结果。
+    """
+    key = _file_cache_key(file_path)
+    with _TEXT_CACHE_LOCK:
+        cached = _STREAM_ENCODING_CACHE.get(key)
+    if cached is not None:
+        return cached
+    detected = detect_file_encoding(file_path)
+    failures = []
+    # 探测到的 'utf-16' 一定带 BOM；候补的 'utf-16' 用于没有 BOM 的文件，增量解码器不接受，
+    # 改按本机字节序解码，与 read_text_file 的 bytes.decode 结果一致
+    native_utf16 = 'utf-16-le' if sys.byteorder == 'little' else 'utf-16-be'
+    fallbacks = [native_utf16 if e == 'utf-16' else e for e in FILE_ENCODINGS if e != detected]
+    for encoding in [detected] + fallbacks:
+        try:
+            _decode_check(file_path, encoding)
+        except UnicodeDecodeError as e:
+            failures.append(f"{encoding}: {e.reason}")
+            continue
+        with _TEXT_CACHE_LOCK:
+            _STREAM_ENCODING_CACHE.clear()
+            _STREAM_ENCODING_CACHE[key] = encoding
+        return encoding
+    raise ValueError("无法用任何支持的编码读取文件：" + "；".join(failures))
+
+
+def _file_cache_key(file_path: str):
+    st = os.stat(file_path)
+    return os.path.abspath(file_path), st.st_mtime_ns, st.st_size
+
+
+def read_text_file(file_path: str):
+    """读取并解码整个文件，返回 (文本, 编码)。
+    文件只读一次：按前缀探测的编码解码，若文件后部解码失败再依次尝试其余候选编码。
+    文件未修改时直接返回缓存的结果。
+    """
+    key = _file_cache_key(file_path)
+    with _TEXT_CACHE_LOCK:
+        cached = _TEXT_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    detected = sniff_encoding(data[:ENCODING_SAMPLE_BYTES])
+    candidates = [detected] + [e for e in FILE_ENCODINGS if e != detected]
+    for encoding in candidates:
+        try:
+            text = data.decode(encoding)
             break
         except UnicodeDecodeError:
             continue
-    if text is None:
+    else:
         raise ValueError("无法用任何支持的编码读取文件")
-    if not text.strip():
-        raise ValueError("文件内容为空")
+    del data
+    if '\r' in text:
+        # 与文本模式 open() 的通用换行处理一致
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
 
-    text = preserve_formatting(text)
-    total_tokens = count_tokens(text)
-    chunks_dir = os.path.join(output_folder, f"{base_name}_chunks")
-    metadata_dir = os.path.join(output_folder, "metadata")
-    os.makedirs(chunks_dir, exist_ok=True)
-    os.makedirs(metadata_dir, exist_ok=True)
+    result = (text, encoding)
+    with _TEXT_CACHE_LOCK:
+        _TEXT_CACHE.clear()
+        _TEXT_CACHE[key] = result
+    return result
 
-    boundaries = find_sentence_boundaries(text)
-    overlap_tokens = int(CHUNK_SIZE * OVERLAP_RATE)
-    min_chunk_tokens = max(200, int(CHUNK_SIZE * MIN_CHUNK_RATIO))
-    chars_per_token = len(text) / (total_tokens or 1)
 
-    current_pos = 0
-    current_token_pos = 0
-    chunk_num = 1
-    chunks = []
-    metadata = {
+# ================== 模式 A：Token 分块（v1）==================
+def _new_v1_metadata(file_path, CHUNK_SIZE, OVERLAP_RATE, total_tokens):
+    return {
         'file_path': file_path,
         'chunk_size': CHUNK_SIZE,
         'overlap_rate': OVERLAP_RATE,
@@ -144,104 +1402,199 @@ def split_text_file_v1(file_path: str, output_folder: str, base_name: str, CHUNK
         'chunks': []
     }
 
-    while current_token_pos < total_tokens:
-        target_end_token_pos = min(current_token_pos + CHUNK_SIZE, total_tokens)
-        target_end_char_pos = int(target_end_token_pos * chars_per_token)
-        optimal_end_pos = find_optimal_boundary(text, target_end_char_pos, boundaries)
-        chunk_text = text[current_pos:optimal_end_pos]
-        chunk_tokens = count_tokens(chunk_text)
-
-        if chunk_tokens < min_chunk_tokens and chunk_num > 1:
-            next_boundaries = [b for b in boundaries if b > optimal_end_pos]
-            if next_boundaries:
-                next_boundary = min(next_boundaries)
-                chunk_text = text[current_pos:next_boundary]
-                chunk_tokens = count_tokens(chunk_text)
-                optimal_end_pos = next_boundary
-
-        chunk_info = {
-            'chunk_num': chunk_num,
-            'start_pos': current_pos,
-            'end_pos': optimal_end_pos,
-            'text': chunk_text,
-            'token_count': chunk_tokens,
-        }
-        chunks.append(chunk_info)
 
-        chunk_file = os.path.join(chunks_dir, f"{base_name}_{chunk_num:03d}.txt")
-        with open(chunk_file, 'w', encoding='utf-8') as f:
-            f.write(chunk_text)
+def _write_v1_chunk(writer, base_name, metadata, chunk_num, chunk_parts, token_count, start_pos, end_pos):
+    chunk_name = f"{base_name}_{chunk_num:03d}.txt"
+    with writer.open(f"{base_name}_chunks/{chunk_name}", tokens=token_count, char_range=[start_pos, end_pos]) as f:
+        f.writelines(chunk_parts)
+    metadata['chunks'].append({
+        'chunk_num': chunk_num,
+        'file_path': os.path.join(f"{base_name}_chunks", chunk_name),
+        'token_count': token_count,
+        'char_range': [start_pos, end_pos]
+    })
 
-        metadata['chunks'].append({
-            'chunk_num': chunk_num,
-            'file_path': os.path.relpath(chunk_file, output_folder),
-            'token_count': chunk_tokens,
-            'char_range': [chunk_info['start_pos'], chunk_info['end_pos']]
-        })
 
-        overlap_start_char = current_pos + int(max(0, (target_end_token_pos - overlap_tokens - current_token_pos)) * chars_per_token)
-        next_start_boundary = find_optimal_boundary(text, overlap_start_char, boundaries)
-        next_start_pos = max(optimal_end_pos, next_start_boundary)
-        current_pos = next_start_pos
-        current_token_pos = int(current_pos / chars_per_token)
+def plan_token_chunks(token_map: TokenOffsetMap, boundaries, text_len: int, CHUNK_SIZE, OVERLAP_RATE,
+                      MIN_CHUNK_RATIO, balanced: bool = False) -> List[ChunkSpan]:
+    """模式 A 的切点：只用 token 偏移表和边界表，不需要原文（分块与分块规划共用）"""
+    overlap_tokens = int(CHUNK_SIZE * OVERLAP_RATE)
+    min_chunk_tokens = max(200, int(CHUNK_SIZE * MIN_CHUNK_RATIO))
+    spans, _, remainder = cut_token_chunks(None, token_map, boundaries, CHUNK_SIZE, overlap_tokens,
+                                           min_chunk_tokens, end=text_len)
+    if balanced:
+        # 块数不多于贪心切法
+        spans, remainder = cut_balanced_chunks(None, token_map, boundaries, CHUNK_SIZE, overlap_tokens,
+                                               end=text_len, max_chunks=len(spans)), None
+
+    chunks = [ChunkSpan(*span) for span in spans]
+    if remainder and chunks:
+        remaining_start, remaining_tokens = remainder
+        chunks[-1].merge_remainder(remaining_start, text_len, remaining_tokens)
+    return chunks
+
+
+def split_text_file_v1(file_path: str, output_folder: str, base_name: str, CHUNK_SIZE, OVERLAP_RATE, MIN_CHUNK_RATIO, encoding_name: str = None, stream: bool = False,
+                       normalizer: TextNormalizer = None, packed: bool = False, balanced: bool = False,
+                       progress=None, dedup: ChunkDeduplicator = None):
+    _check_balanced(stream, balanced)
+    if stream:
+        return _split_text_file_v1_stream(file_path, output_folder, base_name, CHUNK_SIZE, OVERLAP_RATE,
+                                          MIN_CHUNK_RATIO, encoding_name, normalizer, packed, progress, dedup)
+    text, source_encoding = read_text_file(file_path)
+    if not text.strip():
+        raise ValueError("文件内容为空")
 
-        remaining_tokens = total_tokens - current_token_pos
-        if remaining_tokens < min_chunk_tokens and remaining_tokens > 0:
-            if chunks:
-                remaining_text = text[current_pos:]
-                chunks[-1]['text'] += "\n\n[合并的剩余内容]\n" + remaining_text
-                chunks[-1]['end_pos'] = len(text)
-                chunks[-1]['token_count'] = count_tokens(chunks[-1]['text'])
-                chunk_file = os.path.join(chunks_dir, f"{base_name}_{chunk_num}.txt")
-                with open(chunk_file, 'w', encoding='utf-8') as f:
-                    f.write(chunks[-1]['text'])
-                break
+    text = preserve_formatting(text, normalizer)
+    token_map = TokenOffsetMap(text, get_tokenizer(encoding_name))
+    total_tokens = token_map.total_tokens
+    chunks_dir = os.path.join(output_folder, f"{base_name}_chunks")
+    metadata_dir = os.path.join(output_folder, "metadata")
+    os.makedirs(metadata_dir, exist_ok=True)
 
-        chunk_num += 1
+    boundaries = find_sentence_boundaries(text)
+    chunks = plan_token_chunks(token_map, boundaries, len(text), CHUNK_SIZE, OVERLAP_RATE, MIN_CHUNK_RATIO, balanced)
+
+    metadata = _new_v1_metadata(file_path, CHUNK_SIZE, OVERLAP_RATE, total_tokens)
+    with open_chunk_writer(output_folder, base_name, packed, progress, source_encoding, dedup) as writer:
+        for chunk_num, chunk in enumerate(chunks, 1):
+            _write_v1_chunk(writer, base_name, metadata, chunk_num, chunk.parts(text), chunk.tokens,
+                            chunk.start, chunk.char_end)
 
-    metadata['total_chunks'] = len(chunks)
+    metadata['total_chunks'] = len(metadata['chunks'])
     metadata_file = os.path.join(metadata_dir, f"{base_name}_metadata.json")
     with open(metadata_file, 'w', encoding='utf-8') as f:
         json.dump(metadata, f, indent=2, ensure_ascii=False)
+    if balanced:
+        write_size_report(output_folder, base_name, [chunk.tokens for chunk in chunks], CHUNK_SIZE)
 
-    return chunks_dir, len(chunks)
+    return writer.path if packed else chunks_dir, len(chunks)
 
 
 # ================== 模式 B：章节分块（v2）==================
-def detect_chapters(text):
-    chapter_patterns = [
-        r'^\s*(第?[零一二三四五六七八九十百\d]+[章节回篇幕场])\s*[:：\-—]?\s*.*$',
-        r'^\s*(Chapter|Scene|Part|Act|Prologue|Epilogue|Appendix)\s+\d*[A-Za-z]?\s*:?.*$',
-        r'^\s*(序幕|尾声|楔子|终章|后记|前言|引子|附录)\s*:?.*$',
-        r'^\s*#{1,3}\s+(.+)$',
-    ]
-    lines = text.splitlines(keepends=True)
-    chapters = []
-    current_lines = []
-    for line in lines:
-        stripped = line.strip()
-        is_chapter_start = any(re.match(pattern, stripped, re.IGNORECASE) for pattern in chapter_patterns)
-        if is_chapter_start:
-            if current_lines:
-                chapters.append(''.join(current_lines))
-            current_lines = [line]
-        else:
-            current_lines.append(line)
-    if current_lines:
-        chapters.append(''.join(current_lines))
-    return chapters
+def _write_chapter_metadata(output_folder, base_name, file_path, max_tokens, total_tokens, total_chunks):
+    """模式 B/C 的汇总：各章 token 数之和（分块时已统计），批量清单据此填写，不必再编码一遍"""
+    metadata_dir = os.path.join(output_folder, "metadata")
+    os.makedirs(metadata_dir, exist_ok=True)
+    metadata = {'file_path': file_path, 'max_tokens': max_tokens, 'total_tokens': total_tokens,
+                'total_chunks': total_chunks}
+    with open(os.path.join(metadata_dir, f"{base_name}_metadata.json"), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+
+
+# str.splitlines() 认定的行结束符，以及行内空白
+_LINE_ENDS = '\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+_LINE_SPACE = '[^\\S%s]' % _LINE_ENDS
+
+# 章节标题模式：从行首（跳过行首空白）开始匹配，第一个分组为标题，没有分组时取整个匹配
+CHAPTER_PATTERNS = [
+    r'(第?[零一二三四五六七八九十百\d]+[章节回篇幕场])',
+    r'(Chapter|Scene|Part|Act|Prologue|Epilogue|Appendix)(?=%s+\S)' % _LINE_SPACE,
+    r'(序幕|尾声|楔子|终章|后记|前言|引子|附录)',
+    r'#{1,3}%s+(?=(\S[^\n]*))' % _LINE_SPACE,   # 标题放在前瞻里，不吞掉后面可能的标题行
+]
+
+
+class ChapterMatcher:
+    """章节标题识别：内置模式和用户模式编译成一个正则，finditer 一遍扫完全文。
+    用户模式按 CHAPTER_PATTERNS 的约定书写（开头的 ^ 可省略），排在内置模式之后，不区分大小写。
+    """
+
+    def __init__(self, extra_patterns=None):
+        self.patterns = list(CHAPTER_PATTERNS) + [p[1:] if p.startswith('^') else p for p in extra_patterns or []]
+        alternatives = []
+        for i, pattern in enumerate(self.patterns):
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"章节标题模式无效: {pattern!r} ({e})")
+            alternatives.append(f'(?P<heading{i}>{pattern})')
+        heading = r'%s*(?:%s)' % (_LINE_SPACE, '|'.join(alternatives))
+        self._pattern = re.compile(heading, re.IGNORECASE | re.MULTILINE)
+        # 全文扫描时从行结束符起匹配：以字符集开头的正则能让 re 快速跳过普通字符
+        self._line_pattern = re.compile(r'[%s]%s' % (_LINE_ENDS, heading), re.IGNORECASE | re.MULTILINE)
+        # 每个模式的标题取哪个分组（两个正则的分组编号相同）
+        self._title_groups = {}
+        for i, pattern in enumerate(self.patterns):
+            group = self._pattern.groupindex[f'heading{i}']
+            self._title_groups[f'heading{i}'] = group + 1 if re.compile(pattern).groups else group
+
+    def _title(self, match, limit: int) -> str:
+        group = self._title_groups[match.lastgroup]
+        if match.group(group) is None:
+            group = match.lastgroup
+        # 标题不超出本章范围
+        return match.string[match.start(group):min(match.end(group), limit)].strip()
+
+    def iter_headings(self, text: str):
+        """产出 (标题行起始位置, 匹配对象)"""
+        pos = 0
+        match = self._pattern.match(text)
+        if match:
+            yield 0, match
+            pos = match.end()
+        for match in self._line_pattern.finditer(text, pos):
+            yield match.start() + 1, match
+
+    def match_line(self, line: str):
+        """line 是章节标题行时返回标题，否则返回 None"""
+        match = self._pattern.match(line)
+        return self._title(match, len(line)) if match else None
+
+
+DEFAULT_CHAPTER_MATCHER = ChapterMatcher()
+
+
+def get_chapter_matcher(chapter_patterns=None) -> ChapterMatcher:
+    return ChapterMatcher(chapter_patterns) if chapter_patterns else DEFAULT_CHAPTER_MATCHER
+
+
+def is_chapter_start(line, matcher: ChapterMatcher = None):
+    return (matcher or DEFAULT_CHAPTER_MATCHER).match_line(line.strip()) is not None
+
+
+def build_chapter_index(text: str, matcher: ChapterMatcher = None):
+    """章节索引：[(起始位置, 结束位置, 标题)]，章节首尾相接覆盖全文；
+    第一个标题之前的内容单独成为一章，标题按其首行推断。
+    """
+    matcher = matcher or DEFAULT_CHAPTER_MATCHER
+    headings = list(matcher.iter_headings(text))
+    index = []
+    first = headings[0][0] if headings else len(text)
+    if first > 0:
+        line_end = text.find('\n', 0, first)
+        index.append((0, first, extract_title(text[:first if line_end < 0 else line_end])))
+    for i, (start, match) in enumerate(headings):
+        end = headings[i + 1][0] if i + 1 < len(headings) else len(text)
+        index.append((start, end, matcher._title(match, end)))
+    return index
+
+
+def count_chapter_tokens(content: str, chapters, tokenizer, workers: int = DEFAULT_WORKERS) -> List[int]:
+    """按章节索引批量计数，每批 COUNT_BATCH_SIZE 章交给分词器多线程编码"""
+    counts = []
+    for i in range(0, len(chapters), COUNT_BATCH_SIZE):
+        batch = [content[start:end] for start, end, _ in chapters[i:i + COUNT_BATCH_SIZE]]
+        counts.extend(tokenizer.count_batch(batch, workers))
+    return counts
+
+
+def detect_chapters(text, matcher: ChapterMatcher = None):
+    return [text[start:end] for start, end, _ in build_chapter_index(text, matcher)]
+
+
+_TITLE_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in [
+    r'^(第?[零一二三四五六七八九十百\d]+[章节回篇幕场]).*',
+    r'^(Chapter|Scene|Part|Act|Prologue|Epilogue|Appendix)\s+\d*[A-Za-z]?.*',
+    r'^(序幕|尾声|楔子|终章|后记|前言|引子|附录).*',
+    r'^#{1,3}\s+(.+)',
+]]
 
 
 def extract_title(chapter_text):
-    first_line = chapter_text.split('\n')[0].strip()
-    patterns = [
-        r'^(第?[零一二三四五六七八九十百\d]+[章节回篇幕场]).*',
-        r'^(Chapter|Scene|Part|Act|Prologue|Epilogue|Appendix)\s+\d*[A-Za-z]?.*',
-        r'^(序幕|尾声|楔子|终章|后记|前言|引子|附录).*',
-        r'^#{1,3}\s+(.+)',
-    ]
-    for pat in patterns:
-        m = re.match(pat, first_line, re.IGNORECASE)
+    first_line = chapter_text.partition('\n')[0].strip()
+    for pattern in _TITLE_PATTERNS:
+        m = pattern.match(first_line)
         if m:
             return m.group(1).strip()
     return "Unknown"
@@ -251,180 +1604,1560 @@ def sanitize_filename(s):
     return "".join(c for c in s if c.isalnum() or c in " _-").rstrip()
 
 
-def split_text_file_v2(file_path: str, output_folder: str, base_name: str, max_tokens: int):
-    # 尝试多种编码
-    encodings = ['utf-8', 'gbk', 'shift_jis', 'utf-16', 'latin1']
-    content = None
-    for encoding in encodings:
-        try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                content = f.read()
-            break
-        except UnicodeDecodeError:
-            continue
-    if content is None:
-        raise ValueError("无法用任何支持的编码读取文件")
-
-    enc = tiktoken.get_encoding("cl100k_base")
-    chapters = detect_chapters(content)
-    titles = [extract_title(ch) for ch in chapters]
-
+def pack_chapters(chapters, chapter_tokens: List[int], max_tokens: int):
+    """贪心打包：相邻章节依次装入当前块，装不下就另起一块，超限章节单独成块。
+    返回 [(起点, 终点, 起始标题, 结束标题, token数)]
+    """
     chunks = []
-    chunk_ranges = []
-    current_chunk = []
+    current = None
     current_tokens = 0
-    start_i = 0
 
-    for i, chapter in enumerate(chapters):
-        tok = len(enc.encode(chapter))
+    for (start, end, title), tok in zip(chapters, chapter_tokens):
         if tok > max_tokens:
-            if current_chunk:
-                chunks.append(''.join(current_chunk))
-                chunk_ranges.append((titles[start_i], titles[i-1]))
-                current_chunk = []
+            if current:
+                chunks.append(current + (current_tokens,))
+                current = None
                 current_tokens = 0
-            chunks.append(chapter)
-            chunk_ranges.append((titles[i], titles[i]))
-            start_i = i + 1
+            chunks.append((start, end, title, title, tok))
+        elif current and current_tokens + tok <= max_tokens:
+            current = (current[0], end, current[2], title)
+            current_tokens += tok
         else:
-            if current_tokens + tok <= max_tokens:
-                if not current_chunk:
-                    start_i = i
-                current_chunk.append(chapter)
-                current_tokens += tok
-            else:
-                chunks.append(''.join(current_chunk))
-                chunk_ranges.append((titles[start_i], titles[i-1]))
-                current_chunk = [chapter]
-                current_tokens = tok
-                start_i = i
-
-    if current_chunk:
-        chunks.append(''.join(current_chunk))
-        chunk_ranges.append((titles[start_i], titles[-1]))
+            if current:
+                chunks.append(current + (current_tokens,))
+            current = (start, end, title, title)
+            current_tokens = tok
+
+    if current:
+        chunks.append(current + (current_tokens,))
+    return chunks
+
+
+def plan_chapter_chunks(chapters, chapter_tokens: List[int], max_tokens: int, balanced: bool = False):
+    """模式 B 的分块：贪心打包或均衡划分，返回 [(起点, 终点, 起始标题, 结束标题, token数)]"""
+    if not balanced:
+        return pack_chapters(chapters, chapter_tokens, max_tokens)
+    prefix = array('q', [0])
+    prefix.extend(itertools.accumulate(chapter_tokens))
+    cuts = balanced_partition(prefix, max_tokens)
+    return [(chapters[a][0], chapters[b - 1][1], chapters[a][2], chapters[b - 1][2], prefix[b] - prefix[a])
+            for a, b in zip(cuts, cuts[1:])]
+
+
+def split_text_file_v2(file_path: str, output_folder: str, base_name: str, max_tokens: int, encoding_name: str = None, stream: bool = False,
+                       chapter_patterns: List[str] = None, workers: int = DEFAULT_WORKERS, packed: bool = False,
+                       balanced: bool = False, progress=None, dedup: ChunkDeduplicator = None):
+    _check_balanced(stream, balanced)
+    if stream:
+        return _split_text_file_v2_stream(file_path, output_folder, base_name, max_tokens, encoding_name,
+                                          chapter_patterns, packed, progress, dedup)
+    content, source_encoding = read_text_file(file_path)
+
+    enc = get_tokenizer(encoding_name)
+    chapters = build_chapter_index(content, get_chapter_matcher(chapter_patterns))
+    chapter_tokens = count_chapter_tokens(content, chapters, enc, workers)
+
+    # 相邻章节首尾相接，打包后的块直接用 (起点, 终点, 起始标题, 结束标题, token数) 表示
+    chunks = plan_chapter_chunks(chapters, chapter_tokens, max_tokens, balanced)
+    if balanced:
+        write_size_report(output_folder, base_name, [chunk[4] for chunk in chunks], max_tokens)
 
     # 保存 - 使用三位数编号
-    for i, (chunk, (start, end)) in enumerate(zip(chunks, chunk_ranges), 1):
-        safe_start = sanitize_filename(str(start))
-        safe_end = sanitize_filename(str(end))
-        range_str = safe_start if start == end else f"{safe_start}-{safe_end}"
-        filename = f"{base_name}_chunk_{i:03d}({range_str}).txt"
-        with open(os.path.join(output_folder, filename), 'w', encoding='utf-8') as f:
-            f.write(chunk)
+    with open_chunk_writer(output_folder, base_name, packed, progress, source_encoding, dedup) as writer:
+        for i, (chunk_start, chunk_end, start, end, tokens) in enumerate(chunks, 1):
+            safe_start = sanitize_filename(str(start))
+            safe_end = sanitize_filename(str(end))
+            range_str = safe_start if start == end else f"{safe_start}-{safe_end}"
+            filename = f"{base_name}_chunk_{i:03d}({range_str}).txt"
+            writer.write(filename, content[chunk_start:chunk_end], tokens=tokens,
+                         char_range=[chunk_start, chunk_end], title=start, last_title=end)
+    _write_chapter_metadata(output_folder, base_name, file_path, max_tokens, sum(chapter_tokens), len(chunks))
 
-    return output_folder, len(chunks)
+    return writer.path, len(chunks)
 
 
 # ================== 模式 C：章节段落混合模式（v3）==================
-def split_text_file_v3(file_path: str, output_folder: str, base_name: str, max_tokens: int, overlap_rate: float, min_chunk_ratio: float):
+def _split_oversized_chapter(job):
+    """进程池任务：单个超长章节按模式 A 的逻辑细分（balanced 时均衡细分）。
+    返回章节内的 [(起点, 终点, token数)] 和需要并入上一块的剩余内容 (起点, token数)（没有则为 None）。
+    """
+    chapter, encoding_name, max_tokens, overlap_tokens, min_chunk_tokens, balanced = job
+    token_map = TokenOffsetMap(chapter, get_tokenizer(encoding_name))
+    return cut_chapter(token_map, find_sentence_boundaries(chapter), len(chapter), max_tokens, overlap_tokens,
+                       min_chunk_tokens, balanced)
+
+
+def cut_chapter(token_map: TokenOffsetMap, boundaries, chapter_len: int, max_tokens: int, overlap_tokens: int,
+                min_chunk_tokens: int, balanced: bool = False):
+    """超长章节的细分（章节内位置），返回值同 _split_oversized_chapter（分块与分块规划共用）"""
+    spans, _, remainder = cut_token_chunks(None, token_map, boundaries, max_tokens, overlap_tokens,
+                                           min_chunk_tokens, end=chapter_len)
+    if balanced:
+        # 块数不多于贪心切法
+        return cut_balanced_chunks(None, token_map, boundaries, max_tokens, overlap_tokens, end=chapter_len,
+                                   max_chunks=len(spans)), None
+    return spans, remainder
+
+
+def assemble_mixed_chunks(chapters, chapter_tokens: List[int], sub_splits: dict):
+    """模式 C 按全文顺序排列区块：未超限的章节整章成块，超长章节换成其细分结果。
+    sub_splits 为 {章节序号: cut_chapter 的返回值}，返回 [(文件名标签, 章节标题, ChunkSpan)]。
+    """
+    chunks = []
+    for i, (base, chapter_end, chapter_title) in enumerate(chapters):
+        safe_title = sanitize_filename(str(chapter_title))
+        if i not in sub_splits:
+            # 章节未超限，直接作为一个块
+            chunks.append((safe_title, chapter_title, ChunkSpan(base, chapter_end, chapter_tokens[i])))
+            continue
+        spans, remainder = sub_splits[i]
+        for sub_chunk_idx, (start_pos, end_pos, tok) in enumerate(spans, 1):
+            chunks.append((f"{safe_title}_part{sub_chunk_idx}", chapter_title,
+                           ChunkSpan(base + start_pos, base + end_pos, tok)))
+        if remainder is not None:
+            # 将剩余内容合并到上一块
+            remainder_start, remainder_tokens = remainder
+            chunks[-1][2].merge_remainder(base + remainder_start, chapter_end, remainder_tokens)
+    return chunks
+
+
+def parallel_map(func, jobs, n_jobs: int, workers: int = DEFAULT_WORKERS):
+    """多于一个任务且允许多进程时用进程池执行，结果保持 jobs 的顺序"""
+    workers = min(workers or 1, n_jobs)
+    if workers <= 1:
+        return list(map(func, jobs))
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, jobs))
+
+
+def split_text_file_v3(file_path: str, output_folder: str, base_name: str, max_tokens: int, overlap_rate: float, min_chunk_ratio: float, encoding_name: str = None, stream: bool = False,
+                       chapter_patterns: List[str] = None, workers: int = DEFAULT_WORKERS, packed: bool = False,
+                       balanced: bool = False, progress=None, dedup: ChunkDeduplicator = None):
     """
     混合模式：先按章节分割，对超过max_tokens的章节再按token模式细分
     所有块按总顺序编号（001, 002, 003...）
-    参数：overlap_rate=块重叠率, min_chunk_ratio=最小块比例
+    参数：overlap_rate=块重叠率, min_chunk_ratio=最小块比例, encoding_name=分词器（默认 cl100k_base）,
+         stream=流式处理（超大文件，内存占用与文件大小无关）, chapter_patterns=追加的章节标题正则,
+         workers=批量编码线程数和超长章节细分的进程数（1 为单进程）, packed=打包输出为单个 .pack 归档,
+         balanced=超长章节用动态规划均衡细分（各块大小尽量一致），并写出区块大小报告,
+         progress=每写一个区块调用 progress(已写完的区块数)，抛出 SplitCancelled 可中止,
+         dedup=ChunkDeduplicator，在清单中标记重复和近似重复的区块
     """
+    _check_balanced(stream, balanced)
+    if stream:
+        return _split_text_file_v3_stream(file_path, output_folder, base_name, max_tokens, overlap_rate,
+                                          min_chunk_ratio, encoding_name, chapter_patterns, packed, progress, dedup)
     # 读取文件
-    encodings = ['utf-8', 'gbk', 'shift_jis', 'utf-16', 'latin1']
-    content = None
-    for encoding in encodings:
-        try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                content = f.read()
-            break
-        except UnicodeDecodeError:
-            continue
-    if content is None:
-        raise ValueError("无法用任何支持的编码读取文件")
+    content, source_encoding = read_text_file(file_path)
 
-    enc = tiktoken.get_encoding("cl100k_base")
+    enc = get_tokenizer(encoding_name)
     
-    # 第一步：按章节分割
-    chapters = detect_chapters(content)
-    titles = [extract_title(ch) for ch in chapters]
+    # 第一步：按章节分割，批量统计各章 token 数
+    chapters = build_chapter_index(content, get_chapter_matcher(chapter_patterns))
+    chapter_tokens = count_chapter_tokens(content, chapters, enc, workers)
     
-    # 第二步：处理每个章节，超过限制的再细分
-    final_chunks = []
-    chunk_num = 1
+    # 第二步：超过限制的章节并行细分（各章互不依赖），结果按章节顺序取回
+    overlap_tokens = int(max_tokens * overlap_rate)  # 使用参数
+    min_chunk_tokens = max(200, int(max_tokens * min_chunk_ratio))  # 使用参数
+    oversized = [i for i, tok in enumerate(chapter_tokens) if tok > max_tokens]
+    jobs = ((content[chapters[i][0]:chapters[i][1]], encoding_name, max_tokens, overlap_tokens, min_chunk_tokens,
+             balanced) for i in oversized)
+    sub_splits = dict(zip(oversized, parallel_map(_split_oversized_chapter, jobs, len(oversized), workers)))
     
-    for i, chapter in enumerate(chapters):
-        chapter_tokens = len(enc.encode(chapter))
-        chapter_title = titles[i]
-        
-        if chapter_tokens <= max_tokens:
-            # 章节未超限，直接作为一个块
-            safe_title = sanitize_filename(str(chapter_title))
-            filename = f"{base_name}_chunk_{chunk_num:03d}({safe_title}).txt"
-            final_chunks.append((filename, chapter))
-            chunk_num += 1
-        else:
-            # 章节超限，需要按token模式细分
-            # 使用类似v1的逻辑进行细分
-            boundaries = find_sentence_boundaries(chapter)
-            overlap_tokens = int(max_tokens * overlap_rate)  # 使用参数
-            min_chunk_tokens = max(200, int(max_tokens * min_chunk_ratio))  # 使用参数
-            chars_per_token = len(chapter) / (chapter_tokens or 1)
-            
-            current_pos = 0
-            current_token_pos = 0
-            sub_chunk_idx = 1
-            
-            while current_token_pos < chapter_tokens:
-                target_end_token_pos = min(current_token_pos + max_tokens, chapter_tokens)
-                target_end_char_pos = int(target_end_token_pos * chars_per_token)
-                optimal_end_pos = find_optimal_boundary(chapter, target_end_char_pos, boundaries)
-                chunk_text = chapter[current_pos:optimal_end_pos]
-                chunk_tokens = len(enc.encode(chunk_text))
-                
-                # 如果块太小且不是第一块，尝试扩展
-                if chunk_tokens < min_chunk_tokens and current_pos > 0:
-                    next_boundaries = [b for b in boundaries if b > optimal_end_pos]
-                    if next_boundaries:
-                        next_boundary = min(next_boundaries)
-                        chunk_text = chapter[current_pos:next_boundary]
-                        chunk_tokens = len(enc.encode(chunk_text))
-                        optimal_end_pos = next_boundary
-                
-                # 保存子块
-                safe_title = sanitize_filename(str(chapter_title))
-                filename = f"{base_name}_chunk_{chunk_num:03d}({safe_title}_part{sub_chunk_idx}).txt"
-                final_chunks.append((filename, chunk_text))
-                chunk_num += 1
-                sub_chunk_idx += 1
-                
-                # 计算下一个起始位置（带重叠）
-                overlap_start_char = current_pos + int(max(0, (target_end_token_pos - overlap_tokens - current_token_pos)) * chars_per_token)
-                next_start_boundary = find_optimal_boundary(chapter, overlap_start_char, boundaries)
-                next_start_pos = max(optimal_end_pos, next_start_boundary)
-                current_pos = next_start_pos
-                current_token_pos = int(current_pos / chars_per_token)
-                
-                # 处理剩余内容
-                remaining_tokens = chapter_tokens - current_token_pos
-                if remaining_tokens < min_chunk_tokens and remaining_tokens > 0:
-                    if final_chunks:
-                        # 将剩余内容合并到上一块
-                        remaining_text = chapter[current_pos:]
-                        prev_filename, prev_text = final_chunks[-1]
-                        final_chunks[-1] = (prev_filename, prev_text + "\n\n[合并的剩余内容]\n" + remaining_text)
-                    break
+    # 第三步：按全文顺序编号（只记录位置，写出时再取文本）
+    final_chunks = assemble_mixed_chunks(chapters, chapter_tokens, sub_splits)
     
     # 保存所有块
-    for filename, chunk_text in final_chunks:
-        with open(os.path.join(output_folder, filename), 'w', encoding='utf-8') as f:
-            f.write(chunk_text)
+    with open_chunk_writer(output_folder, base_name, packed, progress, source_encoding, dedup) as writer:
+        for chunk_num, (label, title, chunk) in enumerate(final_chunks, 1):
+            chunk.write_to(writer, f"{base_name}_chunk_{chunk_num:03d}({label}).txt", content, title=title)
+    if balanced:
+        write_size_report(output_folder, base_name, [chunk.tokens for _, _, chunk in final_chunks], max_tokens)
+    _write_chapter_metadata(output_folder, base_name, file_path, max_tokens, sum(chapter_tokens),
+                            len(final_chunks))
     
-    return output_folder, len(final_chunks)
+    return writer.path, len(final_chunks)
+
+
+# ================== 流式分割（超大文件）==================
+STREAM_BLOCK_CHARS = 1 << 20       # 每次增量解码读取的字符数
+STREAM_WINDOW_CHARS = 4 << 20      # 滑动窗口 / 单章内存上限（字符）
+STREAM_AUTO_BYTES = 512 << 20      # 超过此大小的文件默认使用流式处理
+
+_PARAGRAPH_SEP = re.compile(r'\n\s*\n')
+_SAFE_PARAGRAPH_CUT = re.compile(r'.*\S(?=\S)', re.DOTALL)
+
+
+def iter_text_blocks(file_path: str, encoding: str, block_chars: int = STREAM_BLOCK_CHARS):
+    with open(file_path, 'r', encoding=encoding) as f:
+        while True:
+            block = f.read(block_chars)
+            if not block:
+                return
+            yield block
+
+
+def iter_preserve_formatting(blocks, max_paragraph_chars: int = STREAM_WINDOW_CHARS, normalizer: TextNormalizer = None):
+    """流式版 preserve_formatting：逐块产出规范化后的文本，拼接结果与整篇处理相同。
+    只在其后已出现非空白字符的段落分隔处切开，保证分隔符完整；
+    超长段落在两个非空白字符之间切开（规范化规则都不跨越这种位置）。
+    """
+    normalizer = normalizer or DEFAULT_NORMALIZER
+    carry = ''
+    has_output = False
+    continuing = False  # carry 是已输出段落的后半部分
+    for block in itertools.chain(blocks, [None]):
+        if block is None:
+            buffer, cut = carry, len(carry)
+        else:
+            buffer = carry + block
+            cut = 0
+            for match in _PARAGRAPH_SEP.finditer(buffer, 0, len(buffer.rstrip())):
+                cut = match.end()
+        carry = buffer[cut:]
+        part = normalizer.normalize(buffer[:cut]) if cut else ''
+        if part:
+            yield part if continuing or not has_output else '\n\n' + part
+            has_output = True
+            continuing = False
+        if block is not None and len(carry) > max_paragraph_chars:
+            match = _SAFE_PARAGRAPH_CUT.match(carry)
+            if match:
+                part = normalizer.normalize(carry[:match.end()])
+                yield part if continuing or not has_output else '\n\n' + part
+                has_output = True
+                continuing = True
+                carry = carry[match.end():]
+
+
+def iter_line_fragments(blocks, max_line_chars: int = STREAM_BLOCK_CHARS):
+    """把文本块切成行，产出 (片段, 是否行首)；超长的行分段产出，只有第一段算行首"""
+    carry = ''
+    line_start = True
+    for block in blocks:
+        lines = (carry + block).splitlines(keepends=True)
+        carry = lines.pop() if lines and lines[-1][-1] not in _LINE_ENDS else ''
+        for line in lines:
+            yield line, line_start
+            line_start = True
+        if len(carry) > max_line_chars:
+            yield carry, line_start
+            line_start = False
+            carry = ''
+    if carry:
+        yield carry, line_start
+
+
+class StreamTokenSplitter:
+    """滑动窗口上的模式 A 切块：feed() 追加文本并返回已确定的块，close() 切完剩余部分。
+    窗口只保留未切出的尾部，内存与文件大小无关。最后一块暂存到 close()，以便并入不足最小块的剩余内容。
+    返回的块为 (文本, token数, 起始, 结束)，位置是在全部输入文本中的字符偏移。
+    """
+
+    def __init__(self, tokenizer, max_tokens: int, overlap_tokens: int, min_chunk_tokens: int,
+                 window_chars: int = STREAM_WINDOW_CHARS):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self.window_chars = window_chars
+        self.carry = ''
+        self.pieces = []
+        self.pieces_chars = 0
+        self.offset = 0          # carry 在全部输入中的起始位置
+        self.pending = None      # 暂存的最后一块
+        self.total_tokens = 0
+
+    def feed(self, text: str):
+        self.pieces.append(text)
+        self.pieces_chars += len(text)
+        if len(self.carry) + self.pieces_chars < self.window_chars:
+            return []
+        return self._cut(final=False)
+
+    def close(self):
+        chunks = self._cut(final=True)
+        if self.pending:
+            chunks.append(tuple(self.pending))
+            self.pending = None
+        return chunks
+
+    def _cut(self, final: bool):
+        window = self.carry + ''.join(self.pieces)
+        self.pieces = []
+        self.pieces_chars = 0
+        token_map = TokenOffsetMap(window, self.tokenizer)
+        spans, next_pos, remainder = self._cut_window(window, token_map, final)
+        chunks = []
+        for start_pos, end_pos, token_count in spans:
+            if self.pending:
+                chunks.append(tuple(self.pending))
+            self.pending = [window[start_pos:end_pos], token_count, self.offset + start_pos, self.offset + end_pos]
+        if remainder and self.pending:
+            remaining_start, remaining_tokens = remainder
+            self.pending[0] += MERGED_REMAINDER_MARK + window[remaining_start:]
+            self.pending[1] += remaining_tokens
+            self.pending[3] = self.offset + len(window)
+        self.total_tokens += token_map.token_at(next_pos)
+        self.carry = window[next_pos:]
+        self.offset += next_pos
+        return chunks
+
+    def _cut_window(self, window: str, token_map: TokenOffsetMap, final: bool):
+        return cut_token_chunks(
+            window, token_map, find_sentence_boundaries(window), self.max_tokens, self.overlap_tokens,
+            self.min_chunk_tokens, first_chunk=self.pending is None, final=final,
+        )
+
+
+def _split_text_file_v1_stream(file_path, output_folder, base_name, CHUNK_SIZE, OVERLAP_RATE, MIN_CHUNK_RATIO,
+                               encoding_name=None, normalizer=None, packed=False, progress=None, dedup=None,
+                               splitter_class=None):
+    encoding = stream_file_encoding(file_path)
+    chunks_dir = os.path.join(output_folder, f"{base_name}_chunks")
+    metadata_dir = os.path.join(output_folder, "metadata")
+    os.makedirs(metadata_dir, exist_ok=True)
+
+    overlap_tokens = int(CHUNK_SIZE * OVERLAP_RATE)
+    min_chunk_tokens = max(200, int(CHUNK_SIZE * MIN_CHUNK_RATIO))
+    splitter = (splitter_class or StreamTokenSplitter)(get_tokenizer(encoding_name), CHUNK_SIZE, overlap_tokens,
+                                                        min_chunk_tokens)
+    metadata = _new_v1_metadata(file_path, CHUNK_SIZE, OVERLAP_RATE, 0)
+
+    def write(chunks):
+        for chunk_text, token_count, start_pos, end_pos in chunks:
+            chunk_num = len(metadata['chunks']) + 1
+            _write_v1_chunk(writer, base_name, metadata, chunk_num, (chunk_text,), token_count, start_pos, end_pos)
+
+    with open_chunk_writer(output_folder, base_name, packed, progress, encoding, dedup) as writer:
+        for piece in iter_preserve_formatting(iter_text_blocks(file_path, encoding), normalizer=normalizer):
+            write(splitter.feed(piece))
+        write(splitter.close())
+    if not metadata['chunks']:
+        raise ValueError("文件内容为空")
+
+    metadata['total_tokens'] = splitter.total_tokens
+    metadata['total_chunks'] = len(metadata['chunks'])
+    metadata_file = os.path.join(metadata_dir, f"{base_name}_metadata.json")
+    with open(metadata_file, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    return writer.path if packed else chunks_dir, len(metadata['chunks'])
+
+
+class _StreamChapter:
+    """流式读取中的当前章节：小章节留在内存；超过窗口上限后由调用方转为边读边处理。
+    start / end 为章节在全文中的字符位置，end 随读取推进。
+    """
+
+    def __init__(self, first_line: str, title: str = None, start: int = 0):
+        self.title = extract_title(first_line) if title is None else title
+        self.start = start
+        self.end = start + len(first_line)
+        self.lines = [first_line]
+        self.chars = len(first_line)
+        self.check_at = STREAM_WINDOW_CHARS
+
+    def add(self, line: str):
+        self.lines.append(line)
+        self.chars += len(line)
+
+    def take_text(self) -> str:
+        text = ''.join(self.lines)
+        self.lines = []
+        self.chars = 0
+        return text
+
+
+def _iter_stream_chapters(file_path: str, matcher: ChapterMatcher = None):
+    """逐行识别章节，产出 ('line', 章节, 行) 和 ('end', 章节, None) 事件"""
+    matcher = matcher or DEFAULT_CHAPTER_MATCHER
+    encoding = stream_file_encoding(file_path)
+    chapter = None
+    pos = 0
+    for fragment, line_start in iter_line_fragments(iter_text_blocks(file_path, encoding)):
+        title = matcher.match_line(fragment) if line_start else None
+        if title is not None:
+            if chapter is not None:
+                yield 'end', chapter, None
+            chapter = _StreamChapter(fragment, title, pos)
+        elif chapter is None:
+            chapter = _StreamChapter(fragment, start=pos)
+        else:
+            chapter.end += len(fragment)
+            yield 'line', chapter, fragment
+        pos += len(fragment)
+    if chapter is not None:
+        yield 'end', chapter, None
+
+
+def _split_text_file_v2_stream(file_path, output_folder, base_name, max_tokens, encoding_name=None,
+                               chapter_patterns=None, packed=False, progress=None, dedup=None):
+    enc = get_tokenizer(encoding_name)
+    writer = open_chunk_writer(output_folder, base_name, packed, progress, stream_file_encoding(file_path), dedup)
+    chunk_count = 0
+    current_chunk = []      # 当前打包中的章节文本
+    current_tokens = 0
+    current_titles = None   # (起始标题, 结束标题)
+    current_start = 0       # 当前块在全文中的起点
+    spill = None            # 超大章节：直接边读边写入自己的文件
+    total_tokens = 0
+
+    def write_chunk(parts, start, end, tokens, char_range):
+        nonlocal chunk_count
+        chunk_count += 1
+        safe_start = sanitize_filename(str(start))
+        safe_end = sanitize_filename(str(end))
+        range_str = safe_start if start == end else f"{safe_start}-{safe_end}"
+        filename = f"{base_name}_chunk_{chunk_count:03d}({range_str}).txt"
+        f = writer.open(filename, tokens=tokens, char_range=char_range, title=start, last_title=end)
+        f.writelines(parts)
+        return f
+
+    def flush_current(end_pos):
+        nonlocal current_chunk, current_tokens, current_titles
+        if current_chunk:
+            write_chunk(current_chunk, *current_titles, current_tokens, [current_start, end_pos]).close()
+        current_chunk = []
+        current_tokens = 0
+        current_titles = None
+
+    with writer:
+        for event, chapter, line in _iter_stream_chapters(file_path, get_chapter_matcher(chapter_patterns)):
+            if event == 'line':
+                if spill:
+                    spill.write(line)
+                    spill.info['tokens'] += enc.count(line)   # 逐行累加，行边界处可能有少量误差
+                    continue
+                chapter.add(line)
+                if chapter.chars >= chapter.check_at:
+                    chapter.check_at += STREAM_WINDOW_CHARS
+                    text = chapter.take_text()
+                    tok = enc.count(text)
+                    if tok > max_tokens:
+                        flush_current(chapter.start)
+                        spill = write_chunk([text], chapter.title, chapter.title, tok, None)
+                    else:
+                        chapter.add(text)
+                continue
+
+            # 章节结束
+            if spill:
+                spill.info['char_range'] = [chapter.start, chapter.end]
+                spill.close()
+                total_tokens += spill.info['tokens']
+                spill = None
+                continue
+            text = chapter.take_text()
+            tok = enc.count(text)
+            total_tokens += tok
+            if tok > max_tokens:
+                flush_current(chapter.start)
+                write_chunk([text], chapter.title, chapter.title, tok, [chapter.start, chapter.end]).close()
+            elif current_tokens + tok <= max_tokens:
+                if not current_chunk:
+                    current_start = chapter.start
+                current_chunk.append(text)
+                current_tokens += tok
+                current_titles = (current_titles[0] if current_titles else chapter.title, chapter.title)
+            else:
+                flush_current(chapter.start)
+                current_chunk = [text]
+                current_tokens = tok
+                current_titles = (chapter.title, chapter.title)
+                current_start = chapter.start
+        if current_chunk:
+            flush_current(chapter.end)
+    _write_chapter_metadata(output_folder, base_name, file_path, max_tokens, total_tokens, chunk_count)
+    return writer.path, chunk_count
+
+
+def _split_text_file_v3_stream(file_path, output_folder, base_name, max_tokens, overlap_rate, min_chunk_ratio,
+                               encoding_name=None, chapter_patterns=None, packed=False, progress=None,
+                               dedup=None):
+    enc = get_tokenizer(encoding_name)
+    writer = open_chunk_writer(output_folder, base_name, packed, progress, stream_file_encoding(file_path), dedup)
+    overlap_tokens = int(max_tokens * overlap_rate)
+    min_chunk_tokens = max(200, int(max_tokens * min_chunk_ratio))
+    chunk_num = 0
+    splitter = None   # 超长章节的窗口切块器
+    part_idx = 0
+    total_tokens = 0
+
+    def write_chunk(chunk_text, label, chapter, tokens, start, end):
+        nonlocal chunk_num
+        chunk_num += 1
+        writer.write(f"{base_name}_chunk_{chunk_num:03d}({label}).txt", chunk_text, tokens=tokens,
+                     char_range=[start, end], title=chapter.title)
+
+    def write_parts(chapter, chunks):
+        # 切块器从章节开头读起，块位置加上章节起点即为全文位置
+        nonlocal part_idx
+        for chunk_text, tokens, start_pos, end_pos in chunks:
+            part_idx += 1
+            write_chunk(chunk_text, f"{sanitize_filename(str(chapter.title))}_part{part_idx}", chapter, tokens,
+                        chapter.start + start_pos, chapter.start + end_pos)
+
+    with writer:
+        for event, chapter, line in _iter_stream_chapters(file_path, get_chapter_matcher(chapter_patterns)):
+            if event == 'line':
+                if splitter:
+                    write_parts(chapter, splitter.feed(line))
+                    continue
+                chapter.add(line)
+                if chapter.chars >= chapter.check_at:
+                    chapter.check_at += STREAM_WINDOW_CHARS
+                    text = chapter.take_text()
+                    if enc.count(text) > max_tokens:
+                        splitter = StreamTokenSplitter(enc, max_tokens, overlap_tokens, min_chunk_tokens)
+                        part_idx = 0
+                        write_parts(chapter, splitter.feed(text))
+                    else:
+                        chapter.add(text)
+                continue
+
+            # 章节结束
+            if not splitter:
+                text = chapter.take_text()
+                tok = enc.count(text)
+                if tok <= max_tokens:
+                    total_tokens += tok
+                    write_chunk(text, sanitize_filename(str(chapter.title)), chapter, tok, chapter.start, chapter.end)
+                    continue
+                splitter = StreamTokenSplitter(enc, max_tokens, overlap_tokens, min_chunk_tokens)
+                part_idx = 0
+                splitter.feed(text)
+            write_parts(chapter, splitter.close())
+            total_tokens += splitter.total_tokens
+            splitter = None
+    _write_chapter_metadata(output_folder, base_name, file_path, max_tokens, total_tokens, chunk_num)
+    return writer.path, chunk_num
+
+
+# ================== 模式 D：内容定义分块（v4）==================
+# 切点由内容决定：每个句子边界按其前一句的 crc32 和 token 数得到一个分值，
+# 块长度达到最小块后遇到的第一个分值低于阈值的边界（锚点）即为切点；到上限仍没有锚点时取窗口内分值最低的边界。
+# 分值只取决于句子本身，某处改动后只有附近的区块变化，后面的切点会重新对齐到相同的锚点，
+# 未改动的区块文本和哈希保持不变，下游可以按哈希复用已有结果。
+# 锚点概率与句子 token 数成正比，平均每 (上限 - 最小块) 个 token 出现一个锚点，与句子长短无关。
+
+
+def sentence_hashes(text: str, boundaries) -> array:
+    """每个边界之前那一句（上一个边界到该边界）的 crc32"""
+    hashes = array('q')
+    prev = 0
+    for pos in boundaries:
+        hashes.append(zlib.crc32(text[prev:pos].encode('utf-8')))
+        prev = pos
+    return hashes
+
+
+def cut_content_defined_chunks(token_map: TokenOffsetMap, boundaries, hashes, max_tokens: int, overlap_tokens: int,
+                               min_chunk_tokens: int, end: int, start: int = 0, final: bool = True):
+    """在 [start, end) 上按内容定义的锚点切块，hashes 与边界一一对应（见 sentence_hashes）。
+    每块（含重叠）在 [min_chunk_tokens, max_tokens] 内，最后一块可能不足最小块；整段无边界时按 token 硬切。
+    返回值同 cut_token_chunks（剩余部分总为 None）；final=False 时只切出离 end 足够远的块。
+    """
+    positions = getattr(boundaries, 'positions', boundaries)
+    min_chunk_tokens = min(min_chunk_tokens, max_tokens)
+    anchor_gap = max(1, max_tokens - min_chunk_tokens)
+    end_token = token_map.token_at(end)
+    safe_tokens = 2 * max_tokens
+    chunks = []
+    pos = start
+    while pos < end:
+        pos_token = token_map.token_at(pos)
+        if not final and end_token - pos_token < safe_tokens:
+            break
+        cut = None
+        best = None
+        i = bisect_right(positions, pos)
+        prev_token = pos_token if i == 0 else token_map.token_at(positions[i - 1])
+        while i < len(positions) and positions[i] < end:
+            boundary_token = token_map.token_at(positions[i])
+            tokens = boundary_token - pos_token
+            if tokens > max_tokens:
+                break
+            if tokens >= min_chunk_tokens:
+                # 分值 = crc32 / 2^32 / 句子 token 数，低于 1 / anchor_gap 即为锚点
+                score = hashes[i] / (1 << 32) / max(1, boundary_token - prev_token)
+                if score * anchor_gap < 1:
+                    cut = positions[i]
+                    break
+                if best is None or score < best[0]:
+                    best = (score, positions[i])
+            prev_token = boundary_token
+            i += 1
+        if cut is None:
+            if end_token - pos_token <= max_tokens:
+                cut = end
+            elif best is not None:
+                cut = best[1]
+            else:
+                cut = max(token_map.char_at(pos_token + max_tokens), pos + 1)
+        chunks.append((pos, cut, token_map.count(pos, cut)))
+        next_pos = cut
+        if overlap_tokens and cut < end:
+            overlap_start = boundaries.next(token_map.char_at(token_map.token_at(cut) - overlap_tokens) - 1)
+            if overlap_start is not None and pos < overlap_start < cut:
+                next_pos = overlap_start
+        pos = next_pos
+    return chunks, pos, None
+
+
+class StreamContentSplitter(StreamTokenSplitter):
+    """滑动窗口上的模式 D 切块，用法同 StreamTokenSplitter。
+    窗口总是从块起点（句子边界）开始，窗口内的句子哈希与整篇处理时相同。
+    """
+
+    def _cut_window(self, window: str, token_map: TokenOffsetMap, final: bool):
+        boundaries = find_sentence_boundaries(window)
+        return cut_content_defined_chunks(token_map, boundaries, sentence_hashes(window, boundaries),
+                                          self.max_tokens, self.overlap_tokens, self.min_chunk_tokens,
+                                          len(window), final=final)
+
+
+def plan_content_defined_chunks(token_map: TokenOffsetMap, boundaries, hashes, text_len: int, CHUNK_SIZE,
+                                OVERLAP_RATE, MIN_CHUNK_RATIO) -> List[ChunkSpan]:
+    """模式 D 的切点（分块与分块规划共用），CHUNK_SIZE 为每块上限"""
+    overlap_tokens = int(CHUNK_SIZE * OVERLAP_RATE)
+    min_chunk_tokens = max(200, int(CHUNK_SIZE * MIN_CHUNK_RATIO))
+    spans, _, _ = cut_content_defined_chunks(token_map, boundaries, hashes, CHUNK_SIZE, overlap_tokens,
+                                             min_chunk_tokens, text_len)
+    return [ChunkSpan(*span) for span in spans]
+
+
+def split_text_file_v4(file_path: str, output_folder: str, base_name: str, CHUNK_SIZE, OVERLAP_RATE,
+                       MIN_CHUNK_RATIO, encoding_name: str = None, stream: bool = False,
+                       normalizer: TextNormalizer = None, packed: bool = False, balanced: bool = False,
+                       progress=None, dedup: ChunkDeduplicator = None):
+    """内容定义分块：参数与模式 A 相同，CHUNK_SIZE 为每块上限，平均块长约为上限与最小块之间。
+    局部改动只影响附近的区块，其余区块的文本和哈希不变。输出格式与模式 A 相同。
+    """
+    if balanced:
+        raise ValueError("模式 D 的切点由内容决定，不能与均衡分块同时使用")
+    if stream:
+        return _split_text_file_v1_stream(file_path, output_folder, base_name, CHUNK_SIZE, OVERLAP_RATE,
+                                          MIN_CHUNK_RATIO, encoding_name, normalizer, packed, progress, dedup,
+                                          splitter_class=StreamContentSplitter)
+    text, source_encoding = read_text_file(file_path)
+    if not text.strip():
+        raise ValueError("文件内容为空")
+
+    text = preserve_formatting(text, normalizer)
+    token_map = TokenOffsetMap(text, get_tokenizer(encoding_name))
+    boundaries = find_sentence_boundaries(text)
+    chunks = plan_content_defined_chunks(token_map, boundaries, sentence_hashes(text, boundaries), len(text),
+                                         CHUNK_SIZE, OVERLAP_RATE, MIN_CHUNK_RATIO)
+    chunks_dir = os.path.join(output_folder, f"{base_name}_chunks")
+    metadata_dir = os.path.join(output_folder, "metadata")
+    os.makedirs(metadata_dir, exist_ok=True)
+
+    metadata = _new_v1_metadata(file_path, CHUNK_SIZE, OVERLAP_RATE, token_map.total_tokens)
+    with open_chunk_writer(output_folder, base_name, packed, progress, source_encoding, dedup) as writer:
+        for chunk_num, chunk in enumerate(chunks, 1):
+            _write_v1_chunk(writer, base_name, metadata, chunk_num, chunk.parts(text), chunk.tokens,
+                            chunk.start, chunk.char_end)
+
+    metadata['total_chunks'] = len(metadata['chunks'])
+    with open(os.path.join(metadata_dir, f"{base_name}_metadata.json"), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    return writer.path if packed else chunks_dir, len(chunks)
+
+
+# ================== 分块规划（只算切点，不写区块）==================
+# 规划索引：原文编码、规范化、分词和边界扫描的结果存为 <内容 sha1>_<类型>_<参数摘要>.json + .bin，
+# .bin 为若干小端 int64 数组依次相接，各数组长度记在 .json 里。参数不同的规划直接在索引上重算切点，
+# 不再读取和分词原文。类型 tokens（模式 A）：规范化文本的 token 偏移表和边界表；
+# chapters（模式 B/C）：章节起点、各章 token 数，以及逐章的 token 偏移表和边界表（章节内位置）
+PLAN_INDEX_DIRNAME = "plan_index"
+PLAN_HISTOGRAM_BINS = 10
+
+
+def file_content_hash(file_path: str) -> str:
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PlanIndex:
+    """持久化的分块规划索引：meta 为 JSON 可表示的信息，arrays 为 {名称: array('q')}"""
+
+    def __init__(self, meta: dict, arrays: dict):
+        self.meta = meta
+        self.arrays = arrays
+        self._token_map = None
+        self._boundaries = None
+
+    def token_map(self) -> TokenOffsetMap:
+        """tokens 索引的整篇 token 偏移表，直接包装 offsets 数组，每个索引只建一次"""
+        if self._token_map is None:
+            self._token_map = TokenOffsetMap.from_offsets(self.arrays['offsets'], self.meta['text_len'])
+        return self._token_map
+
+    def boundaries(self) -> BoundaryIndex:
+        """tokens 索引的整篇句子边界表，每个索引只建一次"""
+        if self._boundaries is None:
+            self._boundaries = BoundaryIndex(self.arrays['boundaries'])
+        return self._boundaries
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        names = list(self.arrays)
+        meta = dict(self.meta, arrays={name: len(self.arrays[name]) for name in names})
+        # 先写 .bin 再写 .json：.json 存在即表示索引完整；都先写临时文件再改名，批量并行时互不干扰
+        tmp = f".{os.getpid()}.tmp"
+        with open(path + ".bin" + tmp, 'wb') as f:
+            for name in names:
+                f.write(_le_offsets(self.arrays[name]).tobytes())
+        os.replace(path + ".bin" + tmp, path + ".bin")
+        with open(path + ".json" + tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(path + ".json" + tmp, path + ".json")
+
+    @classmethod
+    def load(cls, path: str):
+        """读取索引，不存在或已损坏时返回 None"""
+        try:
+            with open(path + ".json", encoding='utf-8') as f:
+                meta = json.load(f)
+            arrays = {}
+            with open(path + ".bin", 'rb') as f:
+                for name, length in meta.pop('arrays').items():
+                    values = array('q')
+                    values.fromfile(f, length)
+                    arrays[name] = _le_offsets(values)
+        except (OSError, ValueError, KeyError, EOFError):
+            return None
+        return cls(meta, arrays)
+
+
+def _build_token_plan_index(text: str, tokenizer) -> PlanIndex:
+    offsets = tokenizer.token_offsets(text)
+    boundaries = find_sentence_boundaries(text).positions
+    return PlanIndex({'text_len': len(text)}, {'offsets': offsets, 'boundaries': boundaries,
+                                               'hashes': sentence_hashes(text, boundaries)})
+
+
+def _build_chapter_plan_index(text: str, tokenizer, matcher: ChapterMatcher) -> PlanIndex:
+    chapters = build_chapter_index(text, matcher)
+    starts = array('q', (start for start, _, _ in chapters))
+    starts.append(len(text))
+    chapter_tokens = array('q')
+    offsets = array('q')
+    boundaries = array('q')
+    boundary_counts = array('q')
+    for start, end, _ in chapters:
+        chapter = text[start:end]
+        chapter_offsets = tokenizer.token_offsets(chapter)
+        chapter_tokens.append(len(chapter_offsets))
+        offsets.extend(chapter_offsets)
+        chapter_boundaries = find_sentence_boundaries(chapter).positions
+        boundary_counts.append(len(chapter_boundaries))
+        boundaries.extend(chapter_boundaries)
+    return PlanIndex({'text_len': len(text), 'titles': [title for _, _, title in chapters]},
+                     {'starts': starts, 'chapter_tokens': chapter_tokens, 'offsets': offsets,
+                      'boundaries': boundaries, 'boundary_counts': boundary_counts})
+
+
+def load_plan_index(file_path: str, kind: str, encoding_name: str = None, chapter_patterns: List[str] = None,
+                    normalizer: TextNormalizer = None, index_dir: str = None):
+    """取文件的规划索引（kind 为 tokens 或 chapters），没有就建好并保存。
+    返回 (索引, 是否复用了已有索引)。
+    """
+    tokenizer = get_tokenizer(encoding_name)
+    if kind == 'tokens':
+        params = [tokenizer.name, list((normalizer or DEFAULT_NORMALIZER).rules)]
+    else:
+        params = [tokenizer.name, list(get_chapter_matcher(chapter_patterns).patterns)]
+    param_digest = hashlib.sha1(json.dumps(params, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+    index_dir = index_dir or os.path.join(create_output_folders(), PLAN_INDEX_DIRNAME)
+    path = os.path.join(index_dir, f"{file_content_hash(file_path)}_{kind}_{param_digest}")
+    index = PlanIndex.load(path)
+    # 早期的 tokens 索引没有句子哈希（模式 D 需要），重新建立
+    if index is not None and (kind != 'tokens' or 'hashes' in index.arrays):
+        return index, True
+
+    text, source_encoding = read_text_file(file_path)
+    if kind == 'tokens':
+        index = _build_token_plan_index(preserve_formatting(text, normalizer), tokenizer)
+    else:
+        index = _build_chapter_plan_index(text, tokenizer, get_chapter_matcher(chapter_patterns))
+    index.meta.update(file=os.path.abspath(file_path), encoding=source_encoding, params=params)
+    index.save(path)
+    return index, False
+
+
+def size_histogram(sizes: List[int], max_tokens: int, bins: int = PLAN_HISTOGRAM_BINS) -> List[dict]:
+    """按 [0, max_tokens] 等分的区块大小直方图，超过上限的区块计入最后一格"""
+    width = max(1, -(-max_tokens // bins))
+    counts = [0] * bins
+    for size in sizes:
+        counts[min(size // width, bins - 1)] += 1
+    return [{'from': i * width, 'to': min((i + 1) * width, max_tokens), 'count': count}
+            for i, count in enumerate(counts)]
+
+
+def format_size_histogram(histogram: List[dict], width: int = 40) -> str:
+    peak = max((row['count'] for row in histogram), default=0) or 1
+    return '\n'.join(f"{row['from']:>7}-{row['to']:<7} {row['count']:>6} {'#' * round(row['count'] * width / peak)}".rstrip()
+                     for row in histogram)
+
+
+def _plan_mixed_chunks(index: PlanIndex, max_tokens: int, overlap_rate: float, min_chunk_ratio: float,
+                       balanced: bool):
+    starts = index.arrays['starts']
+    chapter_tokens = index.arrays['chapter_tokens']
+    # 超长章节的偏移表和边界表用 memoryview 切片，不复制
+    offsets = memoryview(index.arrays['offsets'])
+    boundaries = memoryview(index.arrays['boundaries'])
+    chapters = [(starts[i], starts[i + 1], title) for i, title in enumerate(index.meta['titles'])]
+    overlap_tokens = int(max_tokens * overlap_rate)
+    min_chunk_tokens = max(200, int(max_tokens * min_chunk_ratio))
+    token_starts = list(itertools.accumulate(chapter_tokens, initial=0))
+    boundary_starts = list(itertools.accumulate(index.arrays['boundary_counts'], initial=0))
+    sub_splits = {}
+    for i, tok in enumerate(chapter_tokens):
+        if tok > max_tokens:
+            chapter_len = starts[i + 1] - starts[i]
+            token_map = TokenOffsetMap.from_offsets(offsets[token_starts[i]:token_starts[i + 1]], chapter_len)
+            chapter_boundaries = BoundaryIndex(boundaries[boundary_starts[i]:boundary_starts[i + 1]])
+            sub_splits[i] = cut_chapter(token_map, chapter_boundaries, chapter_len, max_tokens, overlap_tokens,
+                                        min_chunk_tokens, balanced)
+    return [(chunk.start, chunk.char_end, chunk.tokens)
+            for _, _, chunk in assemble_mixed_chunks(chapters, chapter_tokens, sub_splits)]
+
+
+def plan_spans(index: PlanIndex, version: str, params: tuple, balanced: bool = False):
+    """在规划索引上计算切点，参数同 validate_split_params 的返回值，返回 [(起点, 终点, token数)]"""
+    if version == "v1":
+        chunks = plan_token_chunks(index.token_map(), index.boundaries(), index.meta['text_len'], *params, balanced)
+        return [(chunk.start, chunk.char_end, chunk.tokens) for chunk in chunks]
+    if version == "v4":
+        if balanced:
+            raise ValueError("模式 D 的切点由内容决定，不能与均衡分块同时使用")
+        chunks = plan_content_defined_chunks(index.token_map(), index.boundaries(), index.arrays['hashes'],
+                                             index.meta['text_len'], *params)
+        return [(chunk.start, chunk.char_end, chunk.tokens) for chunk in chunks]
+    if version == "v2":
+        starts = index.arrays['starts']
+        chapters = [(starts[i], starts[i + 1], title) for i, title in enumerate(index.meta['titles'])]
+        return [(chunk[0], chunk[1], chunk[4])
+                for chunk in plan_chapter_chunks(chapters, index.arrays['chapter_tokens'], *params, balanced)]
+    return _plan_mixed_chunks(index, *params, balanced)
+
+
+def plan_file(file_path: str, mode: str = "A", chunk_size: int = DEFAULT_CHUNK_SIZE,
+              overlap_rate: float = DEFAULT_OVERLAP_RATE, min_chunk_ratio: float = DEFAULT_MIN_CHUNK_RATIO,
+              max_tokens: int = DEFAULT_MAX_TOKENS, encoding_name: str = None, chapter_patterns: List[str] = None,
+              balanced: bool = False, index_dir: str = None) -> dict:
+    """只规划、不写区块：返回与 split_file 相同参数下的各块位置、大小分布和直方图。
+    第一次规划某个文件时建立索引（与一次分块的读取和分词开销相当）并保存在 index_dir
+    （默认 OUT/plan_index），之后换参数重新规划只在索引上计算切点。
+    返回的 spans 为 [(起点, 终点, token数)]，模式 A、D 的位置以规范化后的文本为准。
+    """
+    version, params = validate_split_params(mode, chunk_size, overlap_rate, min_chunk_ratio, max_tokens)
+    start = time.perf_counter()
+    index, reused = load_plan_index(file_path, 'tokens' if version in ("v1", "v4") else 'chapters', encoding_name,
+                                    chapter_patterns, index_dir=index_dir)
+    spans = plan_spans(index, version, params, balanced)
+    limit = params[0]
+    sizes = [tok for _, _, tok in spans]
+    report = chunk_size_report(sizes, limit)
+    report.pop('sizes', None)
+    return {
+        'file': file_path,
+        'mode': version,
+        'params': list(params),
+        'balanced': balanced,
+        'index_reused': reused,
+        'seconds': round(time.perf_counter() - start, 4),
+        'size_report': report,
+        'histogram': size_histogram(sizes, limit),
+        'spans': spans,
+    }
+
+
+def format_plan(plan: dict) -> str:
+    index_note = "复用索引" if plan['index_reused'] else "新建索引"
+    return (f"{format_size_report(plan['size_report'])}\n"
+            f"{format_size_histogram(plan['histogram'])}\n"
+            f"（{index_note}，用时 {plan['seconds'] * 1000:.1f} ms）")
+
+
+def rough_chunk_count(total_tokens: int, version: str, params: tuple) -> int:
+    """只按 token 总数粗估区块数（不计算切点），用于快速估算和进度条；参数同 validate_split_params 的返回值"""
+    if version == "v2":
+        step = params[0]
+    else:
+        size, overlap_rate, min_chunk_ratio = params
+        if version == "v4":
+            # 模式 D 的块长在最小块与上限之间，平均约在两者中间
+            size = (size + min(size, max(200, int(size * min_chunk_ratio)))) / 2
+        step = max(1, size * (1 - overlap_rate))
+    return max(1, int(-(-total_tokens // step)))
+
+
+# 自动调参：区块目标大小从可用上限向下搜索到一半，模式 A/C 同时搜索最小区块比例
+TUNE_SIZE_STEPS = 64
+TUNE_MIN_RATIOS = (0.1, 0.15, 0.2, 0.25, 0.3)
+TUNE_ROUND_SLACK = 0.1        # 为凑整并发、减少碎块，处理轮数最多比最少的方案多 10%
+TUNING_REPORT_SUFFIX = "_tuning.json"
+
+
+def tune_split_params(file_path: str, context_tokens: int, prompt_tokens: int = 0, mode: str = "A",
+                      pool_size: int = DEFAULT_POOL_SIZE, overlap_rate: float = DEFAULT_OVERLAP_RATE,
+                      min_chunk_ratio: float = DEFAULT_MIN_CHUNK_RATIO, encoding_name: str = None,
+                      chapter_patterns: List[str] = None, balanced: bool = False, index_dir: str = None) -> dict:
+    """在规划索引上搜索分块参数，不做实际分块。目标按优先级依次为：
+    1. 每块不超过 context_tokens - prompt_tokens（连同提示词放得进模型上下文）；
+    2. 区块数为 pool_size 的整数倍（最后一轮不留空闲的并发槽位）；
+    3. 小于 min_chunk_ratio × 目标大小的碎块尽量少；
+    4. 处理轮数尽量少，区块尽量大。
+    为满足 2、3 而增加的轮数不超过最少轮数的 TUNE_ROUND_SLACK。
+    模式 A/C/D 搜索目标大小和最小区块比例（重叠率保持 overlap_rate），模式 B 搜索最大 Token 上限。
+    返回选中的参数 options（可直接传给 split_file）和预计的区块统计。
+    """
+    budget = context_tokens - prompt_tokens
+    if budget <= 0:
+        raise ValueError("提示词开销必须小于模型上下文")
+    version, _ = validate_split_params(mode, budget, overlap_rate, min_chunk_ratio, budget)
+    pool_size = max(1, pool_size)
+    start = time.perf_counter()
+    index, reused = load_plan_index(file_path, 'tokens' if version in ("v1", "v4") else 'chapters', encoding_name,
+                                    chapter_patterns, index_dir=index_dir)
+    sizes = sorted({budget - budget * i // (2 * TUNE_SIZE_STEPS) for i in range(TUNE_SIZE_STEPS + 1)}, reverse=True)
+    # 均衡分块不用最小区块比例；比例相同效果时优先保留用户给定的值
+    ratios = [min_chunk_ratio]
+    if version != "v2" and not balanced:
+        ratios += [r for r in TUNE_MIN_RATIOS if r != min_chunk_ratio]
+
+    candidates = []
+    for size in sizes:
+        for ratio in ratios:
+            params = (size,) if version == "v2" else (size, overlap_rate, ratio)
+            tokens = [tok for _, _, tok in plan_spans(index, version, params, balanced)]
+            count = len(tokens)
+            small_limit = min_chunk_ratio * size
+            # (超出上下文的块数, 轮数, 空闲槽位, 碎块数, -目标大小)
+            score = (sum(tok > budget for tok in tokens), -(-count // pool_size), -count % pool_size,
+                     sum(tok < small_limit for tok in tokens), -size)
+            candidates.append((score, params, tokens))
+
+    least_over, least_rounds = min(score[:2] for score, _, _ in candidates)
+    max_rounds = least_rounds + int(least_rounds * TUNE_ROUND_SLACK)
+    (over_budget, rounds, idle_slots, small_chunks, _), params, tokens = min(
+        (c for c in candidates if c[0][0] == least_over and c[0][1] <= max_rounds),
+        key=lambda c: (c[0][2], c[0][3], c[0][1], c[0][4]))
+    if version == "v2":
+        options = {'mode': mode, 'max_tokens': params[0]}
+    else:
+        options = {'mode': mode, 'chunk_size': params[0], 'overlap_rate': params[1], 'min_chunk_ratio': params[2]}
+    report = chunk_size_report(tokens, budget)
+    report.pop('sizes', None)
+    return {
+        'file': file_path,
+        'context_tokens': context_tokens,
+        'prompt_tokens': prompt_tokens,
+        'budget': budget,
+        'pool_size': pool_size,
+        'options': options,
+        'chunks': len(tokens),
+        'rounds': rounds,
+        'idle_slots': idle_slots,
+        'small_chunks': small_chunks,
+        'over_budget': over_budget,
+        'size_report': report,
+        'histogram': size_histogram(tokens, budget),
+        'candidates': len(candidates),
+        'index_reused': reused,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def format_tuning(result: dict) -> str:
+    options = ', '.join(f"{k}={v}" for k, v in result['options'].items() if k != 'mode')
+    text = (f"自动调参: {options}（可用 {result['budget']} tokens = 上下文 {result['context_tokens']} "
+            f"- 提示词 {result['prompt_tokens']}，比较了 {result['candidates']} 组参数）\n"
+            f"预计 {result['chunks']} 块，并发 {result['pool_size']} 共 {result['rounds']} 轮"
+            f"（最后一轮空闲 {result['idle_slots']} 个槽位），碎块 {result['small_chunks']} 块")
+    if result['over_budget']:
+        text += f"，{result['over_budget']} 块超出可用上下文"
+    return text + "\n" + format_size_report(result['size_report'])
+
+
+def read_tuning_report(output_folder: str, base_name: str) -> dict:
+    with open(os.path.join(output_folder, "metadata", f"{base_name}{TUNING_REPORT_SUFFIX}"), encoding='utf-8') as f:
+        return json.load(f)
+
+
+# ================== 批量处理 ==================
+BATCH_MANIFEST_NAME = "manifest.json"
+
+
+def expand_inputs(inputs: List[str], pattern: str = "*.txt") -> List[str]:
+    """把文件、文件夹（取其中的 pattern 文件，含子文件夹）和通配符展开为去重后的文件列表"""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(glob.glob(os.path.join(item, "**", pattern), recursive=True))
+        elif glob.has_magic(item):
+            matches = sorted(glob.glob(item, recursive=True))
+        else:
+            matches = [item]
+        files.extend(m for m in matches if m == item or os.path.isfile(m))
+    return list(dict.fromkeys(files))
+
+
+def _split_batch_job(job):
+    """进程池任务：分块一本书，失败只记录在结果里，不影响其他文件"""
+    file_path, output_folder, options = job
+    record = {"file": file_path, "output": output_folder, "status": "ok", "chunks": 0, "total_tokens": None,
+              "error": None}
+    start = time.perf_counter()
+    try:
+        _, record["chunks"] = split_file(file_path, output_folder, **options)
+        if options.get("balanced"):
+            record["size_report"] = {k: v for k, v in read_size_report(output_folder, options['base_name']).items()
+                                     if k != 'sizes'}
+        if options.get("context_tokens"):
+            record["tuning"] = read_tuning_report(output_folder, options['base_name'])['options']
+        if options.get("dedup") or options.get("dedup_paragraphs"):
+            report = read_duplicate_report(output_folder, options['base_name'])
+            record["duplicates"] = {k: report[k] for k in ('unique_chunks', 'exact_duplicates', 'near_duplicates')}
+        # 各模式分块时都已统计 token 总数并写入汇总，不再重新编码原文
+        metadata_file = os.path.join(output_folder, "metadata", f"{options['base_name']}_metadata.json")
+        with open(metadata_file, encoding='utf-8') as f:
+            record["total_tokens"] = json.load(f)["total_tokens"]
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def split_batch(inputs: List[str], output_root: str, workers: int = DEFAULT_WORKERS, progress=None, **options):
+    """批量分块：inputs 可以是文件、文件夹或通配符，每本书输出到 output_root/<文件名>/。
+    多个文件用进程池并行（每本书内部单进程），单个文件失败不影响其他文件。
+    progress(已完成数, 总数, 该文件的记录) 在每本书完成后调用，抛出 SplitCancelled 时不再开始新的文件。
+    其余参数同 split_file。返回清单（同时写入 output_root/manifest.json）。
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    files = expand_inputs(inputs)
+    os.makedirs(output_root, exist_ok=True)
+    jobs = []
+    used_names = set()
+    for file_path in files:
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        folder_name = base_name
+        n = 2
+        while folder_name in used_names:  # 不同文件夹下的同名文件
+            folder_name = f"{base_name}_{n}"
+            n += 1
+        used_names.add(folder_name)
+        job_options = dict(options, base_name=base_name, workers=1)
+        jobs.append((file_path, os.path.join(output_root, folder_name), job_options))
+
+    records = [None] * len(jobs)
+    started = datetime.now()
+    workers = min(workers or 1, len(jobs))
+    if workers <= 1:
+        for i, job in enumerate(jobs):
+            records[i] = _split_batch_job(job)
+            if progress:
+                progress(i + 1, len(jobs), records[i])
+    elif jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_split_batch_job, job): i for i, job in enumerate(jobs)}
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                try:
+                    records[i] = future.result()
+                except Exception as e:  # 工作进程异常退出（如内存不足）
+                    records[i] = {"file": jobs[i][0], "output": jobs[i][1], "status": "failed", "chunks": 0,
+                                  "total_tokens": None, "error": f"{type(e).__name__}: {e}", "seconds": None}
+                if progress:
+                    try:
+                        progress(done, len(jobs), records[i])
+                    except SplitCancelled:
+                        # 未开始的文件直接取消，正在处理的等它们结束
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        raise
+
+    succeeded = [r for r in records if r["status"] == "ok"]
+    manifest = {
+        "created_at": started.isoformat(timespec="seconds"),
+        "elapsed_seconds": round((datetime.now() - started).total_seconds(), 3),
+        "options": {k: v for k, v in options.items() if k != "base_name"},
+        "workers": workers,
+        "totals": {
+            "files": len(records),
+            "succeeded": len(succeeded),
+            "failed": len(records) - len(succeeded),
+            "chunks": sum(r["chunks"] for r in succeeded),
+            "total_tokens": sum(r["total_tokens"] or 0 for r in succeeded),
+        },
+        "files": records,
+    }
+    with open(os.path.join(output_root, BATCH_MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+# ================== 语料打包（小文件合并成区块）==================
+# 短篇、帖子之类的文件夹按批量处理会一个文件一个区块、一次请求，大多远小于上限。
+# 语料模式把各篇装箱合并成接近上限的区块，每篇前加一行分隔，清单记下每篇在区块中的位置，便于把结果拆回各个文件。
+CORPUS_BASE_NAME = "corpus"
+CORPUS_DOC_HEADER = "=== {source} ==="     # 每篇文档前的分隔行；超长文档切成多段时为 "=== 来源 (段号/段数) ==="
+CORPUS_DOC_SEPARATOR = "\n\n"              # 同一区块中相邻两篇之间
+_CORPUS_HEADER_PATTERN = re.compile(r'^=== (.+?)(?: \((\d+)/(\d+)\))? ===\n', re.M)
+
+
+def corpus_doc_header(source: str, part: int = None, parts: int = None) -> str:
+    label = source if part is None else f"{source} ({part}/{parts})"
+    return CORPUS_DOC_HEADER.format(source=label) + "\n"
+
+
+def split_corpus_chunk(text: str) -> List[tuple]:
+    """按分隔行把语料区块（或保留了分隔行的模型输出）拆回各篇，返回 [(来源, 段号或 None, 正文)]"""
+    matches = list(_CORPUS_HEADER_PATTERN.finditer(text))
+    docs = []
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        body = text[match.end():next_match.start()] if next_match else text[match.end():]
+        if next_match:
+            body = body.removesuffix(CORPUS_DOC_SEPARATOR)
+        part = int(match.group(2)) if match.group(2) else None
+        docs.append((match.group(1), part, body))
+    return docs
+
+
+def pack_documents(sizes: List[int], capacity: int) -> List[List[int]]:
+    """装箱（最佳适应递减）：从大到小，每件放进放得下且剩余空间最小的箱子。
+    返回每箱的条目下标（箱内按原顺序，各箱按第一件的原顺序排列）。超过 capacity 的条目单独成箱。
+    """
+    free = []  # 已开箱子的 (剩余空间, 箱号)，按剩余空间排序
+    bins = []
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i], i)):
+        j = bisect_left(free, (sizes[i], -1))
+        if j < len(free):
+            room, b = free.pop(j)
+        else:
+            room, b = capacity, len(bins)
+            bins.append([])
+        bins[b].append(i)
+        insort(free, (room - sizes[i], b))
+    return sorted((sorted(members) for members in bins), key=lambda members: members[0])
+
+
+def pack_corpus(inputs: List[str], output_folder: str, max_tokens: int = DEFAULT_MAX_TOKENS,
+                encoding_name: str = None, base_name: str = CORPUS_BASE_NAME, packed: bool = False,
+                dedup: bool = False, dedup_paragraphs: bool = False, progress=None):
+    """语料模式：inputs 同 split_batch，把其中的各篇文档装箱合并成不超过 max_tokens 的区块（含分隔行）。
+    每篇前加一行分隔（见 corpus_doc_header），超过上限的文档先在句子边界上均衡切成多段再装箱。
+    区块清单中每块另记 documents：各篇的来源 source（相对输入文件夹的路径）、原文件 path、段号 part / 段数 parts、
+    在区块中的字符范围 char_range、在原文中的字符范围 source_range、token 数和编码，
+    据此（或用 split_corpus_chunk 按分隔行）即可把处理结果拆回各个文件。
+    汇总写入 metadata/<base_name>_metadata.json。返回 (区块所在目录或归档路径, 区块数)。
+    """
+    files = expand_inputs(inputs)
+    tokenizer = get_tokenizer(encoding_name)
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in files]) if files else ''
+    docs = []
+    failed = []
+    for path in files:
+        try:
+            text, source_encoding = read_text_file(path)
+        except Exception as e:
+            failed.append({'file': path, 'error': f"{type(e).__name__}: {e}"})
+            continue
+        body = text.strip()
+        if body:
+            docs.append({'path': path, 'source': os.path.relpath(os.path.abspath(path), root).replace(os.sep, '/'),
+                         'encoding': source_encoding, 'body': body, 'lead': len(text) - len(text.lstrip())})
+    if not docs:
+        raise ValueError("没有可打包的文档")
+
+    # 条目：(文档, 段号, 段数, 起点, 终点, token数, 分隔行)，超长文档的各段分别成为条目
+    doc_tokens = tokenizer.count_batch([doc['body'] for doc in docs])
+    headers = tokenizer.count_batch([corpus_doc_header(doc['source']) for doc in docs])
+    separator_tokens = tokenizer.count(CORPUS_DOC_SEPARATOR)
+    items = []
+    for doc, tokens, header_tokens in zip(docs, doc_tokens, headers):
+        body = doc['body']
+        if tokens + header_tokens + separator_tokens <= max_tokens:
+            items.append((doc, None, None, 0, len(body), tokens, corpus_doc_header(doc['source'])))
+            continue
+        # 段号未知，按较长的分隔行预留
+        reserve = tokenizer.count(corpus_doc_header(doc['source'], 9999, 9999)) + separator_tokens
+        token_map = TokenOffsetMap(body, tokenizer)
+        spans = cut_balanced_chunks(body, token_map, find_sentence_boundaries(body), max(1, max_tokens - reserve), 0)
+        items.extend((doc, part, len(spans), start, end, count, corpus_doc_header(doc['source'], part, len(spans)))
+                     for part, (start, end, count) in enumerate(spans, 1))
+    header_tokens = tokenizer.count_batch([item[6] for item in items])
+    bins = pack_documents([item[5] + header + separator_tokens for item, header in zip(items, header_tokens)],
+                          max_tokens)
+
+    os.makedirs(os.path.join(output_folder, "metadata"), exist_ok=True)
+    metadata = {
+        'source_files': len(files),
+        'documents': len(docs),
+        'failed': failed,
+        'max_tokens': max_tokens,
+        'total_tokens': sum(doc_tokens),
+        'total_chunks': len(bins),
+        'chunks': [],
+    }
+    dedup = ChunkDeduplicator(paragraphs=dedup_paragraphs) if dedup or dedup_paragraphs else None
+    with open_chunk_writer(output_folder, base_name, packed, progress, dedup=dedup) as writer:
+        for chunk_num, members in enumerate(bins, 1):
+            pieces = []
+            documents = []
+            pos = 0
+            for i in members:
+                doc, part, parts, start, end, tokens, header = items[i]
+                if pieces:
+                    pieces.append(CORPUS_DOC_SEPARATOR)
+                    pos += len(CORPUS_DOC_SEPARATOR)
+                pieces += [header, doc['body'][start:end]]
+                pos += len(header)
+                documents.append({'source': doc['source'], 'path': doc['path'], 'part': part, 'parts': parts,
+                                  'char_range': [pos, pos + end - start],
+                                  'source_range': [doc['lead'] + start, doc['lead'] + end],
+                                  'tokens': tokens, 'encoding': doc['encoding']})
+                pos += end - start
+            chunk_text = ''.join(pieces)
+            chunk_tokens = tokenizer.count(chunk_text)
+            chunk_name = f"{base_name}_{chunk_num:03d}.txt"
+            with writer.open(f"{base_name}_chunks/{chunk_name}", tokens=chunk_tokens, title=documents[0]['source'],
+                             documents=documents) as f:
+                f.write(chunk_text)
+            metadata['chunks'].append({
+                'chunk_num': chunk_num,
+                'file_path': os.path.join(f"{base_name}_chunks", chunk_name),
+                'token_count': chunk_tokens,
+                'documents': [doc['source'] for doc in documents],
+            })
+
+    with open(os.path.join(output_folder, "metadata", f"{base_name}_metadata.json"), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    return writer.path if packed else os.path.join(output_folder, f"{base_name}_chunks"), len(bins)
+
+
+def read_corpus_metadata(output_folder: str, base_name: str = CORPUS_BASE_NAME) -> dict:
+    with open(os.path.join(output_folder, "metadata", f"{base_name}_metadata.json"), encoding='utf-8') as f:
+        return json.load(f)
+
+
+# ================== 命令行与函数接口 ==================
+SPLIT_MODES = {"A": "v1", "B": "v2", "C": "v3", "D": "v4"}
+
+
+def validate_split_params(mode: str, chunk_size: int = DEFAULT_CHUNK_SIZE, overlap_rate: float = DEFAULT_OVERLAP_RATE,
+                          min_chunk_ratio: float = DEFAULT_MIN_CHUNK_RATIO, max_tokens: int = DEFAULT_MAX_TOKENS):
+    """检查分块参数，返回 (v1/v2/v3/v4, 参数元组)，参数不合法时抛 ValueError"""
+    version = SPLIT_MODES.get(mode.upper(), mode.lower())
+    if version in ("v1", "v3", "v4"):
+        if chunk_size <= 0:
+            raise ValueError("Chunk size 必须 > 0")
+        if not (0 <= overlap_rate < 1):
+            raise ValueError("重叠率应在 [0, 1) 范围内")
+        if not (0 < min_chunk_ratio <= 1):
+            raise ValueError("最小区块比例应在 (0, 1] 范围内")
+        return version, (chunk_size, overlap_rate, min_chunk_ratio)
+    if version == "v2":
+        if max_tokens <= 0:
+            raise ValueError("最大 Token 数必须 > 0")
+        return version, (max_tokens,)
+    raise ValueError(f"未知的分块模式: {mode}（可选 A / B / C / D）")
+
+
+def split_file(file_path: str, output_folder: str, mode: str = "A", chunk_size: int = DEFAULT_CHUNK_SIZE,
+               overlap_rate: float = DEFAULT_OVERLAP_RATE, min_chunk_ratio: float = DEFAULT_MIN_CHUNK_RATIO,
+               max_tokens: int = DEFAULT_MAX_TOKENS, encoding_name: str = None, stream: bool = False,
+               chapter_patterns: List[str] = None, workers: int = DEFAULT_WORKERS, base_name: str = None,
+               packed: bool = False, balanced: bool = False, dedup: bool = False, dedup_paragraphs: bool = False,
+               context_tokens: int = None, prompt_tokens: int = 0, pool_size: int = DEFAULT_POOL_SIZE,
+               progress=None):
+    """不依赖 GUI 的分块入口：mode 为 A/B/C/D（或 v1/v2/v3/v4），结果直接写入 output_folder。
+    模式 A、C、D 使用 chunk_size / overlap_rate / min_chunk_ratio，模式 B 使用 max_tokens。
+    模式 D 的 chunk_size 是每块上限，切点由内容决定，文件局部改动后只有附近的区块变化。
+    packed=True 时所有区块写入一个 .pack 归档（见 ChunkArchive），而不是逐个 .txt 文件。
+    balanced=True 时用动态规划选择切点，使各块大小尽量接近平均值（不能与 stream 同用），
+    区块大小分布写入 metadata/<base_name>_size_report.json。
+    dedup=True 时检测完全重复和近似重复的区块，dedup_paragraphs=True 时另统计重复出现的段落；
+    结果记入区块清单，汇总写入 metadata/<base_name>_duplicates.json。
+    给定 context_tokens 时先用 tune_split_params 自动选择分块大小参数（覆盖 chunk_size / min_chunk_ratio /
+    max_tokens，重叠率不变），调参结果写入 metadata/<base_name>_tuning.json。
+    progress(已写完的区块数) 在每个区块写出前后调用，抛出 SplitCancelled 可中止分块。
+    返回 (区块所在目录或归档路径, 区块数)。
+    """
+    base_name = base_name or os.path.splitext(os.path.basename(file_path))[0]
+    os.makedirs(output_folder, exist_ok=True)
+    if context_tokens:
+        tuning = tune_split_params(file_path, context_tokens, prompt_tokens, mode, pool_size, overlap_rate,
+                                   min_chunk_ratio, encoding_name, chapter_patterns, balanced)
+        chunk_size = tuning['options'].get('chunk_size', chunk_size)
+        min_chunk_ratio = tuning['options'].get('min_chunk_ratio', min_chunk_ratio)
+        max_tokens = tuning['options'].get('max_tokens', max_tokens)
+        metadata_dir = os.path.join(output_folder, "metadata")
+        os.makedirs(metadata_dir, exist_ok=True)
+        with open(os.path.join(metadata_dir, f"{base_name}{TUNING_REPORT_SUFFIX}"), 'w', encoding='utf-8') as f:
+            json.dump(tuning, f, indent=2, ensure_ascii=False)
+    version, params = validate_split_params(mode, chunk_size, overlap_rate, min_chunk_ratio, max_tokens)
+    dedup = ChunkDeduplicator(paragraphs=dedup_paragraphs) if dedup or dedup_paragraphs else None
+    if version == "v1":
+        return split_text_file_v1(file_path, output_folder, base_name, *params, encoding_name, stream,
+                                  packed=packed, balanced=balanced, progress=progress, dedup=dedup)
+    if version == "v4":
+        return split_text_file_v4(file_path, output_folder, base_name, *params, encoding_name, stream,
+                                  packed=packed, balanced=balanced, progress=progress, dedup=dedup)
+    if version == "v2":
+        return split_text_file_v2(file_path, output_folder, base_name, *params, encoding_name, stream,
+                                  chapter_patterns, workers, packed, balanced, progress, dedup)
+    return split_text_file_v3(file_path, output_folder, base_name, *params, encoding_name, stream,
+                              chapter_patterns, workers, packed, balanced, progress, dedup)
+
+
+def split_text(text: str, output_folder: str, base_name: str = "text", **options):
+    """对内存中的文本分块（先写入临时文件），参数同 split_file"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"{base_name}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return split_file(path, output_folder, base_name=base_name, **options)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="猫仔文本分割器",
+        description="长文本分块工具。不带参数运行时打开图形界面。",
+    )
+    parser.add_argument("inputs", nargs="+",
+                        help="要分块的文本文件、文件夹或通配符（多个文件时并行批量处理），- 表示从标准输入读取")
+    parser.add_argument("-m", "--mode", default="A", type=str.upper, choices=sorted(SPLIT_MODES), help="分块模式：A=Token 分块，B=章节分块，C=章节段落混合，D=内容定义分块（默认 A）")
+    parser.add_argument("-o", "--output", help="输出目录（默认 OUT/<时间戳>_<文件名>，批量时为 OUT/<时间戳>_batch）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="模式 A/C/D 的目标 Token 大小")
+    parser.add_argument("--overlap", type=float, default=DEFAULT_OVERLAP_RATE, help="模式 A/C/D 的重叠率 [0, 1)")
+    parser.add_argument("--min-ratio", type=float, default=DEFAULT_MIN_CHUNK_RATIO, help="模式 A/C/D 的最小区块比例 (0, 1]")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS, help="模式 B 和语料模式的最大 Token 上限")
+    parser.add_argument("--encoding", default=DEFAULT_ENCODING, help="分词器：tiktoken 编码名或 tokenizer.json 路径")
+    parser.add_argument("--stream", action="store_true", help="流式处理（超大文件）")
+    parser.add_argument("--chapter-pattern", action="append", dest="chapter_patterns",
+                        help="追加的章节标题正则，可重复指定（模式 B/C）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="并行进程/线程数（1 为单进程）")
+    parser.add_argument("--name", help="输出文件名前缀（默认取输入文件名，标准输入为 stdin）")
+    parser.add_argument("--packed", action="store_true",
+                        help="把区块打包为一个 .pack 归档（附 .idx 偏移索引），不生成大量小文件")
+    parser.add_argument("--balanced", action="store_true",
+                        help="均衡分块：用动态规划选切点，使各块大小尽量一致，并输出区块大小分布（不能与 --stream 同用）")
+    parser.add_argument("--dedup", action="store_true",
+                        help="检测完全重复和近似重复（MinHash）的区块，记入区块清单")
+    parser.add_argument("--dedup-paragraphs", action="store_true",
+                        help="同 --dedup，并统计反复出现的段落（作者的话、广告等）")
+    parser.add_argument("--context", type=int, dest="context_tokens",
+                        help="自动调参：目标模型的上下文长度（tokens），按它选择区块大小和最小区块比例")
+    parser.add_argument("--prompt-tokens", type=int, default=0, help="自动调参时每次请求中提示词占用的 tokens")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help=f"自动调参时让区块数为此并发数的整数倍（默认 {DEFAULT_POOL_SIZE}，与猫仔多文伴侣一致）")
+    parser.add_argument("--plan", action="store_true",
+                        help="只规划不写区块：打印区块大小分布和直方图；索引会保存下来，换参数再规划只需几毫秒")
+    parser.add_argument("--index-dir", help="规划索引的保存目录（默认 OUT/plan_index）")
+    parser.add_argument("--estimate", action="store_true",
+                        help="只快速估算 token 数和区块数（按字符类别计数、抽样校准，附误差上界），不编码全文、不分块")
+    parser.add_argument("--export", action="store_true",
+                        help="把输入的 .pack 归档导出为散文件（默认导出到归档所在目录）")
+    parser.add_argument("--corpus", action="store_true",
+                        help="语料模式：把输入的许多小文件装箱合并成不超过 --max-tokens 的区块（给定 --context 时"
+                             "为上下文减提示词），每篇前加分隔行，区块清单记录各篇位置")
+    return parser
+
+
+def cli_main(argv: List[str]) -> int:
+    args = build_arg_parser().parse_args(argv)
+    options = dict(
+        mode=args.mode, chunk_size=args.chunk_size, overlap_rate=args.overlap, min_chunk_ratio=args.min_ratio,
+        max_tokens=args.max_tokens, encoding_name=args.encoding, stream=args.stream,
+        chapter_patterns=args.chapter_patterns, workers=args.workers, packed=args.packed,
+        balanced=args.balanced, dedup=args.dedup, dedup_paragraphs=args.dedup_paragraphs,
+        context_tokens=args.context_tokens, prompt_tokens=args.prompt_tokens, pool_size=args.pool_size,
+    )
+    if args.export:
+        return _cli_export(args.inputs, args.output)
+    if args.estimate:
+        return _cli_estimate(args.inputs, args)
+    if args.plan:
+        return _cli_plan(args.inputs, args)
+    if args.corpus:
+        return _cli_corpus(args.inputs, args)
+    inputs = args.inputs if "-" in args.inputs else expand_inputs(args.inputs)
+    if not inputs:
+        print("没有找到要处理的文件", file=sys.stderr)
+        return 1
+    if len(inputs) > 1 and "-" not in inputs:
+        return _cli_batch(inputs, args, options)
+
+    failed = 0
+    for path in inputs:
+        base_name = args.name or ("stdin" if path == "-" else os.path.splitext(os.path.basename(path))[0])
+        output = args.output
+        if not output:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output = os.path.join(create_output_folders(), f"{timestamp}_{base_name}")
+        try:
+            if path == "-":
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    tmp_path = os.path.join(tmp_dir, f"{base_name}.txt")
+                    with open(tmp_path, 'wb') as f:
+                        shutil.copyfileobj(sys.stdin.buffer, f)
+                    chunks_dir, total_chunks = split_file(tmp_path, output, base_name=base_name, **options)
+            else:
+                chunks_dir, total_chunks = split_file(path, output, base_name=base_name, **options)
+            print(f"{path}: {total_chunks} 个区块 -> {chunks_dir}")
+            if args.context_tokens:
+                print(format_tuning(read_tuning_report(output, base_name)))
+            if args.balanced:
+                print(format_size_report(read_size_report(output, base_name)))
+            if args.dedup or args.dedup_paragraphs:
+                print(format_duplicate_report(read_duplicate_report(output, base_name)))
+        except Exception as e:
+            print(f"{path}: 分块失败：{e}", file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
+
+
+def _cli_batch(files: List[str], args, options) -> int:
+    output = args.output or os.path.join(create_output_folders(),
+                                         f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_batch")
+    options.pop("workers")
+
+    def progress(done, total, record):
+        if record["status"] == "ok":
+            print(f"[{done}/{total}] {record['file']}: {record['chunks']} 个区块")
+        else:
+            print(f"[{done}/{total}] {record['file']}: 分块失败：{record['error']}", file=sys.stderr)
+
+    manifest = split_batch(files, output, workers=args.workers, progress=progress, **options)
+    totals = manifest["totals"]
+    print(f"完成 {totals['succeeded']}/{totals['files']} 个文件，共 {totals['chunks']} 个区块、"
+          f"{totals['total_tokens']:,} tokens，用时 {manifest['elapsed_seconds']:.1f}s")
+    print(f"清单: {os.path.join(output, BATCH_MANIFEST_NAME)}")
+    return 1 if totals["failed"] else 0
+
+
+def _cli_corpus(inputs: List[str], args) -> int:
+    output = args.output or os.path.join(create_output_folders(),
+                                         f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{CORPUS_BASE_NAME}")
+    max_tokens = args.context_tokens - args.prompt_tokens if args.context_tokens else args.max_tokens
+    try:
+        if max_tokens <= 0:
+            raise ValueError("最大 Token 数必须 > 0")
+        chunks_dir, total_chunks = pack_corpus(inputs, output, max_tokens, args.encoding, packed=args.packed,
+                                               dedup=args.dedup, dedup_paragraphs=args.dedup_paragraphs)
+    except Exception as e:
+        print(f"语料打包失败：{e}", file=sys.stderr)
+        return 1
+    metadata = read_corpus_metadata(output)
+    print(f"{metadata['documents']} 篇文档（{metadata['total_tokens']:,} tokens）合并为 {total_chunks} 个区块 -> {chunks_dir}")
+    for record in metadata['failed']:
+        print(f"{record['file']}: 读取失败：{record['error']}", file=sys.stderr)
+    if args.dedup or args.dedup_paragraphs:
+        print(format_duplicate_report(read_duplicate_report(output, CORPUS_BASE_NAME)))
+    return 1 if metadata['failed'] else 0
+
+
+def _cli_export(inputs: List[str], output: str = None) -> int:
+    archives = expand_inputs(inputs, f"*{CHUNK_ARCHIVE_EXT}")
+    if not archives:
+        print("没有找到要导出的归档", file=sys.stderr)
+        return 1
+    failed = 0
+    for path in archives:
+        folder = output or os.path.dirname(os.path.abspath(path))
+        try:
+            count = export_chunk_archive(path, folder)
+            print(f"{path}: 导出 {count} 个区块 -> {folder}")
+        except Exception as e:
+            print(f"{path}: 导出失败：{e}", file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
+
+
+def _cli_estimate(inputs: List[str], args) -> int:
+    files = expand_inputs(inputs)
+    if not files or "-" in files:
+        print("估算需要指定文件（不支持标准输入）", file=sys.stderr)
+        return 1
+    failed = 0
+    for path in files:
+        try:
+            version, params = validate_split_params(args.mode, args.chunk_size, args.overlap, args.min_ratio,
+                                                    args.max_tokens)
+            estimate = estimate_file_tokens(path, args.encoding)
+            print(f"{path}: {format_token_estimate(estimate)}，{estimate['chars']:,} 字，"
+                  f"模式 {args.mode} 约 {rough_chunk_count(estimate['tokens'], version, params):,} 个区块"
+                  f"（用时 {estimate['seconds']:.2f}s）")
+        except Exception as e:
+            print(f"{path}: 估算失败：{e}", file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
+
+
+def _cli_plan(inputs: List[str], args) -> int:
+    files = expand_inputs(inputs)
+    if not files or "-" in files:
+        print("规划需要指定文件（不支持标准输入）", file=sys.stderr)
+        return 1
+    failed = 0
+    for path in files:
+        try:
+            if args.context_tokens:
+                tuning = tune_split_params(path, args.context_tokens, args.prompt_tokens, args.mode, args.pool_size,
+                                           args.overlap, args.min_ratio, args.encoding, args.chapter_patterns,
+                                           args.balanced, args.index_dir)
+                print(f"{path}: {format_tuning(tuning)}")
+                print(format_size_histogram(tuning['histogram']))
+                continue
+            plan = plan_file(path, args.mode, args.chunk_size, args.overlap, args.min_ratio, args.max_tokens,
+                             args.encoding, args.chapter_patterns, args.balanced, args.index_dir)
+            print(f"{path}: 模式 {args.mode}，{plan['size_report']['chunks']} 个区块")
+            print(format_plan(plan))
+        except Exception as e:
+            print(f"{path}: 规划失败：{e}", file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
 
 
 # ================== GUI 主程序 ==================
+tk = ttk = filedialog = messagebox = None  # 由 _import_tk() 在启动 GUI 时导入
+
+
+def _import_tk():
+    """GUI 用到时才导入 tkinter，命令行和函数接口不依赖它"""
+    global tk, ttk, filedialog, messagebox
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
+
+
 class UnifiedSplitGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("猫仔文本分割器V2.0")
-        self.root.geometry("520x520")  # 增加高度以容纳标题和副标题
+        self.root.geometry("520x780")  # 增加高度以容纳标题、副标题、分词器设置和进度条
         self.root.resizable(False, False)
 
         self.file_path = None
         self.mode = tk.StringVar(value="v1")  # "v1" 或 "v2"
+        self.total_tokens = None
+        self.count_job = 0             # 每次选择文件加一，旧的统计线程发现编号变了就退出
+        self.cancel_event = threading.Event()  # 取消标志，分块线程在下一个区块写出前检查
+        self.ui_queue = queue.Queue()  # 后台线程只往这里放 (回调, 参数)，由主线程取出执行
+        self.worker = None
+        self.last_progress_time = 0
+        self.task_started = 0
+        self.expected_chunks = None    # 按 token 总数粗估的区块数，用于进度条和剩余时间
 
         # 使用 grid 布局
         self.root.grid_rowconfigure(0, weight=1)
@@ -441,8 +3174,12 @@ class UnifiedSplitGUI:
 
         # 文件选择
         tk.Label(root, text="请选择要分块的文本文件：").grid(row=2, column=0, sticky='w', padx=20, pady=(15, 5))
-        self.btn_select = tk.Button(root, text="选择文件", command=self.select_file, width=15)
-        self.btn_select.grid(row=3, column=0, sticky='w', padx=20, pady=5)
+        select_frame = tk.Frame(root)
+        select_frame.grid(row=3, column=0, sticky='w', padx=20, pady=5)
+        self.btn_select = tk.Button(select_frame, text="选择文件", command=self.select_file, width=15)
+        self.btn_select.pack(side='left')
+        self.btn_select_folder = tk.Button(select_frame, text="选择文件夹（批量）", command=self.select_folder, width=18)
+        self.btn_select_folder.pack(side='left', padx=(10, 0))
 
         # 文件名标签（可换行）
         self.label_file = tk.Label(root, text="未选择文件", fg="gray", wraplength=480, justify='left')
@@ -459,16 +3196,62 @@ class UnifiedSplitGUI:
         tk.Radiobutton(mode_frame, text="模式 A：Token 精细分块（保留句子边界）", variable=self.mode, value="v1", command=self.toggle_mode).pack(anchor='w')
         tk.Radiobutton(mode_frame, text="模式 B：按章节分块（保持章节完整）", variable=self.mode, value="v2", command=self.toggle_mode).pack(anchor='w')
         tk.Radiobutton(mode_frame, text="模式 C：章节段落混合模式（先章节后Token细分）", variable=self.mode, value="v3", command=self.toggle_mode).pack(anchor='w')
+        tk.Radiobutton(mode_frame, text="模式 D：内容定义分块（局部改动只影响附近区块）", variable=self.mode, value="v4", command=self.toggle_mode).pack(anchor='w')
+
+        # 分词器（tiktoken 编码名或本地 tokenizer.json 路径）
+        tokenizer_frame = tk.Frame(root)
+        tokenizer_frame.grid(row=8, column=0, sticky='w', padx=20, pady=(5, 0))
+        tk.Label(tokenizer_frame, text="分词器:").grid(row=0, column=0, sticky='e', padx=5, pady=3)
+        self.entry_encoding = tk.Entry(tokenizer_frame, width=24)
+        self.entry_encoding.insert(0, DEFAULT_ENCODING)
+        self.entry_encoding.grid(row=0, column=1, padx=5, pady=3)
+        self.stream_mode = tk.BooleanVar(value=False)
+        tk.Checkbutton(tokenizer_frame, text="流式处理（超大文件）", variable=self.stream_mode).grid(row=0, column=2, padx=5, pady=3)
+        self.packed_mode = tk.BooleanVar(value=False)
+        tk.Checkbutton(tokenizer_frame, text="打包输出（.pack 归档）", variable=self.packed_mode).grid(row=1, column=2, sticky='w', padx=5, pady=3)
+        self.balanced_mode = tk.BooleanVar(value=False)
+        tk.Checkbutton(tokenizer_frame, text="均衡分块（各块大小尽量一致）", variable=self.balanced_mode).grid(row=2, column=2, sticky='w', padx=5, pady=3)
+        self.dedup_mode = tk.BooleanVar(value=False)
+        tk.Checkbutton(tokenizer_frame, text="标记重复区块（含重复段落）", variable=self.dedup_mode).grid(row=3, column=2, sticky='w', padx=5, pady=3)
+        self.corpus_mode = tk.BooleanVar(value=False)
+        tk.Checkbutton(tokenizer_frame, text="合并小文件（文件夹语料模式）", variable=self.corpus_mode).grid(row=4, column=2, sticky='w', padx=5, pady=3)
 
         # 参数容器
         self.param_frame = tk.Frame(root)
-        self.param_frame.grid(row=8, column=0, sticky='w', padx=20, pady=10)
+        self.param_frame.grid(row=9, column=0, sticky='w', padx=20, pady=10)
 
         self.create_v1_params()
 
-        # 开始按钮（始终存在）
-        self.btn_start = tk.Button(root, text="开始分块", command=self.start_split, state='disabled', width=15)
-        self.btn_start.grid(row=9, column=0, sticky='w', padx=20, pady=15)
+        # 开始 / 取消按钮（始终存在）
+        button_frame = tk.Frame(root)
+        button_frame.grid(row=10, column=0, sticky='w', padx=20, pady=(15, 5))
+        self.btn_start = tk.Button(button_frame, text="开始分块", command=self.start_split, state='disabled', width=15)
+        self.btn_start.pack(side='left')
+        self.btn_cancel = tk.Button(button_frame, text="取消", command=self.cancel_split, state='disabled', width=10)
+        self.btn_cancel.pack(side='left', padx=(10, 0))
+
+        # 进度条（按已写出的区块数）
+        self.progress_var = tk.DoubleVar(value=0)
+        self.progress_bar = ttk.Progressbar(root, variable=self.progress_var, maximum=100, length=480)
+        self.progress_bar.grid(row=11, column=0, sticky='w', padx=20, pady=(5, 2))
+        self.label_progress = tk.Label(root, text="", fg="gray")
+        self.label_progress.grid(row=12, column=0, sticky='w', padx=20, pady=(0, 10))
+
+        self.root.after(UI_POLL_MS, self._poll_ui_queue)
+
+    def post_to_ui(self, callback, *args):
+        """后台线程调用：把界面更新交给主线程执行（Tk 控件和变量只能在主线程里访问）"""
+        self.ui_queue.put((callback, args))
+
+    def _poll_ui_queue(self):
+        try:
+            while True:
+                callback, args = self.ui_queue.get_nowait()
+                callback(*args)
+        except queue.Empty:
+            pass
+        finally:
+            self.root.after(UI_POLL_MS, self._poll_ui_queue)
 
     def select_file(self):
         path = filedialog.askopenfilename(
@@ -477,43 +3260,88 @@ class UnifiedSplitGUI:
         )
         if path:
             self.file_path = path
-            filename = os.path.basename(path)
+            self.total_tokens = None
+
+            # 超大文件不整篇读入，直接切换到流式处理
+            large = os.path.getsize(path) > STREAM_AUTO_BYTES
+            if large:
+                self.stream_mode.set(True)
+
+            # 更新文件名（允许换行），Token 在后台线程中先估算再统计，界面不会卡住
+            self.label_file.config(text=os.path.basename(path), fg="black")
+            self.label_token.config(text="正在统计 Token…", fg="gray")
+            self.btn_start.config(state='normal')
+            self.count_job += 1
+            threading.Thread(target=self._count_tokens_thread,
+                             args=(path, self.get_encoding_name(), self.count_job, large), daemon=True).start()
+
+    def _count_tokens_thread(self, path, encoding_name, job, large):
+        """后台统计 Token：先快速估算（见 estimate_file_tokens）立即显示；
+        超大文件到此为止，精确数在分块时统计，其余文件再按块读取、逐块累加出精确数"""
+        def show(text, fg, file_fg="black", total=None):
+            if job != self.count_job:  # 已经选择了别的文件
+                return
+            self.total_tokens = total
+            self.label_file.config(fg=file_fg)
+            self.label_token.config(text=text, fg=fg)
 
+        try:
+            tokenizer = get_tokenizer(encoding_name)
+        except Exception as e:
+            self.post_to_ui(show, f"Token 计算失败: {e}", "orange")
+            return
+        try:
+            estimate = estimate_file_tokens(path, encoding_name)
+        except Exception as e:
+            # 仍启用按钮，便于重试或强制处理
+            self.post_to_ui(show, f"文件读取失败: {e}", "red", "red")
+            return
+        if job != self.count_job:
+            return
+        if large:
+            self.post_to_ui(show, f"{format_token_estimate(estimate)}，已启用流式处理", "black", "black",
+                            estimate['tokens'])
+            return
+        self.post_to_ui(show, f"{format_token_estimate(estimate)}，正在精确统计…", "gray", "black",
+                        estimate['tokens'])
+        total = 0
+        last_update = time.monotonic()
+        try:
             try:
-                encodings = ['utf-8', 'gbk', 'shift_jis', 'utf-16', 'latin1']
-                text = None
-                for encoding in encodings:
-                    try:
-                        with open(path, 'r', encoding=encoding) as f:
-                            text = f.read()
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                if text is None:
-                    raise ValueError("无法用任何支持的编码读取文件")
-
-                # 更新文件名（允许换行）
-                self.label_file.config(text=filename, fg="black")
-
-                # 尝试计算 token
-                try:
-                    total_tokens = count_tokens(text)
-                    self.label_token.config(text=f"总 Token 数量: {total_tokens:,}", fg="black")
-                except Exception as e:
-                    self.label_token.config(text=f"Token 计算失败: {e}", fg="orange")
+                for block in iter_text_blocks(path, detect_file_encoding(path)):
+                    if job != self.count_job:
+                        return
+                    total += tokenizer.count(block)
+                    if time.monotonic() - last_update >= 0.2:
+                        last_update = time.monotonic()
+                        self.post_to_ui(show, f"约 {estimate['tokens']:,} tokens，正在精确统计: {total:,} …",
+                                        "gray", "black", estimate['tokens'])
+            except UnicodeDecodeError:
+                # 探测的编码中途解码失败，改为整篇读取（read_text_file 会换用其他编码）
+                total = tokenizer.count(read_text_file(path)[0])
+        except Exception as e:
+            # 仍启用按钮，便于重试或强制处理
+            self.post_to_ui(show, f"文件读取失败: {e}", "red", "red")
+            return
+        self.post_to_ui(show, f"总 Token 数量: {total:,}", "black", "black", total)
 
-                self.btn_start.config(state='normal')
+    def select_folder(self):
+        path = filedialog.askdirectory(title="请选择要批量处理的文件夹")
+        if path:
+            self.file_path = path
+            count = len(expand_inputs([path]))
+            self.label_file.config(text=f"文件夹: {os.path.basename(path) or path}", fg="black")
+            self.label_token.config(text=f"共 {count} 个 txt 文件（含子文件夹），将并行批量处理", fg="black")
+            self.btn_start.config(state='normal' if count else 'disabled')
 
-            except Exception as e:
-                self.label_file.config(text=filename, fg="red")
-                self.label_token.config(text=f"文件读取失败: {e}", fg="red")
-                self.btn_start.config(state='normal')  # 仍启用按钮，便于重试或强制处理
+    def get_encoding_name(self):
+        return self.entry_encoding.get().strip() or DEFAULT_ENCODING
 
     def toggle_mode(self):
         for widget in self.param_frame.winfo_children():
             widget.destroy()
         mode = self.mode.get()
-        if mode == "v1":
+        if mode in ("v1", "v4"):
             self.create_v1_params()
         elif mode == "v2":
             self.create_v2_params()
@@ -536,13 +3364,31 @@ class UnifiedSplitGUI:
         self.entry_min_ratio = tk.Entry(frame, width=12)
         self.entry_min_ratio.insert(0, str(DEFAULT_MIN_CHUNK_RATIO))
         self.entry_min_ratio.grid(row=2, column=1, padx=5, pady=3)
+        self.create_auto_params(frame, 3)
 
     def create_v2_params(self):
         frame = self.param_frame
         tk.Label(frame, text="最大 Token 上限:").grid(row=0, column=0, sticky='e', padx=5, pady=3)
         self.entry_max_tok = tk.Entry(frame, width=12)
-        self.entry_max_tok.insert(0, "5000")
+        self.entry_max_tok.insert(0, str(DEFAULT_MAX_TOKENS))
         self.entry_max_tok.grid(row=0, column=1, padx=5, pady=3)
+        self.create_auto_params(frame, 1)
+
+    def create_auto_params(self, frame, row):
+        """自动调参：填写模型上下文后，分块前按上下文和并发数自动选择区块大小（留空则使用上面的参数）"""
+        tk.Label(frame, text="模型上下文（自动调参）:").grid(row=row, column=0, sticky='e', padx=5, pady=3)
+        self.entry_context = tk.Entry(frame, width=12)
+        self.entry_context.grid(row=row, column=1, padx=5, pady=3)
+        auto_frame = tk.Frame(frame)
+        auto_frame.grid(row=row + 1, column=0, columnspan=2, sticky='e')
+        tk.Label(auto_frame, text="提示词 tokens:").pack(side=tk.LEFT, padx=5)
+        self.entry_prompt = tk.Entry(auto_frame, width=8)
+        self.entry_prompt.insert(0, "0")
+        self.entry_prompt.pack(side=tk.LEFT, padx=5)
+        tk.Label(auto_frame, text="并发数:").pack(side=tk.LEFT, padx=5)
+        self.entry_pool = tk.Entry(auto_frame, width=6)
+        self.entry_pool.insert(0, str(DEFAULT_POOL_SIZE))
+        self.entry_pool.pack(side=tk.LEFT, padx=5)
     
     def create_v3_params(self):
         """模式C参数界面：包含目标Token大小 + 模式A的所有参数"""
@@ -561,38 +3407,48 @@ class UnifiedSplitGUI:
         self.entry_min_ratio = tk.Entry(frame, width=12)
         self.entry_min_ratio.insert(0, str(DEFAULT_MIN_CHUNK_RATIO))
         self.entry_min_ratio.grid(row=2, column=1, padx=5, pady=3)
+        self.create_auto_params(frame, 3)
 
     def validate_inputs(self):
         mode = self.mode.get()
-        if mode == "v1" or mode == "v3":
-            try:
-                chunk = int(self.entry_chunk.get())
-                overlap = float(self.entry_overlap.get())
-                min_ratio = float(self.entry_min_ratio.get())
-                if chunk <= 0:
-                    raise ValueError("Chunk size 必须 > 0")
-                if not (0 <= overlap < 1):
-                    raise ValueError("重叠率应在 [0, 1) 范围内")
-                if not (0 < min_ratio <= 1):
-                    raise ValueError("最小区块比例应在 (0, 1] 范围内")
-                return {"mode": mode, "params": (chunk, overlap, min_ratio)}
-            except ValueError as e:
-                messagebox.showerror("输入错误", f"参数格式错误：{e}")
-                return None
-        elif mode == "v2":
-            try:
-                max_tok = int(self.entry_max_tok.get())
-                if max_tok <= 0:
-                    raise ValueError("最大 Token 数必须 > 0")
-                return {"mode": mode, "params": (max_tok,)}
-            except ValueError as e:
-                messagebox.showerror("输入错误", f"参数格式错误：{e}")
-                return None
+        try:
+            if mode == "v2":
+                _, params = validate_split_params(mode, max_tokens=int(self.entry_max_tok.get()))
+            else:
+                _, params = validate_split_params(mode, int(self.entry_chunk.get()), float(self.entry_overlap.get()),
+                                                  float(self.entry_min_ratio.get()))
+            config = {"mode": mode, "params": params}
+            if self.entry_context.get().strip():
+                context_tokens = int(self.entry_context.get())
+                prompt_tokens = int(self.entry_prompt.get() or 0)
+                if context_tokens <= prompt_tokens:
+                    raise ValueError("模型上下文必须大于提示词 tokens")
+                config["auto"] = {"context_tokens": context_tokens, "prompt_tokens": prompt_tokens,
+                                  "pool_size": max(1, int(self.entry_pool.get()))}
+            return config
+        except ValueError as e:
+            messagebox.showerror("输入错误", f"参数格式错误：{e}")
+            return None
+
+    def split_options(self, config):
+        """界面上的分块参数，转成 split_file / split_batch 的关键字参数"""
+        if config["mode"] == "v2":
+            max_tokens, = config["params"]
+            params = {"max_tokens": max_tokens}
+        else:
+            chunk_size, overlap_rate, min_chunk_ratio = config["params"]
+            params = {"chunk_size": chunk_size, "overlap_rate": overlap_rate, "min_chunk_ratio": min_chunk_ratio}
+        return dict(params, mode=config["mode"], encoding_name=self.get_encoding_name(),
+                    stream=self.stream_mode.get(), packed=self.packed_mode.get(),
+                    balanced=self.balanced_mode.get(), dedup_paragraphs=self.dedup_mode.get(),
+                    **config.get("auto", {}))
 
     def start_split(self):
         if not self.file_path:
             messagebox.showwarning("警告", "请先选择文件！")
             return
+        if self.worker and self.worker.is_alive():
+            return
         config = self.validate_inputs()
         if not config:
             return
@@ -603,56 +3459,225 @@ class UnifiedSplitGUI:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             task_folder = os.path.join(out_dir, f"{timestamp}_{base_name}")
             os.makedirs(task_folder, exist_ok=True)
+        except Exception as e:
+            messagebox.showerror("错误", f"无法创建输出目录：\n{str(e)}")
+            return
 
-            if config["mode"] == "v1":
-                CHUNK_SIZE, OVERLAP_RATE, MIN_CHUNK_RATIO = config["params"]
-                chunks_dir, total_chunks = split_text_file_v1(
-                    self.file_path, task_folder, base_name,
-                    CHUNK_SIZE, OVERLAP_RATE, MIN_CHUNK_RATIO
-                )
-            elif config["mode"] == "v2":
-                max_tokens, = config["params"]
-                chunks_dir, total_chunks = split_text_file_v2(
-                    self.file_path, task_folder, base_name, max_tokens
-                )
-            elif config["mode"] == "v3":
-                max_tokens, overlap_rate, min_chunk_ratio = config["params"]
-                chunks_dir, total_chunks = split_text_file_v3(
-                    self.file_path, task_folder, base_name, max_tokens, overlap_rate, min_chunk_ratio
-                )
-
-            # 自动打开结果文件夹
-            import subprocess
-            import platform
-            try:
-                if platform.system() == 'Windows':
-                    os.startfile(task_folder)
-                elif platform.system() == 'Darwin':  # macOS
-                    subprocess.Popen(['open', task_folder])
-                else:  # Linux
-                    subprocess.Popen(['xdg-open', task_folder])
-            except Exception as open_error:
-                print(f"无法自动打开文件夹：{open_error}")
-
-            messagebox.showinfo("完成", f"✅ 分块成功！\n共 {total_chunks} 个区块\n保存于:\n{task_folder}\n\n结果文件夹已自动打开")
-            
-            # 重置界面，允许继续处理其他文件
-            self.file_path = None
-            self.label_file.config(text="未选择文件", fg="gray")
-            self.label_token.config(text="", fg="gray")
-            self.btn_start.config(state='disabled')
+        options = self.split_options(config)
+        if os.path.isdir(self.file_path):
+            if self.corpus_mode.get():
+                self.run_corpus(options, task_folder)
+            else:
+                self.run_batch(options, task_folder)
+            return
+
+        # 按 Token 总数（精确数或估算值）粗估区块数，作为进度条的总长和剩余时间的依据
+        self.expected_chunks = (rough_chunk_count(self.total_tokens, config["mode"], config["params"])
+                                if self.total_tokens and "auto" not in config else None)
+        self.begin_task(self.expected_chunks or 100)
+        self.worker = threading.Thread(target=self._split_thread,
+                                       args=(self.file_path, task_folder, base_name, options), daemon=True)
+        self.worker.start()
+
+    def begin_task(self, maximum):
+        self.cancel_event.clear()
+        self.task_started = time.monotonic()
+        self.progress_bar.config(maximum=max(1, maximum))
+        self.progress_var.set(0)
+        self.label_progress.config(text="正在分块…", fg="gray")
+        for button in (self.btn_start, self.btn_select, self.btn_select_folder):
+            button.config(state='disabled')
+        self.btn_cancel.config(state='normal')
+
+    def end_task(self):
+        self.cancel_event.clear()
+        self.btn_cancel.config(state='disabled')
+        self.btn_select.config(state='normal')
+        self.btn_select_folder.config(state='normal')
+        self.btn_start.config(state='normal' if self.file_path else 'disabled')
+
+    def cancel_split(self):
+        self.cancel_event.set()
+        self.btn_cancel.config(state='disabled')
+        self.label_progress.config(text="正在取消…（在下一个区块写出前停止）", fg="orange")
+
+    def on_chunk_written(self, written):
+        """分块线程的进度回调：检查取消标志，节流后把进度交给主线程显示"""
+        if self.cancel_event.is_set():
+            raise SplitCancelled()
+        now = time.monotonic()
+        if now - self.last_progress_time >= 0.1:
+            self.last_progress_time = now
+            text = f"已写出 {written:,} 个区块"
+            expected = self.expected_chunks
+            if expected and 0 < written < expected:
+                remaining = (now - self.task_started) / written * (expected - written)
+                text = f"已写出 {written:,} / 约 {expected:,} 个区块，预计还需 {format_duration(remaining)}"
+            self.post_to_ui(self.show_progress, written, text)
+
+    def show_progress(self, done, text):
+        if self.cancel_event.is_set():
+            return
+        if done > self.progress_bar['maximum']:
+            self.progress_bar.config(maximum=done)
+        self.progress_var.set(done)
+        self.label_progress.config(text=text, fg="gray")
 
+    def _split_thread(self, file_path, task_folder, base_name, options):
+        try:
+            _, total_chunks = split_file(file_path, task_folder, base_name=base_name,
+                                         progress=self.on_chunk_written, **options)
+        except SplitCancelled:
+            self.post_to_ui(self.split_cancelled, task_folder)
         except Exception as e:
             import traceback
             traceback.print_exc()
-            messagebox.showerror("错误", f"分块失败：\n{str(e)}")
+            self.post_to_ui(self.split_failed, e)
+        else:
+            self.post_to_ui(self.split_finished, task_folder, base_name, total_chunks, options)
 
+    def split_finished(self, task_folder, base_name, total_chunks, options):
+        self.progress_bar.config(maximum=max(1, total_chunks))
+        self.progress_var.set(total_chunks)
+        self.label_progress.config(text=f"完成：共 {total_chunks:,} 个区块", fg="black")
 
-def main():
+        # 自动打开结果文件夹
+        import subprocess
+        import platform
+        try:
+            if platform.system() == 'Windows':
+                os.startfile(task_folder)
+            elif platform.system() == 'Darwin':  # macOS
+                subprocess.Popen(['open', task_folder])
+            else:  # Linux
+                subprocess.Popen(['xdg-open', task_folder])
+        except Exception as open_error:
+            print(f"无法自动打开文件夹：{open_error}")
+
+        message = f"✅ 分块成功！\n共 {total_chunks} 个区块\n保存于:\n{task_folder}\n\n结果文件夹已自动打开"
+        if options["balanced"]:
+            message += "\n\n" + format_size_report(read_size_report(task_folder, base_name))
+        if options["dedup_paragraphs"]:
+            message += "\n\n" + format_duplicate_report(read_duplicate_report(task_folder, base_name))
+        if options.get("context_tokens"):
+            message += "\n\n" + format_tuning(read_tuning_report(task_folder, base_name))
+        messagebox.showinfo("完成", message)
+
+        # 重置界面，允许继续处理其他文件
+        self.reset_selection()
+        self.end_task()
+
+    def split_cancelled(self, task_folder):
+        # 单个文件的输出不完整，整个删除
+        shutil.rmtree(task_folder, ignore_errors=True)
+        self.progress_var.set(0)
+        self.label_progress.config(text="已取消", fg="orange")
+        self.end_task()
+
+    def split_failed(self, error):
+        self.label_progress.config(text="分块失败", fg="red")
+        self.end_task()
+        messagebox.showerror("错误", f"分块失败：\n{str(error)}")
+
+    def reset_selection(self):
+        self.file_path = None
+        self.total_tokens = None
+        self.count_job += 1
+        self.label_file.config(text="未选择文件", fg="gray")
+        self.label_token.config(text="", fg="gray")
+
+    def run_batch(self, options, task_folder):
+        self.begin_task(len(expand_inputs([self.file_path])))
+        self.worker = threading.Thread(target=self._batch_thread, args=(self.file_path, task_folder, options),
+                                       daemon=True)
+        self.worker.start()
+
+    def _batch_thread(self, folder, task_folder, options):
+        def progress(done, total, record):
+            if self.cancel_event.is_set():
+                raise SplitCancelled()
+            self.post_to_ui(self.show_progress, done,
+                            f"批量处理中: {done}/{total}  {os.path.basename(record['file'])}")
+
+        try:
+            manifest = split_batch([folder], task_folder, progress=progress, **options)
+        except SplitCancelled:
+            self.post_to_ui(self.batch_cancelled, task_folder)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.post_to_ui(self.split_failed, e)
+        else:
+            self.post_to_ui(self.batch_finished, task_folder, manifest)
+
+    def batch_finished(self, task_folder, manifest):
+        totals = manifest["totals"]
+        failed = [r for r in manifest["files"] if r["status"] != "ok"]
+        self.label_progress.config(text=f"完成：{totals['succeeded']}/{totals['files']} 个文件", fg="black")
+        message = (f"✅ 批量分块完成：{totals['succeeded']}/{totals['files']} 个文件\n"
+                   f"共 {totals['chunks']} 个区块，{totals['total_tokens']:,} tokens\n保存于:\n{task_folder}")
+        if failed:
+            message += "\n\n失败的文件：\n" + "\n".join(f"{os.path.basename(r['file'])}: {r['error']}" for r in failed[:10])
+        messagebox.showinfo("完成", message)
+        self.reset_selection()
+        self.end_task()
+
+    def run_corpus(self, options, task_folder):
+        # 区块上限：自动调参时为上下文减提示词，否则取当前模式的目标大小（模式 B 为最大 Token 上限）
+        if options.get("context_tokens"):
+            max_tokens = options["context_tokens"] - options["prompt_tokens"]
+        else:
+            max_tokens = options.get("chunk_size") or options["max_tokens"]
+        self.expected_chunks = None
+        self.begin_task(100)
+        self.worker = threading.Thread(target=self._corpus_thread,
+                                       args=(self.file_path, task_folder, max_tokens, options), daemon=True)
+        self.worker.start()
+
+    def _corpus_thread(self, folder, task_folder, max_tokens, options):
+        try:
+            _, total_chunks = pack_corpus([folder], task_folder, max_tokens, options["encoding_name"],
+                                          packed=options["packed"], dedup_paragraphs=options["dedup_paragraphs"],
+                                          progress=self.on_chunk_written)
+        except SplitCancelled:
+            self.post_to_ui(self.split_cancelled, task_folder)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.post_to_ui(self.split_failed, e)
+        else:
+            self.post_to_ui(self.corpus_finished, task_folder, total_chunks)
+
+    def corpus_finished(self, task_folder, total_chunks):
+        metadata = read_corpus_metadata(task_folder)
+        self.progress_bar.config(maximum=max(1, total_chunks))
+        self.progress_var.set(total_chunks)
+        self.label_progress.config(text=f"完成：{metadata['documents']} 篇文档合并为 {total_chunks:,} 个区块", fg="black")
+        message = (f"✅ 语料打包完成：{metadata['documents']} 篇文档（{metadata['total_tokens']:,} tokens）\n"
+                   f"合并为 {total_chunks} 个区块\n保存于:\n{task_folder}")
+        if metadata['failed']:
+            message += "\n\n读取失败的文件：\n" + "\n".join(
+                f"{os.path.basename(r['file'])}: {r['error']}" for r in metadata['failed'][:10])
+        messagebox.showinfo("完成", message)
+        self.reset_selection()
+        self.end_task()
+
+    def batch_cancelled(self, task_folder):
+        # 已完成的书各自完整，保留下来；不再生成清单
+        self.label_progress.config(text="已取消（已完成的文件保留在输出目录）", fg="orange")
+        self.end_task()
+        messagebox.showinfo("已取消", f"批量分块已取消\n已完成的文件保留在:\n{task_folder}")
+
+
+def main(argv: List[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return cli_main(argv)
+    _import_tk()
     root = tk.Tk()
     app = UnifiedSplitGUI(root)
     root.mainloop()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -188,6 +188,25 @@ if %errorLevel% == 0 (
 
 echo.
 
+:: 检测 httpx（可选，多文伴侣的异步引擎使用）
+echo [检测] 正在检查 httpx 库（异步引擎，可选）...
+python -c "import httpx, h2" >nul 2>&1
+if %errorLevel% == 0 (
+    echo [✓] httpx 库已安装
+) else (
+    echo [!] httpx 库未安装
+    echo [安装] 正在安装 httpx[http2]...
+    python -m pip install "httpx[http2]" -i https://pypi.tuna.tsinghua.edu.cn/simple
+    rem 括号块内的 %errorLevel% 在解析整块时就已展开，这里用 if errorlevel 取 pip 的实际结果
+    if errorlevel 1 (
+        echo [!] httpx 安装失败，多文伴侣的异步引擎不可用，其余功能不受影响
+    ) else (
+        echo [✓] httpx 安装成功
+    )
+)
+
+echo.
+
 :: 检测tkinter（Python自带，但有时会缺失）
 echo [检测] 正在检查 tkinter 库（GUI支持）...
 python -c "import tkinter" >nul 2>&1